@@ -1,17 +1,27 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from utils import InternalLogicException, UserInputException, try_cast, ticker_exists, get_data_for_stock, get_today
+from utils import InternalLogicException, UserInputException, try_cast, get_today, get_start_date_for_bars
+from instrumentation import run_metrics
+from stock_data import stock_data_store
+from model_state import model_state_store
+from figure_rendering import render_market_figure
+from sheet_parsing import SheetSchema, ColumnSchema, TEXT, CURRENCY, PERCENTAGE, NUMBER, DATE, parse_sheet, get_sheet_frame, get_user_error_message
+from storage import StorageBackend, GspreadBackend, WorksheetNotFoundException, StorageAPIException, format_cell_reference
 from model import LumpSumModel, NUMBER_OF_STOCK_DAYS_IN_YEAR
 from enum import Enum
-from datetime import datetime, timedelta
+from datetime import timedelta
+import os
 import math
 import pandas as pd
 
 database_spreadsheet_id = '19IjGW4jdqqzrNAO7mFsO5e43WcwMTL4nIGvUqlcwp4A'
-SCOPE = ['https://www.googleapis.com/auth/spreadsheets']
 LAST_DATE_SUCCESS_COLUMN = 4
 NUM_CURRENT_DAY_FAILURES_COLUMN = 5
 ORDER_FULFILLMENT_WAIT_TIME_DAYS = 10
+ORDERS_ARCHIVE_WORKSHEET_NAME = 'Orders Archive'
+# Fulfilled orders older than this many days are moved out of the Orders sheet, which keeps its size (and the per-run reads
+# of it) bounded no matter how long the user has been subscribed.
+ORDER_ARCHIVE_HORIZON_DAYS = int(os.environ.get('FINZ_ORDER_ARCHIVE_HORIZON_DAYS', '90'))
+# Archiving rewrites the Orders sheet, so it waits until at least this many orders can be moved at once.
+ORDER_ARCHIVE_MIN_ORDERS = 20
 
 class InvestmentInputSchedules(Enum):
     MONDAYS = 1
@@ -28,33 +38,62 @@ investment_input_schedules_spreadsheet_to_enum = {
     'Weekly on Fridays': InvestmentInputSchedules.FRIDAYS,
 }
 
+STOCKS_SCHEMA = SheetSchema([
+    ColumnSchema('Stock', TEXT, duplicate_message='Some tickers appears multiple times in the "Stock" sheet. This will lead to undefined behavior.'),
+    ColumnSchema('Current Balance', CURRENCY, format_message='Some "Current Balance" does not start with a "$".', invalid_message='"Balance" or "Percentage to Input" is not a valid for some rows.', negative_message='Balance less than 0 for some stock.'),
+    ColumnSchema('Percentage to Input', PERCENTAGE, format_message='Some "Percentage to Input" does not end with a "%".', invalid_message='"Balance" or "Percentage to Input" is not a valid for some rows.', negative_message='Investment input percentage less than 0 for some stock.'),
+], missing_columns_message='Could not find column name "Stock", "Current Balance", or "Percentage to Input".', key_column='Stock')
+
+INVESTMENT_SCHEDULE_SCHEMA = SheetSchema([
+    ColumnSchema('Investment Frequency', TEXT, duplicate_message='Some investment frequencies appears multiple times in the "Investment Schedule" sheet.', allowed_values=investment_input_schedules_spreadsheet_to_enum, allowed_values_message=f'Some "Investment Frequency" is valid from possibilities ({", ".join(investment_input_schedules_spreadsheet_to_enum.keys())}).'),
+    ColumnSchema('Amount', CURRENCY, format_message='Some "Amount" does not start with a "$".', invalid_message='"Amount" is not a valid for some rows.', negative_message='Amount less than 0 for some stock.'),
+], missing_columns_message='Could not find column name "Investment Frequency" or "Amount".', key_column='Investment Frequency')
+
+ORDERS_SCHEMA = SheetSchema([
+    ColumnSchema('Date', DATE, invalid_message='"Date" is not a valid for some rows. Ensure format is "YYYY-MM-DD".'),
+    ColumnSchema('Stock', TEXT),
+    ColumnSchema('Amount', NUMBER, invalid_message='"Amount" or "Limit Price" is not a valid for some rows.'),
+    ColumnSchema('Limit Price', CURRENCY, format_message='Some "Limit Price" does not start with a "$".', invalid_message='"Amount" or "Limit Price" is not a valid for some rows.'),
+    ColumnSchema('Fulfilled?', TEXT),
+], missing_columns_message='Could not find column name "Date", "Stock", "Amount", "Limit Price", or "Fulfilled?".')
+
+def get_orders_sheet_values(orders_data):
+    return [[str(value) if column == 'Date' else value for column, value in zip(orders_data.columns, row)] for row in orders_data.values.tolist()]
+
 class Database:
-    def __init__(self):
-        self.google_credentials = ServiceAccountCredentials.from_json_keyfile_name("spreadsheet_creds.json", SCOPE)
-        self.spreadsheet_client = gspread.authorize(self.google_credentials)
-        try:
-            self.database_sheet = self.spreadsheet_client.open_by_key(database_spreadsheet_id).worksheet('Database')
-        except gspread.exceptions.WorksheetNotFound:
-            raise InternalLogicException
-        
+    # When due_date is given, only users that still need to be run on that date are loaded.
+    # With populate_users=False the user sheets are not read here, so they can be loaded later with populate_user (e.g. by the notifier pipeline).
+    def __init__(self, backend: StorageBackend = None, spreadsheet_id: str = database_spreadsheet_id, due_date = None, populate_users = True):
+        with run_metrics.stage('database_load'):
+            self.backend = GspreadBackend() if backend is None else backend
+            try:
+                self.database_sheet = self.backend.open_worksheet(spreadsheet_id, 'Database')
+            except WorksheetNotFoundException:
+                raise InternalLogicException
+
+            if due_date is None:
+                database_data = [(ii + 2, user_row) for ii, user_row in enumerate(self.database_sheet.get_all_records())]
+            else:
+                database_data = self.backend.get_due_user_records(self.database_sheet, due_date)
+
         self.users = []
-        database_data = self.database_sheet.get_all_records()
+        for database_row_index, user_row in database_data:
+            user = User(self.backend, self.database_sheet, database_row_index, user_row)
+            if populate_users:
+                self.populate_user(user)
+            self.users.append(user)
 
-        for ii, user_row in enumerate(database_data):
-            database_row_index = ii + 2
-            user = User(self.database_sheet, database_row_index, user_row)
+    def populate_user(self, user):
+        with run_metrics.scope(user.email):
             try:
                 user.populate_user_data()
             except Exception:
                 if user.user_error_message == '':
                     user.user_error_message = 'Error loading user values from spreadsheet: Something went wrong with no known cause.'
-            self.users.append(user)
 
 class User:
-    def __init__(self, database_sheet, database_row_index, user_row):
-        self.google_credentials = ServiceAccountCredentials.from_json_keyfile_name("spreadsheet_creds.json", SCOPE)
-        self.spreadsheet_client = gspread.authorize(self.google_credentials)
-
+    def __init__(self, backend: StorageBackend, database_sheet, database_row_index, user_row):
+        self.backend = backend
         self.database_sheet = database_sheet
         self.database_row_index = database_row_index
         self.loaded = False
@@ -99,7 +138,7 @@ class User:
                 continue
 
             stock = row['Stock']
-            data = get_data_for_stock(stock, today_datetime)
+            data = stock_data_store.get(stock, today_date, self.get_data_start_date(stock, today_date))
             data_in_fulfillment_window = data[(row['Date'] + timedelta(days=1)):]
             if (data_in_fulfillment_window['Low'] < row['Limit Price']).any():
                 self.orders_data.loc[index, 'Fulfilled?'] = 'Yes'
@@ -112,11 +151,65 @@ class User:
 
         return message_for_unfulfilled_orders
 
+    # Marks open orders placed before today as fulfilled when today's intraday low (per stock) went below the limit price.
+    # Returns the number of orders that were newly marked fulfilled.
+    def update_fulfilled_orders_from_intraday_lows(self, intraday_lows, today_date):
+        number_of_fulfilled_orders = 0
+        for index, row in self.orders_data.iterrows():
+            if row['Fulfilled?'] == 'Yes' or row['Stock'] not in intraday_lows or row['Date'] >= today_date:
+                continue
+            if intraday_lows[row['Stock']] < row['Limit Price']:
+                self.orders_data.loc[index, 'Fulfilled?'] = 'Yes'
+                number_of_fulfilled_orders += 1
+        return number_of_fulfilled_orders
+
     def update_user_sheets(self):
-        self.user_stock_sheet.update(range_name='A1:C', values=[self.stock_data.columns.values.tolist()] + self.stock_data.values.tolist())
-        transformed_orders_data = self.orders_data
-        transformed_orders_data['Date'] = transformed_orders_data['Date'].apply(lambda date: str(date))
-        self.orders_sheet.update(range_name='A1:E', values=[transformed_orders_data.columns.values.tolist()] + transformed_orders_data.values.tolist())
+        with run_metrics.stage('sheet_write_back'):
+            self.user_stock_sheet.update(range_name='A1:C', values=[self.stock_data.columns.values.tolist()] + self.stock_data.values.tolist())
+        self.update_orders_sheet()
+
+    # Only orders whose "Fulfilled?" changed and orders appended since the sheet was read are written (in one request), so the
+    # write does not grow with the order history. Row index + 2 is the sheet row of an order (row 1 is the header).
+    def update_orders_sheet(self):
+        is_written = self.orders_data.index.isin(self.written_orders_fulfilled.index)
+        written_orders_data = self.orders_data[is_written]
+        changed_indices = written_orders_data.index[written_orders_data['Fulfilled?'] != self.written_orders_fulfilled[written_orders_data.index]]
+        fulfilled_column = self.orders_data.columns.get_loc('Fulfilled?') + 1
+        updates = [(format_cell_reference(index + 2, fulfilled_column), [[self.orders_data.loc[index, 'Fulfilled?']]]) for index in changed_indices]
+        new_orders_data = self.orders_data[~is_written]
+        if not new_orders_data.empty:
+            updates.append((format_cell_reference(new_orders_data.index[0] + 2, 1), get_orders_sheet_values(new_orders_data)))
+        if len(updates) > 0:
+            with run_metrics.stage('sheet_write_back'):
+                self.orders_sheet.batch_update(updates)
+        self.set_orders_written()
+
+    def set_orders_written(self):
+        self.written_orders_fulfilled = self.orders_data['Fulfilled?'].copy()
+
+    # Moves fulfilled orders placed more than ORDER_ARCHIVE_HORIZON_DAYS before today_date to the "Orders Archive" worksheet
+    # (created when missing) and rewrites the Orders sheet without them. Expects the Orders sheet to be up to date.
+    # Returns the number of archived orders.
+    def archive_orders(self, today_date):
+        is_archived = (self.orders_data['Fulfilled?'] == 'Yes') & (self.orders_data['Date'] < today_date - timedelta(days=ORDER_ARCHIVE_HORIZON_DAYS))
+        number_of_archived_orders = int(is_archived.sum())
+        if number_of_archived_orders < ORDER_ARCHIVE_MIN_ORDERS:
+            return 0
+
+        remaining_orders_data = self.orders_data[~is_archived].reset_index(drop=True)
+        with run_metrics.stage('sheet_write_back'):
+            try:
+                archive_sheet = self.backend.open_worksheet(self.spreadsheet_id, ORDERS_ARCHIVE_WORKSHEET_NAME)
+            except WorksheetNotFoundException:
+                archive_sheet = self.backend.create_worksheet(self.spreadsheet_id, ORDERS_ARCHIVE_WORKSHEET_NAME, self.orders_data.columns.values.tolist())
+            # Archived first, so that a failure in between can only duplicate orders in the archive and never lose them.
+            archive_sheet.append_rows(get_orders_sheet_values(self.orders_data[is_archived]))
+            self.orders_sheet.update(range_name='A1', values=[remaining_orders_data.columns.values.tolist()] + get_orders_sheet_values(remaining_orders_data))
+            self.orders_sheet.delete_rows(remaining_orders_data.shape[0] + 2, self.orders_data.shape[0] + 1)
+        self.orders_data = remaining_orders_data
+        self.set_orders_written()
+        run_metrics.increment('orders_archived', number_of_archived_orders)
+        return number_of_archived_orders
     
     def get_model_for_stock(self, stock):
         current_balance_list = self.stock_data.loc[self.stock_data['Stock'] == stock, 'Current Balance'].tolist()
@@ -125,9 +218,10 @@ class User:
         model = LumpSumModel(current_balance_list[0])
         return model
 
-    def notify_buy_orders(self):
+    # Charts of the stocks are drawn by the caller from the returned (model, open prices, stock) inputs, so this does no plotting.
+    def compute_buy_orders(self):
         message = ''
-        figures = []
+        chart_inputs = []
         success = True
 
         today_datetime, today_date = get_today()
@@ -136,13 +230,18 @@ class User:
             stock = row['Stock']
             balance = row['Current Balance']
             model = self.get_model_for_stock(stock)
-            data = get_data_for_stock(stock, today_datetime)
+            data = stock_data_store.get(stock, today_date, self.get_data_start_date(stock, today_date))
             open_price = round(data['Open'].iloc[-1], 2)
             stock_today = data.index[-1].date()
             if stock_today != today_date:
                 message += f'Warning: stock date and python date not matching for {stock}. Data might be stale.<br>'
             try:
-                buy_rate = model.analyze_stock(data)
+                with run_metrics.stage('model_evaluation'):
+                    if model.supports_incremental_state():
+                        model_state_store.resume(model, stock, data)
+                        buy_rate = model.analyze_state()
+                    else:
+                        buy_rate = model.analyze_stock(data)
             except Exception as e:
                 print(f'Modeling Error: {str(e)}')
                 message += f'{stock} had a modeling error.<br>'
@@ -155,7 +254,7 @@ class User:
             num_to_buy = math.floor(buy_rate)
             
             message += f'{stock}: Limit buy order {num_to_buy} share(s) at price {open_price}.<br>'
-            figures.append(model.get_market_figure(data['Open'].iloc[-NUMBER_OF_STOCK_DAYS_IN_YEAR:], stock)[0])
+            chart_inputs.append((model, data['Open'].iloc[-NUMBER_OF_STOCK_DAYS_IN_YEAR:], stock))
             
             self.stock_data.loc[index, 'Current Balance'] -= open_price * num_to_buy
             if num_to_buy > 0:
@@ -164,8 +263,35 @@ class User:
                     self.orders_data = pd.concat([order], ignore_index=True)
                 else:
                     self.orders_data = pd.concat([self.orders_data, order], ignore_index=True)
+        return message, chart_inputs, success
+
+    def notify_buy_orders(self):
+        message, chart_inputs, success = self.compute_buy_orders()
+        with run_metrics.stage('figure_rendering'):
+            figures = [render_market_figure(model, open_prices, stock) for model, open_prices, stock in chart_inputs]
         return message, figures, success
 
+    # Earliest date of prices needed for stock: enough bars for its model and the chart, and everything since its oldest open order.
+    # None means the full history (a model without a fixed lookback).
+    def get_data_start_date(self, stock, today_date):
+        number_of_bars = NUMBER_OF_STOCK_DAYS_IN_YEAR
+        model = self.get_model_for_stock(stock)
+        if model is not None:
+            if model.get_lookback_distance() is None:
+                return None
+            number_of_bars = max(number_of_bars, model.get_lookback_distance())
+        start_date = get_start_date_for_bars(today_date, number_of_bars)
+
+        open_order_dates = self.orders_data.loc[(self.orders_data['Fulfilled?'] != 'Yes') & (self.orders_data['Stock'] == stock), 'Date']
+        if not open_order_dates.empty:
+            start_date = min(start_date, open_order_dates.min() + timedelta(days=1))
+        return start_date
+
+    # Tickers whose prices are needed to compute buy orders and check order fulfillment.
+    def get_tickers_to_fetch(self):
+        open_orders = self.orders_data[(self.orders_data['Fulfilled?'] != 'Yes') & (self.orders_data['Stock'] != '')]
+        return list(dict.fromkeys(self.stock_data['Stock'].tolist() + open_orders['Stock'].tolist()))
+
     def populate_user_data(self):
         self.stock_data = pd.DataFrame()
         self.investment_schedule_data = pd.DataFrame()
@@ -173,140 +299,78 @@ class User:
         self.user_error_message = ''
 
         try:
-            self.user_stock_sheet = self.spreadsheet_client.open_by_key(self.spreadsheet_id).worksheet('Stocks')
-            self.investment_schedule_sheet = self.spreadsheet_client.open_by_key(self.spreadsheet_id).worksheet('Investment Schedule')
-            self.orders_sheet = self.spreadsheet_client.open_by_key(self.spreadsheet_id).worksheet('Orders')
+            with run_metrics.stage('sheet_reads'):
+                self.user_stock_sheet = self.backend.open_worksheet(self.spreadsheet_id, 'Stocks')
+                self.investment_schedule_sheet = self.backend.open_worksheet(self.spreadsheet_id, 'Investment Schedule')
+                self.orders_sheet = self.backend.open_worksheet(self.spreadsheet_id, 'Orders')
         except Exception:
             self.user_error_message += 'Error loading user values from spreadsheet: Could not find "Stocks", "Investment Schedule", or "Orders" worksheet (these might need to be renamed).<br>'
             raise UserInputException
         
         try:
-            user_stock_sheet_values = self.user_stock_sheet.get_all_values()
-            investment_schedule_sheet_values = self.investment_schedule_sheet.get_all_values()
-            orders_sheet_values = self.orders_sheet.get_all_values()
-            self.stock_data = pd.DataFrame(user_stock_sheet_values[1:], columns=user_stock_sheet_values[0])
-            self.investment_schedule_data = pd.DataFrame(investment_schedule_sheet_values[1:], columns=investment_schedule_sheet_values[0])
-            self.orders_data = pd.DataFrame(orders_sheet_values[1:], columns=orders_sheet_values[0])
+            with run_metrics.stage('sheet_reads'):
+                user_stock_sheet_values = self.user_stock_sheet.get_all_values()
+                investment_schedule_sheet_values = self.investment_schedule_sheet.get_all_values()
+                orders_sheet_values = self.orders_sheet.get_all_values()
+            self.stock_data = get_sheet_frame(user_stock_sheet_values)
+            self.investment_schedule_data = get_sheet_frame(investment_schedule_sheet_values)
+            self.orders_data = get_sheet_frame(orders_sheet_values)
         except Exception:
             self.user_error_message += 'Error loading user values from spreadsheet: Could not get data from either stock, investment schedule, or orders sheet. Ensure that the header row still exists.<br>'
             raise UserInputException
 
-        if 'Stock' not in self.stock_data or 'Current Balance' not in self.stock_data or 'Percentage to Input' not in self.stock_data:
-            self.user_error_message += f'Error loading user values from spreadsheet: Could not find column name "Stock", "Current Balance", or "Percentage to Input".<br>'
-            raise UserInputException
-        
-        try:
-            self.stock_data['Stock'] = self.stock_data['Stock'].apply(lambda stock: try_cast(stock, str))
-        except Exception:
-            self.user_error_message += f'Error loading user values from spreadsheet: "Stock" value is not a valid string.<br>'
-            raise UserInputException
+        # Every check of every sheet runs before raising, so the user sees all problems of their sheets at once.
+        self.stock_data, errors = parse_sheet(self.stock_data, STOCKS_SCHEMA)
+        if STOCKS_SCHEMA.has_columns(self.stock_data):
+            bad_tickers = self.stock_data.loc[~self.stock_data['Stock'].apply(stock_data_store.ticker_exists), 'Stock'].tolist()
+            if len(bad_tickers) > 0:
+                errors.append(get_user_error_message(f'{bad_tickers} is/are not a valid ticker.'))
+            percentages = self.stock_data['Percentage to Input']
+            if percentages.notna().all() and abs(percentages.sum() - 1) >= 1e-3:
+                errors.append(get_user_error_message('Sum of investment input percentages does not equal 100%.'))
 
-        self.stock_data = self.stock_data[self.stock_data['Stock'] != '']
-        
-        if not self.stock_data['Current Balance'].str.startswith('$').all():
-            self.user_error_message += f'Error loading user values from spreadsheet: Some "Current Balance" does not start with a "$".<br>'
-            raise UserInputException
-        if not self.stock_data['Percentage to Input'].str.endswith('%').all():
-            self.user_error_message += f'Error loading user values from spreadsheet: Some "Percentage to Input" does not end with a "%".<br>'
-            raise UserInputException
-        
-        try:
-            self.stock_data['Current Balance'] = self.stock_data['Current Balance'].apply(lambda balance: try_cast(balance[1:].replace(',', ''), float))
-            self.stock_data['Percentage to Input'] = self.stock_data['Percentage to Input'].apply(lambda percentage_to_input: try_cast(percentage_to_input[:-1], float) / 100)
-        except Exception:
-            self.user_error_message += f'Error loading user values from spreadsheet: "Balance" or "Percentage to Input" is not a valid for some rows.<br>'
-            raise UserInputException
-                
-        if (self.stock_data['Current Balance'] < 0).any():
-            self.user_error_message += f'Error loading user values from spreadsheet: Balance less than 0 for some stock.<br>'
-            raise UserInputException
-        if (self.stock_data['Percentage to Input'] < 0).any():
-            self.user_error_message += f'Error loading user values from spreadsheet: Investment input percentage less than 0 for some stock.<br>'
-            raise UserInputException
-        bad_tickers = self.stock_data.loc[~self.stock_data['Stock'].apply(ticker_exists), 'Stock'].tolist()
-        if len(bad_tickers) > 0:
-            self.user_error_message += f'Error loading user values from spreadsheet: {bad_tickers} is/are not a valid ticker.<br>'
-            raise UserInputException
-            
-        if self.stock_data['Stock'].duplicated().any():
-            self.user_error_message += f'Error loading user values from spreadsheet: Some tickers appears multiple times in the "Stock" sheet. This will lead to undefined behavior.<br>'
-            raise UserInputException
-        
-        if 'Investment Frequency' not in self.investment_schedule_data or 'Amount' not in self.investment_schedule_data:
-            self.user_error_message += f'Error loading user values from spreadsheet: Could not find column name "Investment Frequency" or "Amount".<br>'
-            raise UserInputException
-        
-        try:
-            self.investment_schedule_data['Investment Frequency'] = self.investment_schedule_data['Investment Frequency'].apply(lambda investment_frequency: try_cast(investment_frequency, str))
-        except Exception:
-            self.user_error_message += f'Error loading user values from spreadsheet: "Investment Frequency" is not a valid string.<br>'
-            raise UserInputException
-        
-        self.investment_schedule_data = self.investment_schedule_data[self.investment_schedule_data['Investment Frequency'] != '']
-        
-        if self.investment_schedule_data['Investment Frequency'].duplicated().any():
-            self.user_error_message += f'Error loading user values from spreadsheet: Some investment frequencies appears multiple times in the "Investment Schedule" sheet.<br>'
-            raise UserInputException
-        
-        if not self.investment_schedule_data['Amount'].str.startswith('$').all():
-            self.user_error_message += f'Error loading user values from spreadsheet: Some "Amount" does not start with a "$".<br>'
-            raise UserInputException
-        
-        try:
-            self.investment_schedule_data['Amount'] = self.investment_schedule_data['Amount'].apply(lambda amount: try_cast(amount[1:].replace(',', ''), float))
-        except Exception:
-            self.user_error_message += f'Error loading user values from spreadsheet: "Amount" is not a valid for some rows.<br>'
+        self.investment_schedule_data, investment_schedule_errors = parse_sheet(self.investment_schedule_data, INVESTMENT_SCHEDULE_SCHEMA)
+        self.orders_data, orders_errors = parse_sheet(self.orders_data, ORDERS_SCHEMA)
+        errors += investment_schedule_errors + orders_errors
+        if len(errors) > 0:
+            self.user_error_message += ''.join(errors)
             raise UserInputException
+        self.set_orders_written()
+        self.loaded = True
 
-        if (self.investment_schedule_data['Amount'] < 0).any():
-            self.user_error_message += f'Error loading user values from spreadsheet: Amount less than 0 for some stock.<br>'
-            raise UserInputException
-        
-        try:
-            self.investment_schedule_data['Investment Frequency'] = self.investment_schedule_data['Investment Frequency'].apply(lambda investment_frequency: investment_input_schedules_spreadsheet_to_enum[investment_frequency])
-        except Exception:
-            self.user_error_message += f'Error loading user values from spreadsheet: Some "Investment Frequency" is valid from possibilities ({", ".join(investment_input_schedules_spreadsheet_to_enum.keys())}).<br>'
+    def parse_orders_data(self):
+        self.orders_data, errors = parse_sheet(self.orders_data, ORDERS_SCHEMA)
+        if len(errors) > 0:
+            self.user_error_message += ''.join(errors)
             raise UserInputException
+        self.set_orders_written()
 
+    # Reads and parses only the Orders sheet, for work that does not need the balances or schedule (e.g. intraday_refresh).
+    def populate_orders_data(self):
+        self.orders_data = pd.DataFrame()
+        self.user_error_message = ''
         try:
-            assert abs(self.stock_data['Percentage to Input'].sum() - 1) < 1e-3
-        except Exception:
-            self.user_error_message += f'Error loading user values from spreadsheet: Sum of investment input percentages does not equal 100%.<br>'
-            raise UserInputException
-        
-        if 'Date' not in self.orders_data or 'Stock' not in self.orders_data or 'Amount' not in self.orders_data or 'Limit Price' not in self.orders_data or 'Fulfilled?' not in self.orders_data:
-            self.user_error_message += f'Error loading user values from spreadsheet: Could not find column name "Date", "Stock", "Amount", "Limit Price", or "Fulfilled?".<br>'
-            raise UserInputException
-        
-        try:
-            self.orders_data['Date'] = self.orders_data['Date'].apply(lambda date_string: datetime.strptime(date_string, '%Y-%m-%d').date())
-        except Exception:
-            self.user_error_message += f'Error loading user values from spreadsheet: "Date" is not a valid for some rows. Ensure format is "YYYY-MM-DD".<br>'
-            raise UserInputException
-        
-        if not self.orders_data['Limit Price'].str.startswith('$').all():
-            self.user_error_message += f'Error loading user values from spreadsheet: Some "Limit Price" does not start with a "$".<br>'
-            raise UserInputException
-        
-        try:
-            self.orders_data['Amount'] = self.orders_data['Amount'].apply(lambda amount: try_cast(amount, float))
-            self.orders_data['Limit Price'] = self.orders_data['Limit Price'].apply(lambda limit_price: try_cast(limit_price[1:].replace(',', ''), float))
+            with run_metrics.stage('sheet_reads'):
+                self.orders_sheet = self.backend.open_worksheet(self.spreadsheet_id, 'Orders')
+                orders_sheet_values = self.orders_sheet.get_all_values()
+            self.orders_data = get_sheet_frame(orders_sheet_values)
         except Exception:
-            self.user_error_message += f'Error loading user values from spreadsheet: "Amount" or "Limit Price" is not a valid for some rows.<br>'
+            self.user_error_message += 'Error loading user values from spreadsheet: Could not get data from the orders sheet. Ensure that the header row still exists.<br>'
             raise UserInputException
-
-        self.loaded = True
+        self.parse_orders_data()
 
     def set_last_date_success(self, date):
         try:
-            self.database_sheet.update_cell(self.database_row_index, LAST_DATE_SUCCESS_COLUMN, str(date))
+            with run_metrics.stage('sheet_write_back'):
+                self.database_sheet.update_cell(self.database_row_index, LAST_DATE_SUCCESS_COLUMN, str(date))
             self.last_date_success = str(date)
-        except gspread.exceptions.APIError:
+        except StorageAPIException:
             raise InternalLogicException
 
     def set_num_current_day_fails(self, num_fails):
         try:
-            self.database_sheet.update_cell(self.database_row_index, NUM_CURRENT_DAY_FAILURES_COLUMN, num_fails)
+            with run_metrics.stage('sheet_write_back'):
+                self.database_sheet.update_cell(self.database_row_index, NUM_CURRENT_DAY_FAILURES_COLUMN, num_fails)
             self.num_current_day_failures = num_fails
-        except gspread.exceptions.APIError:
+        except StorageAPIException:
             raise InternalLogicException
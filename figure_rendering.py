@@ -0,0 +1,88 @@
+import io
+import threading
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib import dates as mdates
+from matplotlib import image as mimage
+
+from utils import RenderedFigure
+
+# Upper bound on the points drawn per chart. A year of opens is about twice this.
+MAX_CHART_POINTS = 130
+
+# Keeps the lowest and highest open of each bucket (and the first and last open), so dips and peaks survive downsampling.
+def downsample_open_prices(open_prices, max_points: int = MAX_CHART_POINTS):
+    number_of_points = open_prices.shape[0]
+    if number_of_points <= max_points:
+        return open_prices
+    values = open_prices.to_numpy(dtype=float)
+    positions = {0, number_of_points - 1}
+    for bucket in np.array_split(np.arange(number_of_points), (max_points - 2) // 2):
+        positions.add(bucket[np.argmin(values[bucket])])
+        positions.add(bucket[np.argmax(values[bucket])])
+    return open_prices.iloc[sorted(positions)]
+
+# One Agg figure whose artists are updated for every chart, instead of creating, laying out and closing a pyplot figure per
+# stock. It does not use pyplot, so each thread can have its own template (see get_market_chart_template).
+# Laying out and drawing the date axis is most of the cost of a chart and the charts of one report all cover the same dates,
+# so the background (frame and date axis) is drawn once per x range and only the per stock artists are drawn over a copy of it.
+class MarketChartTemplate:
+    def __init__(self):
+        self.figure = Figure()
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axis = self.figure.add_subplot(1, 1, 1)
+        self.axis.xaxis_date()
+        self.scatter = self.axis.scatter([], [], s = 5)
+        self.trend_line, = self.axis.plot([], [], color = 'blue', linewidth = 3)
+        # In the order a full draw of the figure draws them. Animated artists are left out of canvas.draw().
+        self.stock_artists = [self.scatter, self.trend_line, self.axis.yaxis, self.axis.title]
+        for artist in self.stock_artists:
+            artist.set_animated(True)
+        self.background = None
+        self.background_x_limits = None
+
+    # trend is (dates, values) of a line to draw over the opens, e.g. from BaseModel.get_chart_trend.
+    def render(self, open_prices, title, trend = None) -> RenderedFigure:
+        open_prices = downsample_open_prices(open_prices)
+        points = np.column_stack([mdates.date2num(open_prices.index.to_pydatetime()), open_prices.to_numpy(dtype=float)])
+        self.scatter.set_offsets(points)
+        if trend is None:
+            self.trend_line.set_visible(False)
+        else:
+            trend_points = np.column_stack([mdates.date2num(trend[0].to_pydatetime()), np.asarray(trend[1], dtype=float).ravel()])
+            self.trend_line.set_data(trend_points[:, 0], trend_points[:, 1])
+            self.trend_line.set_visible(True)
+            points = np.concatenate([points, trend_points])
+
+        # Same limits a fresh figure would autoscale to.
+        self.axis.ignore_existing_data_limits = True
+        self.axis.update_datalim(points)
+        self.axis.autoscale_view()
+        self.axis.set_title(title)
+
+        x_limits = self.axis.get_xlim()
+        if x_limits != self.background_x_limits:
+            self.canvas.draw()
+            self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+            self.background_x_limits = x_limits
+        else:
+            self.canvas.restore_region(self.background)
+        for artist in self.stock_artists:
+            self.axis.draw_artist(artist)
+
+        figure_file = io.BytesIO()
+        mimage.imsave(figure_file, self.canvas.buffer_rgba(), format = 'png', dpi = self.figure.dpi)
+        return RenderedFigure(title, figure_file.getvalue())
+
+market_chart_templates = threading.local()
+
+def get_market_chart_template() -> MarketChartTemplate:
+    if not hasattr(market_chart_templates, 'template'):
+        market_chart_templates.template = MarketChartTemplate()
+    return market_chart_templates.template
+
+# Email chart of the opens of one stock, with the model's trend line when its state already has one (see BaseModel.get_chart_trend).
+def render_market_figure(model, open_prices, stock_ticker) -> RenderedFigure:
+    return get_market_chart_template().render(open_prices, f'Market for {stock_ticker}', model.get_chart_trend(open_prices))
@@ -1,12 +1,12 @@
 import os
-import random
 from datetime import datetime
 import pytz
 
-from utils import get_data_for_stock
-from simulation import SimulationParameters
+from stock_data import stock_data_store
+from simulation import DATE_FORMAT
 
 from tqdm import tqdm
+import numpy as np
 import pandas as pd
 
 file_name = 'validation_set.csv'
@@ -15,43 +15,64 @@ min_number_days = 365 * 5
 max_number_days = 365 * 30
 buffer_number_days_for_model = 365 * 2
 number_runs_per_stock = 250
+# Set to an integer to make the generated set reproducible.
+generation_seed = None
 validation_stocks = ['VTI', 'VNQ', 'VDE', 'RYE', 'QCLN', 'VIG', 'VGT', 'SPY', 'VYM', 'SCHD', 'VDC', 'VUG', 'VONE', 'VTHR', 'VDE', 'VOO', 'VHT', 'VWO', 'VOX', 'VIS', 'VOT', 'VOE', 'VTWG', 'VTWV', 'VTWO', 'IVOG', 'VIOV', 'MGK', 'MGV', '^IXIC', '^DJI', '^RUT', '^FTSE', '^NYA', '^XAX', '^BUK100P', '^RUT', '^VIX', '^GDAXI', '^FCHI', '^NZ50', '^BVSP', '^AORD', 'AAPL', 'TSLA', 'GOOGL', 'MSFT', 'NVDA', 'AMZN', 'META', 'GOOG', 'COST', 'JPM', 'XOM', 'JNJ']
 
+# Inclusive integer sampling with a different upper bound per element.
+def sample_integers(rng, low, high):
+    return low + np.floor(rng.random(len(low)) * (high - low + 1)).astype(np.int64)
+
+def sample_runs_for_stock(rng, stock, data, number_of_runs):
+    number_of_rows = data.shape[0]
+    assert number_of_rows - buffer_number_days_for_model > min_number_days, f'Not enough data for validation on {stock}.'
+
+    start_day = rng.integers(buffer_number_days_for_model, number_of_rows - min_number_days - 1, size=number_of_runs, endpoint=True)
+    end_day = sample_integers(rng, start_day + min_number_days, np.minimum(start_day + max_number_days, number_of_rows - 1))
+    yearly_amount_input = rng.uniform(5000, 30000, size=number_of_runs)
+
+    # Can buy roughly 2 a year.
+    fractional_shares = np.where(data['Open'].iloc[-1] < yearly_amount_input / 2, rng.random(number_of_runs) < 0.5, True)
+    investment_input_cycle_days = rng.integers(7, 28, size=number_of_runs, endpoint=True)
+    start_day_of_cycle = sample_integers(rng, np.zeros(number_of_runs, dtype=np.int64), investment_input_cycle_days - 1)
+
+    return {
+        'stock': np.full(number_of_runs, stock, dtype=object),
+        'random_seed': rng.integers(0, 10000000000, size=number_of_runs, endpoint=True),
+        'start_date': data.index[start_day].strftime(DATE_FORMAT).values,
+        'end_date': data.index[end_day].strftime(DATE_FORMAT).values,
+        'start_day_of_cycle': start_day_of_cycle,
+        'yearly_amount_input': yearly_amount_input,
+        'starting_account_balance': np.zeros(number_of_runs, dtype=np.int64),
+        'fractional_shares': fractional_shares,
+        'investment_input_cycle_days': investment_input_cycle_days,
+    }
+
+# Same checks as SimulationParameters.parse_from_inputs, applied to every row at once.
+def validate_runs(df):
+    assert (df['start_date'] <= df['end_date']).all()
+    assert (df['yearly_amount_input'] > 0).all()
+    assert (df['starting_account_balance'] >= 0).all()
+    assert (df['investment_input_cycle_days'] > 0).all()
+    assert (df['start_day_of_cycle'] < df['investment_input_cycle_days']).all()
+
+def generate_validation_set(stocks, number_of_runs_per_stock, end_date, seed = None):
+    rng = np.random.default_rng(seed)
+    # Fetch (and sanity check) every ticker once before sampling anything.
+    stock_data = {stock: stock_data_store.get(stock, end_date) for stock in tqdm(list(dict.fromkeys(stocks)), desc='Downloading')}
+    runs = [sample_runs_for_stock(rng, stock, stock_data[stock], number_of_runs_per_stock) for stock in stocks]
+    df = pd.DataFrame({column: np.concatenate([run[column] for run in runs]) for column in runs[0].keys()})
+    validate_runs(df)
+    return df
+
 if __name__ == '__main__':
     validation_path = 'validation_sets/'
     file_path = validation_path + file_name
-    
+
     if os.path.exists(file_path):
         print('Validation file already exists. Either delete it or rename the validation file.')
         exit(1)
-    
+
     today_datetime = datetime.now().astimezone(pytz.timezone('US/Eastern'))
-    
-    # Check all tickers work.
-    for stock in validation_stocks:
-        data = get_data_for_stock(stock, today_datetime)
-        assert data.shape[0] - buffer_number_days_for_model > min_number_days, f'Not enough data for validation on {stock}.'
-    df = pd.DataFrame()
-    for stock in tqdm(validation_stocks):
-        data = get_data_for_stock(stock, today_datetime)
-        for ii in tqdm(range(number_runs_per_stock), desc=f'{stock}'):
-            random_seed = random.randint(0, 10000000000)
-            start_day = random.randint(buffer_number_days_for_model, data.shape[0] - min_number_days - 1)
-            end_day = random.randint(start_day + min_number_days, min(start_day + max_number_days, data.shape[0] - 1))
-            start_date = data.index[start_day].date()
-            end_date = data.index[end_day].date()
-            yearly_amount_input = random.uniform(5000, 30000)
-            starting_account_balance = 0
-
-            # Can buy roughly 2 a year.
-            if data['Open'].iloc[-1] < yearly_amount_input / 2:
-                fractional_shares = random.random() < 0.5
-            else:
-                fractional_shares = True
-            investment_input_cycle_days = random.randint(7, 28)
-            start_day_of_cycle = random.randint(0, investment_input_cycle_days - 1)
-                
-            simulation_parameters = SimulationParameters()
-            simulation_parameters.parse_from_inputs(stock, random_seed, start_date, end_date, start_day_of_cycle, yearly_amount_input, starting_account_balance, fractional_shares, investment_input_cycle_days)
-            df = pd.concat([df, pd.DataFrame([simulation_parameters.convert_to_dict()])], ignore_index=True)
+    df = generate_validation_set(validation_stocks, number_runs_per_stock, today_datetime, generation_seed)
     df.to_csv(file_path, index=False)
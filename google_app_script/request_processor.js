@@ -10,19 +10,37 @@ function send_email(to_email, message) {
   GmailApp.sendEmail(to_email, subject, message);
 }
 
-function get_database_row_index_if_email_exists(database, email) {
+// Rows are 0-indexed like getValues() (row 0 is the header). The first row of an email wins, as before.
+function build_email_to_row_index(database) {
+  const email_to_row_index = new Map();
   for (let ii = 1; ii < database.length; ii++) {
-    let row = database[ii];
-    if (row[0] === email) {
-      return ii;
+    let email = database[ii][0];
+    if (!email_to_row_index.has(email)) {
+      email_to_row_index.set(email, ii);
     }
   }
-  return null;
+  return email_to_row_index;
 }
 
-function create_new_user_spreadsheet(email) {
-  const new_spreadsheet = DriveApp.getFileById(template_stock_spreadsheet_id).makeCopy(`${email} Stocks`);  
-  return new_spreadsheet.getId();
+// Copies the template once per new user (Drive has no bulk copy) but only looks the template up once.
+// Returns email -> spreadsheet file for every copy that succeeded and email -> error for the rest.
+function create_new_user_spreadsheets(emails) {
+  const template_file = DriveApp.getFileById(template_stock_spreadsheet_id);
+  const user_spreadsheet_files = new Map();
+  const errors = new Map();
+  for (const email of emails) {
+    try {
+      const user_spreadsheet_file = template_file.makeCopy(`${email} Stocks`);
+      user_spreadsheet_file.setShareableByEditors(false);
+      user_spreadsheet_file.addEditor(email);
+      user_spreadsheet_file.addEditor(spreadsheet_service_account);
+      user_spreadsheet_files.set(email, user_spreadsheet_file);
+    } catch (error) {
+      console.log(error);
+      errors.set(email, error);
+    }
+  }
+  return [user_spreadsheet_files, errors];
 }
 
 function get_default_last_date_success() {
@@ -33,65 +51,109 @@ function get_default_num_current_day_failures() {
   return 0;
 }
 
-function create_new_user(database_sheet, email) {
-  const user_spreadsheet_id = create_new_user_spreadsheet(email);
-  
-  
-  const user_spreadsheet_file = DriveApp.getFileById(user_spreadsheet_id);
-  user_spreadsheet_file.setShareableByEditors(false)
-  user_spreadsheet_file.addEditor(email);
-  user_spreadsheet_file.addEditor(spreadsheet_service_account);
-
-  const user_values = [email, user_spreadsheet_id, subscribed_value, get_default_last_date_success(), get_default_num_current_day_failures()];
-  database_sheet.appendRow(user_values);
-  
-  return database_sheet.getLastRow() - 1;
-}
-
-function unsubscribe_user(database_sheet, user_row_index) {
-  database_sheet.getRange(user_row_index + 1, 3).setValue("No");
+function get_user_spreadsheet_url(database, user_spreadsheet_files, email, row_index) {
+  if (user_spreadsheet_files.has(email)) {
+    return user_spreadsheet_files.get(email).getUrl();
+  }
+  return DriveApp.getFileById(database[row_index][1]).getUrl();
 }
 
-function resubscribe_user(database_sheet, user_row_index) {
-  database_sheet.getRange(user_row_index + 1, 3).setValue("Yes");
+function get_notification_message(database, user_spreadsheet_files, notification) {
+  const [email, kind, row_index] = notification;
+  if (kind === "added") {
+    return `You have been successfully added to Finz - use your shared spreadsheet (named "${email} Stocks" at link ${get_user_spreadsheet_url(database, user_spreadsheet_files, email, row_index)}) to choose your stocks and preferences.`;
+  } else if (kind === "unsubscribed") {
+    return "You have been successfully unsubscribed from Finz.";
+  }
+  return `You have been successfully resubscribed from Finz. You can use the spreadsheet you were using before (named "${email} Stocks" at link ${get_user_spreadsheet_url(database, user_spreadsheet_files, email, row_index)}).`;
 }
 
-function process_request(database_sheet, email, action) {
-  const database = database_sheet.getDataRange().getValues();
-  let row_index_if_exists = get_database_row_index_if_email_exists(database, email);
-  if (row_index_if_exists === null && action === sign_up_action) {
-    row_index_if_exists = create_new_user(database_sheet, email);
-    send_email(email, `You have been successfully added to Finz - use your shared spreadsheet (named "${email} Stocks" at link ${DriveApp.getFileById(database_sheet.getRange(row_index_if_exists + 1, 2).getValue()).getUrl()}) to choose your stocks and preferences.`);
-  } else if (row_index_if_exists !== null && action === unsubscribe_action) {
-    unsubscribe_user(database_sheet, row_index_if_exists);
-    send_email(email, "You have been successfully unsubscribed from Finz.");
-  } else if (row_index_if_exists !== null && action === sign_up_action) {
-    resubscribe_user(database_sheet, row_index_if_exists);
-    send_email(email, `You have been successfully resubscribed from Finz. You can use the spreadsheet you were using before (named "${email} Stocks" at link ${DriveApp.getFileById(database_sheet.getRange(row_index_if_exists + 1, 2).getValue()).getUrl()}).`);
+// Applies every pending request in order against an in-memory copy of the Database sheet, then writes the subscribed column,
+// the new user rows and the processed column with one range write each, and finally sends the emails.
+function process_requests() {
+  const lock = LockService.getScriptLock();
+  lock.waitLock(30000);
+  try {
+    process_pending_requests();
+  } finally {
+    lock.releaseLock();
   }
 }
 
-function process_requests() {
+function process_pending_requests() {
   const spreadsheet = SpreadsheetApp.openById(requests_spreadsheets_id);
   
   const requests_sheet = spreadsheet.getSheetByName("Requests");
   const database_sheet = spreadsheet.getSheetByName("Database");
   
   const requests = requests_sheet.getDataRange().getValues();
+  const database = database_sheet.getDataRange().getValues();
+  const email_to_row_index = build_email_to_row_index(database);
+  const number_of_existing_users = database.length - 1;
+  
+  // One entry per user row (existing users first, then users added by these requests).
+  const subscribed_values = database.slice(1).map(row => [row[2]]);
+  const processed_values = requests.slice(1).map(row => [row[3]]);
+  const new_user_emails = [];
+  const notifications = [];
+  let any_subscription_change = false;
+  let any_processed = false;
   
-  let any_error = null;
   for (let ii = 1; ii < requests.length; ii++) {
-    let row = requests[ii];
-    let [timestamp, email, action, processed] = row;
-    if (timestamp !== "" && processed === "") {
-      try {
-        process_request(database_sheet, email, action);
-        requests_sheet.getRange(ii + 1, 4).setValue("Yes");
-      } catch (error) {
-        console.log(error);
-        requests_sheet.getRange(ii + 1, 4).setValue("Yes");
-        any_error = error;
-      }
+    let [timestamp, email, action, processed] = requests[ii];
+    if (timestamp === "" || processed !== "") {
+      continue;
+    }
+    processed_values[ii - 1][0] = "Yes";
+    any_processed = true;
+    
+    let row_index = email_to_row_index.has(email) ? email_to_row_index.get(email) : null;
+    if (row_index === null && action === sign_up_action) {
+      row_index = subscribed_values.length + 1;
+      email_to_row_index.set(email, row_index);
+      subscribed_values.push([subscribed_value]);
+      new_user_emails.push(email);
+      notifications.push([email, "added", row_index]);
+    } else if (row_index !== null && action === unsubscribe_action) {
+      subscribed_values[row_index - 1][0] = "No";
+      any_subscription_change = true;
+      notifications.push([email, "unsubscribed", row_index]);
+    } else if (row_index !== null && action === sign_up_action) {
+      subscribed_values[row_index - 1][0] = "Yes";
+      any_subscription_change = true;
+      notifications.push([email, "resubscribed", row_index]);
+    }
+  }
+  
+  let any_error = null;
+  const [user_spreadsheet_files, creation_errors] = create_new_user_spreadsheets(new_user_emails);
+  for (const error of creation_errors.values()) {
+    any_error = error;
+  }
+  
+  if (any_subscription_change && number_of_existing_users > 0) {
+    database_sheet.getRange(2, 3, number_of_existing_users, 1).setValues(subscribed_values.slice(0, number_of_existing_users));
+  }
+  const new_user_rows = new_user_emails
+    .filter(email => user_spreadsheet_files.has(email))
+    .map(email => [email, user_spreadsheet_files.get(email).getId(), subscribed_values[email_to_row_index.get(email) - 1][0], get_default_last_date_success(), get_default_num_current_day_failures()]);
+  if (new_user_rows.length > 0) {
+    database_sheet.getRange(database.length + 1, 1, new_user_rows.length, new_user_rows[0].length).setValues(new_user_rows);
+  }
+  if (any_processed) {
+    requests_sheet.getRange(2, 4, processed_values.length, 1).setValues(processed_values);
+  }
+  
+  for (const notification of notifications) {
+    let email = notification[0];
+    if (creation_errors.has(email)) {
+      continue;
+    }
+    try {
+      send_email(email, get_notification_message(database, user_spreadsheet_files, notification));
+    } catch (error) {
+      console.log(error);
+      any_error = error;
     }
   }
   
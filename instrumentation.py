@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+RUN_SCOPE = 'run'
+
+class RunMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.perf_counter()
+            self.stage_seconds = defaultdict(lambda: defaultdict(float))
+            self.stage_calls = defaultdict(lambda: defaultdict(int))
+            self.counters = defaultdict(lambda: defaultdict(int))
+
+    def current_scope(self):
+        return getattr(self.local, 'scope', None)
+
+    # Everything recorded inside this block is attributed to the scope (usually a user email) as well as to the whole run.
+    @contextmanager
+    def scope(self, name):
+        previous_scope = self.current_scope()
+        self.local.scope = name
+        try:
+            yield
+        finally:
+            self.local.scope = previous_scope
+
+    def scopes_to_record(self):
+        scope = self.current_scope()
+        return [RUN_SCOPE] if scope is None else [RUN_SCOPE, scope]
+
+    @contextmanager
+    def stage(self, stage_name):
+        stage_start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(stage_name, time.perf_counter() - stage_start_time)
+
+    def add_stage_time(self, stage_name, seconds):
+        with self.lock:
+            for scope in self.scopes_to_record():
+                self.stage_seconds[scope][stage_name] += seconds
+                self.stage_calls[scope][stage_name] += 1
+
+    def increment(self, counter_name, amount = 1):
+        with self.lock:
+            for scope in self.scopes_to_record():
+                self.counters[scope][counter_name] += amount
+
+    def get_records(self):
+        with self.lock:
+            scopes = list(dict.fromkeys([RUN_SCOPE] + list(self.stage_seconds.keys()) + list(self.counters.keys())))
+            timestamp = datetime.now().isoformat()
+            records = []
+            for scope in scopes:
+                record = {
+                    'timestamp': timestamp,
+                    'scope': scope,
+                    'stage_seconds': dict(self.stage_seconds[scope]),
+                    'stage_calls': dict(self.stage_calls[scope]),
+                    'counters': dict(self.counters[scope]),
+                }
+                if scope == RUN_SCOPE:
+                    record['total_seconds'] = time.perf_counter() - self.start_time
+                records.append(record)
+            return records
+
+    # One JSON object per line so that cloud logging parses them as structured records.
+    def emit(self, file_path = None):
+        records = self.get_records()
+        for record in records:
+            print(json.dumps(record))
+        if file_path is not None:
+            with open(file_path, 'a') as metrics_file:
+                for record in records:
+                    metrics_file.write(json.dumps(record) + '\n')
+        return records
+
+run_metrics = RunMetrics()
@@ -0,0 +1,112 @@
+import os
+import threading
+from datetime import datetime, time
+
+import pandas as pd
+import pytz
+
+from utils import get_intraday_data_for_stock, get_today
+from database import Database
+from instrumentation import run_metrics
+
+INTRADAY_INTERVAL = '5m'
+MARKET_TIMEZONE = pytz.timezone('US/Eastern')
+MARKET_OPEN_TIME = time(9, 30)
+MARKET_CLOSE_TIME = time(16, 0)
+# When set, the bars of the current session are kept in this directory so that later refreshes of the day only fetch new bars.
+INTRADAY_CACHE_PATH = os.environ.get('FINZ_INTRADAY_CACHE_PATH')
+# When set, the structured per-stage timing records of each refresh are also appended to this file.
+METRICS_FILE_PATH = os.environ.get('FINZ_METRICS_FILE_PATH')
+
+# Holidays are not known here; on those days the downloads are simply empty and no order changes.
+def is_market_open(now_datetime) -> bool:
+    now_datetime = now_datetime.astimezone(MARKET_TIMEZONE)
+    return now_datetime.weekday() < 5 and MARKET_OPEN_TIME <= now_datetime.time() < MARKET_CLOSE_TIME
+
+# Bars of the current session per stock. Each refresh only downloads the bars after the last one it has seen.
+class IntradayDataStore:
+    def __init__(self, cache_path = None):
+        self.cache_path = cache_path
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get_cache_file_path(self, stock, today_date):
+        return os.path.join(self.cache_path, f'{stock}_{today_date}_{INTRADAY_INTERVAL}.pkl')
+
+    def get_cached(self, stock, today_date):
+        key = (stock, today_date)
+        with self.lock:
+            if key in self.data:
+                return self.data[key]
+        if self.cache_path is not None and os.path.exists(self.get_cache_file_path(stock, today_date)):
+            return pd.read_pickle(self.get_cache_file_path(stock, today_date))
+        return None
+
+    def get(self, stock, today_date):
+        cached_data = self.get_cached(stock, today_date)
+        if cached_data is None or cached_data.empty:
+            start_datetime = MARKET_TIMEZONE.localize(datetime.combine(today_date, MARKET_OPEN_TIME))
+        else:
+            # The last bar may still have been forming when it was fetched, so it is fetched again.
+            start_datetime = cached_data.index[-1].to_pydatetime()
+        new_data = get_intraday_data_for_stock(stock, start_datetime, INTRADAY_INTERVAL)
+        if cached_data is None:
+            data = new_data
+        else:
+            run_metrics.increment('intraday_cache_hits')
+            data = pd.concat([cached_data, new_data])
+            data = data[~data.index.duplicated(keep='last')].sort_index()
+        if not data.empty and data.index.tz is not None:
+            data = data[data.index.tz_convert(MARKET_TIMEZONE).date == today_date]
+
+        with self.lock:
+            self.data[(stock, today_date)] = data
+        if self.cache_path is not None:
+            os.makedirs(self.cache_path, exist_ok=True)
+            data.to_pickle(self.get_cache_file_path(stock, today_date))
+        return data
+
+    def get_low(self, stock, today_date):
+        data = self.get(stock, today_date)
+        return None if data.empty else float(data['Low'].min())
+
+intraday_data_store = IntradayDataStore(INTRADAY_CACHE_PATH)
+
+# Marks open orders as fulfilled from today's intraday lows, without the balance updates, modeling or emails of the daily run.
+# Meant to be scheduled several times during market hours.
+def main(data, context, backend = None, now_datetime = None):
+    run_metrics.reset()
+    now_datetime = get_today()[0] if now_datetime is None else now_datetime
+    if not is_market_open(now_datetime):
+        print('Market closed. Nothing to refresh.')
+        return
+    today_date = now_datetime.astimezone(MARKET_TIMEZONE).date()
+
+    database = Database(backend, populate_users=False)
+    open_order_spreadsheet_ids = database.backend.get_open_order_spreadsheet_ids()
+    users = [user for user in database.users if user.subscribed and (open_order_spreadsheet_ids is None or user.spreadsheet_id in open_order_spreadsheet_ids)]
+
+    intraday_lows = {}
+    for user in users:
+        with run_metrics.scope(user.email):
+            # Sheets that do not load are reported to the user by the daily run.
+            try:
+                user.populate_orders_data()
+            except Exception:
+                continue
+            open_orders = user.orders_data[(user.orders_data['Fulfilled?'] != 'Yes') & (user.orders_data['Stock'] != '') & (user.orders_data['Date'] < today_date)]
+            for stock in open_orders['Stock'].unique():
+                if stock not in intraday_lows:
+                    intraday_lows[stock] = intraday_data_store.get_low(stock, today_date)
+            user_intraday_lows = {stock: low for stock, low in intraday_lows.items() if low is not None}
+            number_of_fulfilled_orders = user.update_fulfilled_orders_from_intraday_lows(user_intraday_lows, today_date)
+            if number_of_fulfilled_orders > 0:
+                user.update_orders_sheet()
+                run_metrics.increment('orders_fulfilled_intraday', number_of_fulfilled_orders)
+            run_metrics.increment('users_refreshed')
+            print(f'{user.email} newly fulfilled orders: {number_of_fulfilled_orders}')
+
+    run_metrics.emit(METRICS_FILE_PATH)
+
+if __name__ == '__main__':
+    main('Fake data.', 'Fake context')
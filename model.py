@@ -1,5 +1,7 @@
 import random
+from collections import deque
 import numpy as np
+import pandas as pd
 from sklearn.linear_model import LinearRegression
 from matplotlib import pyplot as plt
 
@@ -9,6 +11,39 @@ NUMBER_OF_DAYS_IN_YEAR = 365
 class BaseModel:
     def analyze_stock(self, data) -> float:
         raise NotImplementedError()
+
+    # Number of most recent bars analyze_stock looks at (None if it needs the full history).
+    def get_lookback_distance(self):
+        return None
+
+    # Incremental state lets a model resume from yesterday's run and only be fed the newest bars.
+    # By default the state is the window of the last get_lookback_distance() open prices and analyze_stock is run on it.
+    def supports_incremental_state(self) -> bool:
+        return self.get_lookback_distance() is not None
+
+    def get_state_key(self) -> str:
+        return f'{type(self).__name__}:{self.get_lookback_distance()}'
+
+    def reset_state(self) -> None:
+        self.state_last_date = None
+        self.state_open_prices = deque(maxlen=self.get_lookback_distance())
+
+    def update_state(self, date, open_price: float) -> None:
+        self.state_last_date = str(date)
+        self.state_open_prices.append(float(open_price))
+
+    def get_state(self) -> dict:
+        return {'key': self.get_state_key(), 'last_date': self.state_last_date, 'open_prices': list(self.state_open_prices)}
+
+    def load_state(self, state: dict) -> None:
+        assert state['key'] == self.get_state_key(), 'Model state was saved by a different model.'
+        self.reset_state()
+        self.state_last_date = state['last_date']
+        self.state_open_prices.extend(state['open_prices'])
+
+    # Same result as analyze_stock on all the bars given to update_state.
+    def analyze_state(self) -> float:
+        return self.analyze_stock(pd.DataFrame({'Open': list(self.state_open_prices)}))
     
     def sample_num_stocks_to_buy(self, buy_rate: float) -> int:
         if random.random() < buy_rate % 1:
@@ -22,12 +57,20 @@ class BaseModel:
         axis.set_title(f"Market for {stock_ticker}")
         return figure, axis
 
+    # (dates, values) of the trend line to draw over open_prices, taken from the incremental state instead of fitting again.
+    # None when the model has no trend or its state does not end on the last bar of open_prices. Only LinearRegressionModel
+    # keeps a trend in its state, so the other models (LumpSumModel included) get the plain chart of opens.
+    def get_chart_trend(self, open_prices):
+        return None
+
     def get_market_trend_figure(self, open_prices, stock_ticker):
-        market_trend, score = self.get_market_trend(open_prices)
-        x = np.arange(open_prices.shape[0]).reshape(-1, 1)
-        predicted_y = market_trend.predict(x)
+        trend = self.get_chart_trend(open_prices)
+        if trend is None:
+            market_trend, score = self.get_market_trend(open_prices)
+            x = np.arange(open_prices.shape[0]).reshape(-1, 1)
+            trend = (open_prices.index, market_trend.predict(x))
         figure, axis = self.get_market_figure(open_prices, stock_ticker)
-        axis.plot(open_prices.index, predicted_y, color = 'blue', linewidth = 3)
+        axis.plot(trend[0], trend[1], color = 'blue', linewidth = 3)
         return figure, axis
     
 class RandomModel(BaseModel):
@@ -38,6 +81,9 @@ class RandomModel(BaseModel):
     def analyze_stock(self, data) -> float:
         return self.buy_rate
 
+    def get_lookback_distance(self):
+        return 1
+
 # TODO try to add a lump sum model that accounts for monday effect.
 
 # Buy as much as possible every day.
@@ -45,6 +91,9 @@ class LumpSumModel(BaseModel):
     def __init__(self, money_to_input: float):
         self.name = 'lump_sum_model'
         self.money_to_input = money_to_input
+
+    def get_lookback_distance(self):
+        return 1
         
     def analyze_stock(self, data) -> float:
         open_price = data['Open'].iloc[-1]
@@ -59,6 +108,9 @@ class ConstantDollarRandomModel(BaseModel):
         self.name = 'constant_dollar_random_model'
         self.annual_money_input = annual_money_input
         self.spending_cycle = spending_cycle
+
+    def get_lookback_distance(self):
+        return 1
         
     def analyze_stock(self, data) -> float:
         open_price = data['Open'].iloc[-1]
@@ -75,6 +127,9 @@ class LinearRegressionModel(BaseModel):
         self.spending_cycle = spending_cycle
         self.lookback_distance = lookback_distance
     
+    def get_lookback_distance(self):
+        return self.lookback_distance
+
     def get_market_trend(self, open_prices):
         y = open_prices.values.reshape(-1, 1)
         num_points = y.shape[0]
@@ -83,6 +138,16 @@ class LinearRegressionModel(BaseModel):
         regression = LinearRegression().fit(x,y)
         score = regression.score(x, y)
         return regression, score
+
+    def get_buy_rate_for_trend(self, open_price: float, model_open_price: float, intercept: float) -> float:
+        constant_buy_rate = self.annual_money_input / self.spending_cycle / open_price
+        scaled_buy_rate = constant_buy_rate * (max(model_open_price, 0) / open_price) ** 4
+
+        market_trend_return = max(model_open_price, 0) / max(intercept, 0.01)
+        if market_trend_return < 1:
+            return max(constant_buy_rate, scaled_buy_rate)
+        else:
+            return scaled_buy_rate
     
     def analyze_stock(self, data) -> float:
         open_prices = data['Open'].iloc[-self.lookback_distance:]
@@ -92,14 +157,58 @@ class LinearRegressionModel(BaseModel):
             return 0
         regression, score = self.get_market_trend(open_prices)
         model_open_price = regression.predict([[self.lookback_distance]])[0][0]
-        constant_buy_rate = self.annual_money_input / self.spending_cycle / open_price
-        scaled_buy_rate = constant_buy_rate * (max(model_open_price, 0) / open_price) ** 4
+        return self.get_buy_rate_for_trend(open_price, model_open_price, regression.intercept_[0])
 
-        market_trend_return = max(model_open_price, 0) / max(regression.intercept_, 0.01)
-        if market_trend_return < 1:
-            return max(constant_buy_rate, scaled_buy_rate)
-        else:
-            return scaled_buy_rate
+    # The fit is kept as rolling sums of y and x * y over the window (x is the position in the window), so each new bar costs O(1).
+    def reset_state(self) -> None:
+        super().reset_state()
+        self.state_sum_y = 0.0
+        self.state_sum_xy = 0.0
+
+    def update_state(self, date, open_price: float) -> None:
+        open_price = float(open_price)
+        new_position = len(self.state_open_prices)
+        if new_position == self.lookback_distance:
+            # Dropping the oldest price shifts every other position down by one.
+            oldest_open_price = self.state_open_prices[0]
+            self.state_sum_xy -= self.state_sum_y - oldest_open_price
+            self.state_sum_y -= oldest_open_price
+            new_position -= 1
+        self.state_sum_xy += new_position * open_price
+        self.state_sum_y += open_price
+        super().update_state(date, open_price)
+
+    def get_state(self) -> dict:
+        return {**super().get_state(), 'sum_y': self.state_sum_y, 'sum_xy': self.state_sum_xy}
+
+    def load_state(self, state: dict) -> None:
+        super().load_state(state)
+        self.state_sum_y = state['sum_y']
+        self.state_sum_xy = state['sum_xy']
+
+    def get_state_trend(self):
+        num_points = len(self.state_open_prices)
+        assert num_points == self.lookback_distance, 'Trying to get a market trend with less points than the lookback distance.'
+        sum_x = num_points * (num_points - 1) / 2
+        sum_xx = (num_points - 1) * num_points * (2 * num_points - 1) / 6
+        slope = (num_points * self.state_sum_xy - sum_x * self.state_sum_y) / (num_points * sum_xx - sum_x ** 2) if num_points > 1 else 0
+        intercept = (self.state_sum_y - slope * sum_x) / num_points
+        return slope, intercept
+
+    # The trend is a straight line, so its two end points are enough.
+    def get_chart_trend(self, open_prices):
+        if getattr(self, 'state_last_date', None) != str(open_prices.index[-1].date()) or len(self.state_open_prices) != self.lookback_distance or open_prices.shape[0] < self.lookback_distance:
+            return None
+        slope, intercept = self.get_state_trend()
+        return open_prices.index[-self.lookback_distance:][[0, -1]], [intercept, intercept + slope * (self.lookback_distance - 1)]
+
+    def analyze_state(self) -> float:
+        open_price = self.state_open_prices[-1]
+        assert open_price >= 0, 'Model requires an open price >= 0.'
+        if open_price == 0:
+            return 0
+        slope, intercept = self.get_state_trend()
+        return self.get_buy_rate_for_trend(open_price, intercept + slope * self.lookback_distance, intercept)
         
 class WeightedLinearRegressionModel(BaseModel):
     def __init__(self, annual_money_input: float, spending_cycle: float = NUMBER_OF_STOCK_DAYS_IN_YEAR, lookback_distance: int = NUMBER_OF_STOCK_DAYS_IN_YEAR):
@@ -108,6 +217,9 @@ class WeightedLinearRegressionModel(BaseModel):
         self.spending_cycle = spending_cycle
         self.lookback_distance = lookback_distance
     
+    def get_lookback_distance(self):
+        return self.lookback_distance
+
     def get_market_trend(self, open_prices):
         y = open_prices.values.reshape(-1, 1)
         num_points = y.shape[0]
@@ -135,18 +247,75 @@ class WeightedLinearRegressionModel(BaseModel):
         else:
             return scaled_buy_rate
         
-class LinearDistributionModel(BaseModel):
+# Keeps the minimum and maximum of the last lookback_distance open prices in monotonic deques of [bar number, price],
+# so each new bar costs O(1) instead of rescanning the window.
+class RollingRangeModel(BaseModel):
+    def get_buy_rate_for_range(self, open_price: float, range_minimum: float, range_maximum: float) -> float:
+        raise NotImplementedError()
+
+    def analyze_stock(self, data) -> float:
+        open_prices = data['Open'].iloc[-self.lookback_distance:]
+        return self.get_buy_rate_for_range(open_prices.iloc[-1], min(open_prices), max(open_prices))
+
+    def reset_state(self) -> None:
+        self.state_last_date = None
+        self.state_number_of_bars = 0
+        self.state_open_price = None
+        self.state_minimum_candidates = deque()
+        self.state_maximum_candidates = deque()
+
+    def update_state(self, date, open_price: float) -> None:
+        open_price = float(open_price)
+        bar_number = self.state_number_of_bars
+        while len(self.state_minimum_candidates) > 0 and self.state_minimum_candidates[-1][1] >= open_price:
+            self.state_minimum_candidates.pop()
+        self.state_minimum_candidates.append([bar_number, open_price])
+        while len(self.state_maximum_candidates) > 0 and self.state_maximum_candidates[-1][1] <= open_price:
+            self.state_maximum_candidates.pop()
+        self.state_maximum_candidates.append([bar_number, open_price])
+
+        first_bar_in_window = bar_number - self.lookback_distance + 1
+        while self.state_minimum_candidates[0][0] < first_bar_in_window:
+            self.state_minimum_candidates.popleft()
+        while self.state_maximum_candidates[0][0] < first_bar_in_window:
+            self.state_maximum_candidates.popleft()
+
+        self.state_number_of_bars += 1
+        self.state_open_price = open_price
+        self.state_last_date = str(date)
+
+    def get_state(self) -> dict:
+        return {
+            'key': self.get_state_key(),
+            'last_date': self.state_last_date,
+            'number_of_bars': self.state_number_of_bars,
+            'open_price': self.state_open_price,
+            'minimum_candidates': list(self.state_minimum_candidates),
+            'maximum_candidates': list(self.state_maximum_candidates),
+        }
+
+    def load_state(self, state: dict) -> None:
+        assert state['key'] == self.get_state_key(), 'Model state was saved by a different model.'
+        self.state_last_date = state['last_date']
+        self.state_number_of_bars = state['number_of_bars']
+        self.state_open_price = state['open_price']
+        self.state_minimum_candidates = deque(state['minimum_candidates'])
+        self.state_maximum_candidates = deque(state['maximum_candidates'])
+
+    def analyze_state(self) -> float:
+        return self.get_buy_rate_for_range(self.state_open_price, self.state_minimum_candidates[0][1], self.state_maximum_candidates[0][1])
+
+class LinearDistributionModel(RollingRangeModel):
     def __init__(self, annual_money_input: float, spending_cycle: float = NUMBER_OF_STOCK_DAYS_IN_YEAR, lookback_distance: int = NUMBER_OF_STOCK_DAYS_IN_YEAR):
         self.name = 'linear_distribution_model'
         self.annual_money_input = annual_money_input
         self.spending_cycle = spending_cycle
         self.lookback_distance = lookback_distance
         
-    def analyze_stock(self, data) -> float:
-        open_prices = data['Open'].iloc[-self.lookback_distance:]
-        range_maximum = max(open_prices)
-        range_minimum = min(open_prices)
-        open_price = open_prices.iloc[-1]
+    def get_lookback_distance(self):
+        return self.lookback_distance
+
+    def get_buy_rate_for_range(self, open_price: float, range_minimum: float, range_maximum: float) -> float:
         assert open_price >= 0, 'Model requires an open price >= 0.'
         if open_price == 0:
             return 0
@@ -155,18 +324,17 @@ class LinearDistributionModel(BaseModel):
         scaled_buy_rate = constant_buy_rate * (1 - range_percentile)
         return scaled_buy_rate
     
-class LumpLinearDistributionModel(BaseModel):
+class LumpLinearDistributionModel(RollingRangeModel):
     def __init__(self, annual_money_input: float, range_buy_percentage: float = 0.5, lookback_distance: int = NUMBER_OF_STOCK_DAYS_IN_YEAR):
         self.name = 'lump_linear_distribution_model'
         self.annual_money_input = annual_money_input
         self.range_buy_percentage = range_buy_percentage
         self.lookback_distance = lookback_distance
         
-    def analyze_stock(self, data) -> float:
-        open_prices = data['Open'].iloc[-self.lookback_distance:]
-        range_maximum = max(open_prices)
-        range_minimum = min(open_prices)
-        open_price = open_prices.iloc[-1]
+    def get_lookback_distance(self):
+        return self.lookback_distance
+
+    def get_buy_rate_for_range(self, open_price: float, range_minimum: float, range_maximum: float) -> float:
         assert open_price >= 0, 'Model requires an open price >= 0.'
         if open_price == 0:
             return 0
@@ -182,6 +350,9 @@ class FutureLimitModel(BaseModel):
         self.max_limit_days = max_limit_days
         self.price_decrease = price_decrease
         
+    def get_lookback_distance(self):
+        return self.max_limit_days + 1
+
     def analyze_stock(self, data) -> float:
         open_prices = data['Open'].iloc[-(self.max_limit_days + 1):]
         open_price = open_prices.iloc[-1]
@@ -212,6 +383,9 @@ class AveragedFutureLimitModel(BaseModel):
         self.price_decrease = price_decrease
         self.spending_cycle = spending_cycle
         
+    def get_lookback_distance(self):
+        return self.max_limit_days + 1
+
     def analyze_stock(self, data) -> float:
         open_prices = data['Open'].iloc[-(self.max_limit_days + 1):]
         open_price = open_prices.iloc[-1]
@@ -240,6 +414,9 @@ class STDModel(BaseModel):
         self.spending_cycle = spending_cycle
         self.lookback_distance = lookback_distance
 
+    def get_lookback_distance(self):
+        return self.lookback_distance
+
     def get_avg_and_std(self, column):
         diminishing_avg = 0
         num = column.shape[0]
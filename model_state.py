@@ -0,0 +1,65 @@
+import os
+import json
+import threading
+
+import pandas as pd
+
+from instrumentation import run_metrics
+
+# When set, incremental model state is kept in this JSON file between notifier runs.
+MODEL_STATE_FILE_PATH = os.environ.get('FINZ_MODEL_STATE_FILE_PATH')
+# Relative difference in the last open price that is treated as a revised history (e.g. a split) and forces a rebuild.
+OPEN_PRICE_REVISION_TOLERANCE = 1e-6
+
+# Incremental model state per (stock, model) so that a daily run only feeds each model the bars added since the last run.
+class ModelStateStore:
+    def __init__(self, file_path = None):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.states = {}
+        if file_path is not None and os.path.exists(file_path):
+            with open(file_path) as state_file:
+                self.states = json.load(state_file)
+
+    def get_key(self, stock, model):
+        return f'{stock}|{model.get_state_key()}'
+
+    def can_resume(self, entry, model, data):
+        if entry is None or entry['state']['key'] != model.get_state_key():
+            return False
+        last_date = pd.Timestamp(entry['state']['last_date'])
+        if last_date not in data.index:
+            return False
+        last_open_price = data['Open'].loc[last_date]
+        return abs(last_open_price - entry['last_open_price']) <= OPEN_PRICE_REVISION_TOLERANCE * max(abs(entry['last_open_price']), 1)
+
+    # Brings the model state up to the last bar of data, resuming from the stored state when the stored history still matches.
+    def resume(self, model, stock, data) -> None:
+        key = self.get_key(stock, model)
+        with self.lock:
+            entry = self.states.get(key)
+        if self.can_resume(entry, model, data):
+            run_metrics.increment('model_state_resumes')
+            model.load_state(entry['state'])
+            new_data = data.loc[pd.Timestamp(entry['state']['last_date']):].iloc[1:]
+        else:
+            run_metrics.increment('model_state_rebuilds')
+            model.reset_state()
+            new_data = data.iloc[-model.get_lookback_distance():]
+
+        for date, open_price in zip(new_data.index, new_data['Open']):
+            model.update_state(date.date(), open_price)
+
+        with self.lock:
+            self.states[key] = {'state': model.get_state(), 'last_open_price': float(data['Open'].iloc[-1])}
+
+    def save(self) -> None:
+        if self.file_path is None:
+            return
+        with self.lock:
+            temporary_file_path = f'{self.file_path}.tmp'
+            with open(temporary_file_path, 'w') as state_file:
+                json.dump(self.states, state_file)
+            os.replace(temporary_file_path, self.file_path)
+
+model_state_store = ModelStateStore(MODEL_STATE_FILE_PATH)
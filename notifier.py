@@ -1,83 +1,220 @@
+import os
+
 from utils import get_data_for_stock, send_email, send_fail_email, EmailContent, get_today
 from database import Database
+from instrumentation import run_metrics
+from stock_data import stock_data_store
+from sqlite_storage import SQLiteBackend
+from model_state import model_state_store
+from run_journal import open_run_journal, SHEETS_UPDATED_STAGE, EMAIL_SENT_STAGE, SUCCESS_RECORDED_STAGE
+from pipeline import Pipeline, Stage
+from figure_rendering import render_market_figure
 
 # TODO Switch prints to log messages
-# TODO New class that downloads and caches stock data
 
 MAX_NUM_FAILS = 5
+# When set, the structured per-stage timing records of each run are also appended to this file.
+METRICS_FILE_PATH = os.environ.get('FINZ_METRICS_FILE_PATH')
+# When set, user state is read from and written to this local SQLite store instead of Google Sheets.
+SQLITE_DATABASE_PATH = os.environ.get('FINZ_SQLITE_DATABASE_PATH')
 
-def run(user, should_email = False, should_print = False, send_figures = False) -> bool:
-    success = True
-    if not user.subscribed:
-        return success
-    
-    today_datetime, today_date = get_today()
+# Worker threads per stage of the daily pipeline. Sheets and SMTP stages wait on the network, evaluation is CPU bound and
+# rendering holds the GIL for most of its work, so more workers would not help it.
+LOAD_WORKERS = 8
+FETCH_WORKERS = 8
+EVALUATE_WORKERS = 2
+RENDER_WORKERS = 1
+WRITE_BACK_WORKERS = 8
+DELIVER_WORKERS = 4
+PIPELINE_QUEUE_SIZE = 32
 
-    subject = f'Finz Stock Notification for {today_date}\n'
-    message = ''
-    figures = []
+# State of one user's notification as it moves through the stages of the daily run.
+class UserRun:
+    def __init__(self, user, run_journal, today_date, should_email = False, should_print = False, send_figures = False):
+        self.user = user
+        self.run_journal = run_journal
+        self.today_date = today_date
+        self.should_email = should_email
+        self.should_print = should_print
+        self.send_figures = send_figures
+        self.subject = f'Finz Stock Notification for {today_date}\n'
+        self.message = ''
+        self.chart_inputs = []
+        self.figures = []
+        self.success = True
+        self.finished = False
+        self.from_journal = False
 
-    if user.last_date_success == str(today_date):
-        return success
-    
-    if user.loaded:
-        user.input_money_to_stock_balances(today_date)
+    def prepare(self):
+        if not self.user.subscribed or self.user.last_date_success == str(self.today_date) or self.run_journal.has_stage(self.user.email, SUCCESS_RECORDED_STAGE):
+            self.finished = True
+        elif self.run_journal.has_stage(self.user.email, SHEETS_UPDATED_STAGE):
+            # An earlier attempt already moved money and appended orders, so only the remaining stages are redone.
+            self.message, self.figures = self.run_journal.get_delivery(self.user.email)
+            self.from_journal = True
+
+    def needs_user_data(self):
+        return not self.finished and not self.from_journal
+
+    # A stage that raises fails the user's run instead of dropping it from the pipeline, so deliver still counts the failure.
+    def fail(self, message):
+        self.success = False
+        self.message = message
+        self.chart_inputs = []
+        self.figures = []
+
+    def load(self, database):
+        self.prepare()
+        if self.needs_user_data():
+            database.populate_user(self.user)
+
+    def fetch(self):
+        if not self.needs_user_data() or not self.user.loaded:
+            return
         try:
-            message, figures, success = user.notify_buy_orders()
+            for stock in self.user.get_tickers_to_fetch():
+                stock_data_store.get(stock, self.today_date, self.user.get_data_start_date(stock, self.today_date))
         except Exception:
-            message, figures, success = 'Unknown error occured in modeling buy orders.<br>', [], False
-        if success:
-            try:
-                message += user.check_and_update_newly_fulfilled_orders()
-            except Exception:
-                message, figures, success = 'Unknown error occured in updating fulfilled orders.<br>', [], False
-        if success:
+            self.fail('Unknown error occured in fetching market data.<br>')
+
+    def evaluate(self):
+        if not self.needs_user_data() or not self.success:
+            return
+        if not self.user.loaded:
+            self.success = False
+            self.message += self.user.user_error_message
+            return
+        self.user.input_money_to_stock_balances(self.today_date)
+        try:
+            self.message, self.chart_inputs, self.success = self.user.compute_buy_orders()
+        except Exception:
+            self.message, self.chart_inputs, self.success = 'Unknown error occured in modeling buy orders.<br>', [], False
+        if self.success:
             try:
-                user.update_user_sheets()
+                self.message += self.user.check_and_update_newly_fulfilled_orders()
             except Exception:
-                send_fail_email(f'{user.email} failed while updating user values (check that the user sheet is not malformed).')
-    else:
-        success = False
-        message += user.user_error_message
-
-    if not success and user.num_current_day_failures >= MAX_NUM_FAILS:
-        send_fail_email(f'{user.email} reached max num fails.')
-        success = True
-
-    if should_print:
-        print_message = message.replace('<br>', '\n')
-        print(f'Message for user {user.email}:\n{print_message}')
-    if success and should_email:
-        send_email(EmailContent(subject, message, figures, [user.email]))
-
-    if success:
-        user.set_last_date_success(today_date)
-        user.set_num_current_day_fails(0)
-    else:
-        user.set_num_current_day_fails(user.num_current_day_failures + 1)
-
-    return success
-
-def main(data, context):
+                self.message, self.chart_inputs, self.success = 'Unknown error occured in updating fulfilled orders.<br>', [], False
+
+    def render(self):
+        if not self.send_figures:
+            return
+        try:
+            with run_metrics.stage('figure_rendering'):
+                for model, open_prices, stock in self.chart_inputs:
+                    self.figures.append(render_market_figure(model, open_prices, stock))
+        except Exception:
+            self.fail('Unknown error occured in rendering figures.<br>')
+
+    def write_back(self):
+        if not self.needs_user_data() or not self.success:
+            return
+        try:
+            self.user.update_user_sheets()
+            self.run_journal.record_sheets_updated(self.user.email, self.message, self.figures)
+        except Exception:
+            send_fail_email(f'{self.user.email} failed while updating user values (check that the user sheet is not malformed).')
+            return
+        # Archiving is housekeeping; the sheets are already consistent, so a failure here does not fail the user's run.
+        try:
+            self.user.archive_orders(self.today_date)
+        except Exception as e:
+            print(f'{self.user.email} failed to archive orders: {str(e)}')
+
+    def check_max_failures(self):
+        if not self.success and self.user.num_current_day_failures >= MAX_NUM_FAILS:
+            send_fail_email(f'{self.user.email} reached max num fails.')
+            self.success = True
+
+    def record_outcome(self):
+        if self.success:
+            self.user.set_last_date_success(self.today_date)
+            self.user.set_num_current_day_fails(0)
+            self.run_journal.record_success(self.user.email)
+        else:
+            self.user.set_num_current_day_fails(self.user.num_current_day_failures + 1)
+
+    def deliver(self):
+        if self.finished:
+            return
+        self.check_max_failures()
+
+        if self.should_print:
+            print_message = self.message.replace('<br>', '\n')
+            print(f'Message for user {self.user.email}:\n{print_message}')
+        if self.success and self.should_email and not self.run_journal.has_stage(self.user.email, EMAIL_SENT_STAGE):
+            send_email(EmailContent(self.subject, self.message, self.figures, [self.user.email]))
+            self.run_journal.record_email_sent(self.user.email)
+        self.record_outcome()
+
+# Runs every stage for a single, already loaded user.
+def run(user, should_email = False, should_print = False, send_figures = False, run_journal = None) -> bool:
+    today_datetime, today_date = get_today()
+    if run_journal is None:
+        run_journal = open_run_journal(today_date)
+    user_run = UserRun(user, run_journal, today_date, should_email, should_print, send_figures)
+    user_run.prepare()
+    user_run.fetch()
+    user_run.evaluate()
+    user_run.render()
+    user_run.write_back()
+    user_run.deliver()
+    return user_run.success
+
+def get_notifier_pipeline(database):
+    return Pipeline([
+        Stage('load', lambda user_run: user_run.load(database), LOAD_WORKERS),
+        Stage('fetch', UserRun.fetch, FETCH_WORKERS),
+        Stage('evaluate', UserRun.evaluate, EVALUATE_WORKERS),
+        Stage('render', UserRun.render, RENDER_WORKERS),
+        Stage('write_back', UserRun.write_back, WRITE_BACK_WORKERS),
+        Stage('deliver', UserRun.deliver, DELIVER_WORKERS),
+    ], PIPELINE_QUEUE_SIZE, get_scope_name=lambda user_run: user_run.user.email)
+
+def main(data, context, backend = None, run_journal = None):
     should_email = True
     should_print = True
     send_figures = True
 
+    run_metrics.reset()
+    stock_data_store.clear()
+    if backend is None and SQLITE_DATABASE_PATH is not None:
+        backend = SQLiteBackend(SQLITE_DATABASE_PATH)
+    today_datetime, today_date = get_today()
+    if run_journal is None:
+        run_journal = open_run_journal(today_date)
     try:
-        database = Database()
-        users = database.users
+        # On a retry only users without a recorded success are due. User sheets are read by the pipeline, and not at all
+        # for users whose sheets were already updated.
+        database = Database(backend, due_date=today_date, populate_users=False)
+        user_runs = [UserRun(user, run_journal, today_date, should_email, should_print, send_figures) for user in database.users]
     except Exception as e:
         print(f'Database error: {str(e)}')
         send_fail_email(f'Database error: {str(e)}')
-        users = []
+        database, user_runs = None, []
     
+    completed_user_runs, failures = get_notifier_pipeline(database).run(user_runs)
+    # Stages catch the errors of a user's own work, so these are failures of the run's bookkeeping (e.g. sending the email).
+    # They are still counted against the user so that MAX_NUM_FAILS ends the retries.
+    for user_run, stage_name, exception in failures:
+        print(f'{user_run.user.email} failed in {stage_name}: {str(exception)}')
+        user_run.fail(f'Unknown error occured in {stage_name}.<br>')
+        try:
+            user_run.check_max_failures()
+            user_run.record_outcome()
+        except Exception as e:
+            print(f'{user_run.user.email} failed to record its failure: {str(e)}')
+
     all_success = True
-    for user in users:
-        success = run(user, should_email = should_email, should_print = should_print, send_figures = send_figures)
-        all_success = success and all_success
-        print(f'{user.email} Success? : {success}')
+    for user_run in completed_user_runs + [user_run for user_run, _, _ in failures]:
+        all_success = user_run.success and all_success
+        run_metrics.increment('users_processed')
+        if not user_run.success:
+            run_metrics.increment('users_failed')
+        print(f'{user_run.user.email} Success? : {user_run.success}')
 
     print(f'All Success: {all_success}')
+    model_state_store.save()
+    run_metrics.emit(METRICS_FILE_PATH)
     if not all_success:
         raise Exception('Something unsuccessful. Need to retry.')
     
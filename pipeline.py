@@ -0,0 +1,77 @@
+import queue
+import threading
+from contextlib import nullcontext
+
+from instrumentation import run_metrics
+
+DEFAULT_QUEUE_SIZE = 32
+# Put on a queue after the last item. Each worker that reads it puts it back for its siblings before exiting.
+END_OF_ITEMS = object()
+
+class Stage:
+    def __init__(self, name, function, number_of_workers = 1):
+        self.name = name
+        self.function = function
+        self.number_of_workers = number_of_workers
+
+# Runs every item through the stages in order. Each stage has its own worker threads and hands items to the next stage
+# through a bounded queue, so I/O bound stages (Sheets, SMTP) overlap with CPU bound ones and throughput is set by the
+# slowest stage instead of the sum of all stages.
+class Pipeline:
+    def __init__(self, stages, queue_size = DEFAULT_QUEUE_SIZE, get_scope_name = None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.get_scope_name = get_scope_name
+        self.lock = threading.Lock()
+
+    # Returns the items that went through every stage and (item, stage name, exception) for the items a stage raised on.
+    # Items that raise are not passed on to later stages.
+    def run(self, items):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        self.failures = []
+        self.remaining_workers = [stage.number_of_workers for stage in self.stages]
+
+        threads = [threading.Thread(target=self.feed, args=(items, queues[0]), daemon=True)]
+        for stage_index, stage in enumerate(self.stages):
+            for _ in range(stage.number_of_workers):
+                threads.append(threading.Thread(target=self.work, args=(stage_index, queues[stage_index], queues[stage_index + 1]), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        completed_items = []
+        while True:
+            item = queues[-1].get()
+            if item is END_OF_ITEMS:
+                break
+            completed_items.append(item)
+        for thread in threads:
+            thread.join()
+        return completed_items, self.failures
+
+    def feed(self, items, output_queue):
+        for item in items:
+            output_queue.put(item)
+        output_queue.put(END_OF_ITEMS)
+
+    def work(self, stage_index, input_queue, output_queue):
+        stage = self.stages[stage_index]
+        while True:
+            item = input_queue.get()
+            if item is END_OF_ITEMS:
+                input_queue.put(END_OF_ITEMS)
+                break
+            scope = nullcontext() if self.get_scope_name is None else run_metrics.scope(self.get_scope_name(item))
+            try:
+                with scope, run_metrics.stage(f'pipeline_{stage.name}'):
+                    stage.function(item)
+            except Exception as e:
+                with self.lock:
+                    self.failures.append((item, stage.name, e))
+                continue
+            output_queue.put(item)
+
+        with self.lock:
+            self.remaining_workers[stage_index] -= 1
+            is_last_worker = self.remaining_workers[stage_index] == 0
+        if is_last_worker:
+            output_queue.put(END_OF_ITEMS)
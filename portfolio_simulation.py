@@ -0,0 +1,258 @@
+import random
+import time
+from datetime import date, timedelta, datetime
+import pytz
+
+import numpy as np
+import pandas as pd
+from matplotlib import pyplot as plt
+import matplotlib
+
+from simulation import Simulator, DATE_FORMAT
+from stock_data import stock_data_store
+from model import BaseModel, LumpSumModel, NUMBER_OF_DAYS_IN_YEAR
+
+class PortfolioSimulationParameters:
+    def parse_from_dict(self, dict):
+        stocks = str(dict['stocks']).split(';')
+        percentages_to_input = [float(percentage) for percentage in str(dict['percentages_to_input']).split(';')]
+        self.parse_from_inputs(stocks, percentages_to_input, int(dict['random_seed']), datetime.strptime(dict['start_date'], DATE_FORMAT).date(), datetime.strptime(dict['end_date'], DATE_FORMAT).date(), int(dict['start_day_of_cycle']), float(dict['yearly_amount_input']), float(dict['starting_account_balance']), str(dict['fractional_shares']).lower() in ('true', '1'), int(dict['investment_input_cycle_days']))
+
+    def parse_from_inputs(self, stocks: list, percentages_to_input: list, random_seed: int, start_date: date, end_date: date, start_day_of_cycle: int, yearly_amount_input: float, starting_account_balance: float, fractional_shares: bool, investment_input_cycle_days: int):
+        self.stocks = stocks
+        self.percentages_to_input = percentages_to_input
+        self.random_seed = random_seed
+        self.start_date = start_date
+        self.end_date = end_date
+        self.start_day_of_cycle = start_day_of_cycle
+        self.yearly_amount_input = yearly_amount_input
+        self.starting_account_balance = starting_account_balance
+        self.fractional_shares = fractional_shares
+        self.investment_input_cycle_days = investment_input_cycle_days
+
+        assert len(self.stocks) > 0
+        assert len(self.stocks) == len(set(self.stocks))
+        assert len(self.stocks) == len(self.percentages_to_input)
+        assert all(percentage >= 0 for percentage in self.percentages_to_input)
+        assert abs(sum(self.percentages_to_input) - 1) < 1e-3
+        assert self.start_date <= self.end_date
+        assert self.yearly_amount_input > 0
+        assert self.starting_account_balance >= 0
+        assert self.investment_input_cycle_days > 0
+        assert self.start_day_of_cycle < self.investment_input_cycle_days
+
+        return self
+
+    def convert_to_dict(self):
+        return {
+            'stocks': ';'.join(self.stocks),
+            'percentages_to_input': ';'.join(str(percentage) for percentage in self.percentages_to_input),
+            'random_seed': self.random_seed,
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'start_day_of_cycle': self.start_day_of_cycle,
+            'yearly_amount_input': self.yearly_amount_input,
+            'starting_account_balance': self.starting_account_balance,
+            'fractional_shares': self.fractional_shares,
+            'investment_input_cycle_days': self.investment_input_cycle_days,
+        }
+
+# Simulates one account split across several stocks the way the Stocks sheet does it: every deposit (and the starting balance) is divided
+# between the stocks by their percentage to input and each stock spends only its own balance.
+# All stocks are stepped together over the union of their trading calendars (a stock that did not trade on a date keeps its last bar).
+class PortfolioSimulator(Simulator):
+    def __init__(self, simulation_parameters: PortfolioSimulationParameters, data: dict = None):
+        self.debug = False
+        self.profile = False
+        self.data = {} if data is None else dict(data)
+
+        self.reset(simulation_parameters)
+
+    def reset(self, simulation_parameters: PortfolioSimulationParameters):
+        self.stocks = simulation_parameters.stocks
+        self.stock = ';'.join(self.stocks)
+        self.percentages_to_input = np.array(simulation_parameters.percentages_to_input, dtype=float)
+        self.random_seed = simulation_parameters.random_seed
+        self.start_date = simulation_parameters.start_date
+        self.end_date = simulation_parameters.end_date
+        self.start_day_of_cycle = simulation_parameters.start_day_of_cycle
+        self.yearly_amount_input = simulation_parameters.yearly_amount_input
+        self.fractional_shares = simulation_parameters.fractional_shares
+        self.investment_input_cycle_days = simulation_parameters.investment_input_cycle_days
+        self.simulation_parameters = simulation_parameters
+
+        self.account_balances = simulation_parameters.starting_account_balance * self.percentages_to_input
+        self.numbers_stocks_bought = np.zeros(len(self.stocks))
+        self.model_run_dates = []
+        self.cash_over_time = []
+        self.total_value_over_time = []
+        self.stock_value_over_time = []
+        self.cash_over_time_per_stock = []
+        self.stock_value_over_time_per_stock = []
+        self.purchases_per_stock = {stock: [] for stock in self.stocks}
+        self.desired_dollars_to_buy_per_stock = {stock: [] for stock in self.stocks}
+        self.total_cash_received = 0
+        self.reset_profile_stats()
+        random.seed(self.random_seed)
+
+        today_datetime = datetime.now().astimezone(pytz.timezone('US/Eastern'))
+        for stock in self.stocks:
+            if stock not in self.data:
+                self.data[stock] = stock_data_store.get(stock, today_datetime)
+            assert self.start_date >= self.data[stock].iloc[0].name.date() and self.end_date <= self.data[stock].iloc[-1].name.date(), f'Not enough data for {stock}.'
+        self.align_data()
+
+    # Builds one calendar for all stocks with (dates x stocks) open / close matrices and, per stock, the number of its own rows visible on each date.
+    def align_data(self):
+        self.calendar = self.data[self.stocks[0]].index
+        for stock in self.stocks[1:]:
+            self.calendar = self.calendar.union(self.data[stock].index)
+        self.open_prices = np.column_stack([self.data[stock]['Open'].reindex(self.calendar).ffill().values for stock in self.stocks])
+        self.close_prices = np.column_stack([self.data[stock]['Close'].reindex(self.calendar).ffill().values for stock in self.stocks])
+        self.trading_on_date = np.column_stack([self.calendar.isin(self.data[stock].index) for stock in self.stocks])
+        self.visible_rows = np.column_stack([self.data[stock].index.searchsorted(self.calendar, side='right') for stock in self.stocks])
+
+    @property
+    def purchases(self):
+        return [purchase for stock in self.stocks for purchase in self.purchases_per_stock[stock]]
+
+    # Models with incremental state (and not shared between stocks) are fed each stock's new bars as the calendar advances,
+    # instead of being handed the re-sliced history of their stock every day.
+    def reset_model_states(self, models: dict) -> None:
+        number_of_stocks_per_model = {}
+        for stock in self.stocks:
+            number_of_stocks_per_model[id(models[stock])] = number_of_stocks_per_model.get(id(models[stock]), 0) + 1
+        self.incremental_stocks = np.array([models[stock].supports_incremental_state() and number_of_stocks_per_model[id(models[stock])] == 1 for stock in self.stocks])
+        self.fed_rows = np.zeros(len(self.stocks), dtype=int)
+        for ii, stock in enumerate(self.stocks):
+            if self.incremental_stocks[ii]:
+                models[stock].reset_state()
+
+    def analyze_model_state(self, model: BaseModel, stock_index: int, visible_rows: int) -> float:
+        data = self.data[self.stocks[stock_index]]
+        for row in range(self.fed_rows[stock_index], visible_rows):
+            model.update_state(data.index[row].date(), data['Open'].iat[row])
+        self.fed_rows[stock_index] = visible_rows
+        if not self.profile:
+            return model.analyze_state()
+        model_start_time = time.perf_counter()
+        number_to_buy = model.analyze_state()
+        self.profile_model_seconds_per_day.append(time.perf_counter() - model_start_time)
+        self.profile_analyze_stock_calls += 1
+        return number_to_buy
+
+    def get_buy_rates_for_day(self, models: dict, calendar_index: int) -> np.ndarray:
+        buy_rates = np.zeros(len(self.stocks))
+        for ii, stock in enumerate(self.stocks):
+            visible_rows = self.visible_rows[calendar_index, ii]
+            if self.incremental_stocks[ii]:
+                buy_rates[ii] = self.analyze_model_state(models[stock], ii, visible_rows)
+            else:
+                buy_rates[ii] = self.analyze_stock(models[stock], self.data[stock].iloc[:visible_rows])
+        return buy_rates
+
+    def buy_stocks_for_day(self, models: dict, calendar_index: int) -> None:
+        open_prices = self.open_prices[calendar_index]
+        buy_rates = self.get_buy_rates_for_day(models, calendar_index)
+        for ii, stock in enumerate(self.stocks):
+            if self.trading_on_date[calendar_index, ii] and self.calendar[calendar_index].date() == self.model_run_dates[-1]:
+                self.desired_dollars_to_buy_per_stock[stock].append(buy_rates[ii] * open_prices[ii])
+        if not self.fractional_shares:
+            buy_rates = np.array([models[stock].sample_num_stocks_to_buy(buy_rate) for stock, buy_rate in zip(self.stocks, buy_rates)], dtype=float)
+
+        affordable_rates = np.divide(self.account_balances, open_prices, out=np.zeros(len(self.stocks)), where=open_prices > 0)
+        if not self.fractional_shares:
+            affordable_rates = np.floor(affordable_rates)
+        numbers_to_buy = np.where(self.account_balances >= buy_rates * open_prices, buy_rates, affordable_rates)
+
+        self.numbers_stocks_bought += numbers_to_buy
+        self.account_balances -= numbers_to_buy * open_prices
+        for ii, stock in enumerate(self.stocks):
+            self.purchases_per_stock[stock].append([numbers_to_buy[ii], open_prices[ii]])
+
+    def append_nightly_reportings_for_day(self, calendar_index: int) -> None:
+        stock_values = self.numbers_stocks_bought * self.close_prices[calendar_index]
+        self.cash_over_time.append(self.account_balances.sum())
+        self.total_value_over_time.append(self.account_balances.sum() + stock_values.sum())
+        self.stock_value_over_time.append(stock_values.sum())
+        self.cash_over_time_per_stock.append(self.account_balances.copy())
+        self.stock_value_over_time_per_stock.append(stock_values)
+
+    def simulate(self, models: dict):
+        for stock in self.stocks:
+            if not isinstance(models[stock], BaseModel):
+                raise Exception(f'Model for {stock} given to PortfolioSimulator is not a BaseModel instance.')
+        self.reset_model_states(models)
+
+        for ii in range((self.end_date - self.start_date).days + 1):
+            if (self.investment_input_cycle_days - self.start_day_of_cycle + ii) % self.investment_input_cycle_days == 0:
+                input_amount = self.yearly_amount_input * self.investment_input_cycle_days / NUMBER_OF_DAYS_IN_YEAR
+                self.account_balances += input_amount * self.percentages_to_input
+                self.total_cash_received += input_amount
+
+            current_date = self.start_date + timedelta(days=ii)
+            if current_date.weekday() >= 5:
+                continue
+
+            self.model_run_dates.append(current_date)
+            calendar_index = self.calendar.searchsorted(pd.Timestamp(current_date), side='right') - 1
+            self.buy_stocks_for_day(models, calendar_index)
+            self.append_nightly_reportings_for_day(calendar_index)
+
+    def plot(self, log_color_plot = False) -> None:
+        figure, axis = plt.subplots(2, 2)
+        axis[0, 0].plot(self.model_run_dates, self.total_value_over_time)
+        axis[0, 0].set_title("Total value over time")
+        axis[1, 0].plot(self.model_run_dates, self.cash_over_time)
+        axis[1, 0].set_title("Cash over time")
+        axis[0, 1].stackplot(self.model_run_dates, np.array(self.stock_value_over_time_per_stock).T, labels = self.stocks)
+        axis[0, 1].set_title("Stock value over time per stock")
+        axis[0, 1].legend(loc = 'upper left')
+        axis[1, 1].plot(self.model_run_dates, np.array(self.cash_over_time_per_stock), label = self.stocks)
+        axis[1, 1].set_title("Cash over time per stock")
+        axis[1, 1].legend(loc = 'upper left')
+        figure2, axis2 = plt.subplots(len(self.stocks), 1, squeeze = False)
+        for ii, stock in enumerate(self.stocks):
+            # desired_dollars_to_buy_per_stock has an entry for each weekday the stock traded on.
+            evaled_data = self.data[stock].loc[self.start_date:self.end_date]
+            evaled_data = evaled_data[evaled_data.index.weekday < 5]
+            desired_dollars_to_buy = np.array(self.desired_dollars_to_buy_per_stock[stock])
+            colors = np.log(desired_dollars_to_buy) if log_color_plot else desired_dollars_to_buy
+            scatter = axis2[ii, 0].scatter(evaled_data.index, evaled_data['Open'], c = colors, norm=matplotlib.colors.Normalize(), cmap='viridis', s = 5)
+            axis2[ii, 0].set_title(f"Market for {stock} colored by{' LOG ' if log_color_plot else ' '}money input per day")
+            figure2.colorbar(scatter, ax = axis2[ii, 0])
+        figure.show()
+        figure2.show()
+
+    # Purchase prices of different tickers cannot be averaged together, so average_price is only reported per stock.
+    def metrics(self):
+        metrics = super().metrics()
+        metrics.pop('average_price', None)
+        return metrics
+
+    def per_stock_metrics(self):
+        metrics = {}
+        for ii, stock in enumerate(self.stocks):
+            number_of_shares_bought = sum(purchase[0] for purchase in self.purchases_per_stock[stock])
+            purchase_amount_spent = sum(purchase[0] * purchase[1] for purchase in self.purchases_per_stock[stock])
+            end_stock_value = self.stock_value_over_time_per_stock[-1][ii] if len(self.stock_value_over_time_per_stock) > 0 else 0
+            metrics[stock] = {
+                'average_price': purchase_amount_spent / number_of_shares_bought if number_of_shares_bought > 0 else 0,
+                'total_cash_invested': purchase_amount_spent,
+                'end_stock_value': end_stock_value,
+                'end_cash': self.account_balances[ii],
+                'stock_roi': (end_stock_value - purchase_amount_spent) / purchase_amount_spent if purchase_amount_spent > 0 else 0,
+            }
+        return metrics
+
+if __name__ == '__main__':
+    stocks = ['VOO', 'SCHD']
+    percentages_to_input = [0.75, 0.25]
+    yearly_amount_input = 5000
+    simulation_parameters = PortfolioSimulationParameters()
+    simulation_parameters.parse_from_inputs(stocks, percentages_to_input, 12, date(2013, 1, 2), date(2023, 12, 29), 0, yearly_amount_input, 1000, False, 14)
+
+    simulator = PortfolioSimulator(simulation_parameters)
+    simulator.simulate({stock: LumpSumModel(yearly_amount_input * percentage) for stock, percentage in zip(stocks, percentages_to_input)})
+    print(f'Portfolio lump sum:\n{simulator.metrics()}')
+    print(f'Per stock:\n{simulator.per_stock_metrics()}')
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+import pandas as pd
+
+# Bump when simulation or model logic changes so that stale results are not reused.
+CACHE_VERSION = 1
+DEFAULT_MAX_ENTRIES = 500000
+FINGERPRINT_COLUMNS = ['Open', 'Close']
+
+def get_price_row_hashes(data):
+    return pd.util.hash_pandas_object(data[FINGERPRINT_COLUMNS], index=True).values
+
+# Only the rows a simulation ending on end_date can see are hashed, so appending new days to the download keeps old keys valid.
+def get_data_fingerprint(data, row_hashes, end_date):
+    number_of_rows = data.index.searchsorted(pd.Timestamp(end_date), side='right')
+    return hashlib.sha256(row_hashes[:number_of_rows].tobytes()).hexdigest()
+
+# Incremental state (the state_* attributes, see BaseModel.reset_state) changes as a model is run, so it is not part of the key.
+def get_model_hyperparameters(model):
+    return {key: value for key, value in sorted(vars(model).items()) if key != 'name' and not key.startswith('state_') and isinstance(value, (int, float, str, bool, type(None)))}
+
+def get_result_key(simulation_parameters, model, data_fingerprint):
+    key_contents = {
+        'cache_version': CACHE_VERSION,
+        'simulation_parameters': {key: str(value) for key, value in simulation_parameters.convert_to_dict().items()},
+        'model_class': f'{type(model).__module__}.{type(model).__qualname__}',
+        'model_hyperparameters': get_model_hyperparameters(model),
+        'data_fingerprint': data_fingerprint,
+    }
+    return hashlib.sha256(json.dumps(key_contents, sort_keys=True, default=str).encode()).hexdigest()
+
+class ResultCache:
+    def __init__(self, file_path, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(file_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, metrics TEXT NOT NULL, last_access REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)')
+        self.number_of_entries = self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        row = self.connection.execute('SELECT metrics FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute('UPDATE results SET last_access = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key, metrics):
+        already_exists = self.connection.execute('SELECT 1 FROM results WHERE key = ?', (key,)).fetchone() is not None
+        self.connection.execute('INSERT OR REPLACE INTO results (key, metrics, last_access) VALUES (?, ?, ?)', (key, json.dumps(metrics), time.time()))
+        if not already_exists:
+            self.number_of_entries += 1
+        self.evict()
+
+    # Least recently used results are dropped once the store grows past max_entries.
+    def evict(self):
+        if self.number_of_entries <= self.max_entries:
+            return
+        number_to_evict = self.number_of_entries - self.max_entries
+        self.connection.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_access ASC LIMIT ?)', (number_to_evict,))
+        self.number_of_entries -= number_to_evict
+
+    def flush(self):
+        self.connection.commit()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,86 @@
+import os
+import json
+import base64
+import tempfile
+import threading
+
+from instrumentation import run_metrics
+from utils import RenderedFigure
+
+# The per-user stage journal of each day is kept in this directory so that a retried run (even in a new process) can resume.
+# By default it is in the temporary directory, which a retry on the same instance still sees. Point it at persistent storage to
+# also resume on a new instance, or set it to an empty string to keep the journal in memory for one run only.
+DEFAULT_RUN_JOURNAL_PATH = os.path.join(tempfile.gettempdir(), 'finz_run_journals')
+RUN_JOURNAL_PATH = os.environ.get('FINZ_RUN_JOURNAL_PATH', DEFAULT_RUN_JOURNAL_PATH) or None
+SHEETS_UPDATED_STAGE = 'sheets_updated'
+EMAIL_SENT_STAGE = 'email_sent'
+SUCCESS_RECORDED_STAGE = 'success_recorded'
+
+# Append only log of the stages each user finished on one date. A user is never sent the same email or given the
+# same sheet update twice on that date, no matter how many times the notifier is retried.
+class RunJournal:
+    def __init__(self, run_date, journal_path = None):
+        self.run_date = str(run_date)
+        self.lock = threading.Lock()
+        self.user_stages = {}
+        self.deliveries = {}
+        self.file_path = None
+        if journal_path is not None:
+            os.makedirs(journal_path, exist_ok=True)
+            self.file_path = os.path.join(journal_path, f'run_journal_{self.run_date}.jsonl')
+            if os.path.exists(self.file_path):
+                self.replay()
+
+    def replay(self):
+        with open(self.file_path) as journal_file:
+            for line in journal_file:
+                # A partially written last line means the process died while appending it, so that stage did not finish.
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.apply(entry)
+
+    def apply(self, entry):
+        self.user_stages.setdefault(entry['email'], set()).add(entry['stage'])
+        if entry['stage'] == SHEETS_UPDATED_STAGE:
+            figures = [RenderedFigure(title, base64.b64decode(png)) for title, png in entry['figures']]
+            self.deliveries[entry['email']] = (entry['message'], figures)
+
+    def record(self, email, stage, **entry_values):
+        entry = {'email': email, 'stage': stage, **entry_values}
+        with self.lock:
+            if self.file_path is not None:
+                with open(self.file_path, 'a') as journal_file:
+                    journal_file.write(json.dumps(entry) + '\n')
+            self.apply(entry)
+
+    def has_stage(self, email, stage) -> bool:
+        with self.lock:
+            return stage in self.user_stages.get(email, set())
+
+    def get_emails_with_stage(self, stage) -> set:
+        with self.lock:
+            return {email for email, stages in self.user_stages.items() if stage in stages}
+
+    # Stores everything needed to deliver the email, since the sheets no longer hold the state that produced it.
+    def record_sheets_updated(self, email, message, figures):
+        run_metrics.increment('journal_entries')
+        self.record(email, SHEETS_UPDATED_STAGE, message=message, figures=[(figure.title, base64.b64encode(figure.png_bytes).decode()) for figure in figures])
+
+    def get_delivery(self, email):
+        with self.lock:
+            return self.deliveries[email]
+
+    def record_email_sent(self, email):
+        run_metrics.increment('journal_entries')
+        self.record(email, EMAIL_SENT_STAGE)
+
+    def record_success(self, email):
+        run_metrics.increment('journal_entries')
+        self.record(email, SUCCESS_RECORDED_STAGE)
+
+# Journal of run_date that a retry resumes from. When RUN_JOURNAL_PATH is disabled the journal only lives as long as one run,
+# and a retry relies on the "Last Date Success" column alone.
+def open_run_journal(run_date) -> RunJournal:
+    return RunJournal(run_date, RUN_JOURNAL_PATH)
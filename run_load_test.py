@@ -0,0 +1,188 @@
+import sys
+import os
+import time
+import socketserver
+import threading
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import utils
+import notifier
+from utils import get_today
+from storage import FakeSheetsBackend
+from sqlite_storage import SQLiteBackend
+from run_journal import RunJournal
+from stock_data import stock_data_store
+from instrumentation import run_metrics, RUN_SCOPE
+from database import database_spreadsheet_id, investment_input_schedules_spreadsheet_to_enum
+
+NUMBER_OF_USERS = 1000
+NUMBER_OF_TICKERS = 50
+MAX_STOCKS_PER_USER = 4
+MAX_ORDERS_PER_USER = 20
+NUMBER_OF_MARKET_DAYS = 260 * 10
+LOAD_TEST_SEED = 0
+FAKE_SHEETS_BACKEND = 'fake_sheets'
+SQLITE_BACKEND = 'sqlite'
+SQLITE_LOAD_TEST_FILE_PATH = ':memory:'
+
+# Minimal SMTP server that accepts and discards everything, so emails are fully serialized and sent without leaving the machine.
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def send_line(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.send_line('220 finz-sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith('EHLO'):
+                self.send_line('250-finz-sink')
+                self.send_line('250 AUTH PLAIN LOGIN')
+            elif command.startswith('AUTH'):
+                self.send_line('235 Authentication successful')
+            elif command == 'DATA':
+                self.send_line('354 End data with <CR><LF>.<CR><LF>')
+                number_of_bytes = 0
+                for data_line in self.rfile:
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    number_of_bytes += len(data_line)
+                self.server.record_message(number_of_bytes)
+                self.send_line('250 OK')
+            elif command == 'QUIT':
+                self.send_line('221 Bye')
+                return
+            else:
+                self.send_line('250 OK')
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.lock = threading.Lock()
+        self.number_of_messages = 0
+        self.number_of_bytes = 0
+
+    def record_message(self, number_of_bytes):
+        with self.lock:
+            self.number_of_messages += 1
+            self.number_of_bytes += number_of_bytes
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        utils.SMTP_HOST, utils.SMTP_PORT = self.server_address
+        utils.SMTP_USE_SSL = False
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def get_synthetic_tickers(number_of_tickers):
+    return [f'FAKE{ii}' for ii in range(number_of_tickers)]
+
+# Random walk prices ending today are put straight into the shared stock data store so the notifier never downloads anything.
+def stub_market_data(tickers, today_date, rng):
+    dates = pd.bdate_range(end=today_date, periods=NUMBER_OF_MARKET_DAYS)
+    for ticker in tickers:
+        open_prices = rng.uniform(10, 500) * np.exp(np.cumsum(rng.normal(0.0003, 0.01, len(dates))))
+        stock_data_store.stub_data(ticker, today_date, pd.DataFrame({
+            'Open': open_prices,
+            'High': open_prices * 1.01,
+            'Low': open_prices * rng.uniform(0.97, 1.0, len(dates)),
+            'Close': open_prices * rng.uniform(0.99, 1.01, len(dates)),
+            'Adj Close': open_prices,
+            'Volume': rng.integers(1000, 100000, len(dates)),
+        }, index=dates))
+
+def get_percentages_to_input(rng, number_of_stocks):
+    cut_points = np.sort(rng.choice(np.arange(1, 100), size=number_of_stocks - 1, replace=False))
+    return np.diff(np.concatenate([[0], cut_points, [100]]))
+
+def generate_synthetic_user(backend, rng, user_index, tickers, today_date):
+    spreadsheet_id = f'fake-user-spreadsheet-{user_index}'
+    number_of_stocks = int(rng.integers(1, MAX_STOCKS_PER_USER, endpoint=True))
+    stocks = rng.choice(tickers, size=number_of_stocks, replace=False)
+    stock_values = [['Stock', 'Current Balance', 'Percentage to Input']]
+    for stock, percentage in zip(stocks, get_percentages_to_input(rng, number_of_stocks)):
+        stock_values.append([stock, f'${rng.uniform(0, 5000):,.2f}', f'{percentage}%'])
+
+    schedule_values = [['Investment Frequency', 'Amount']]
+    for frequency in rng.choice(list(investment_input_schedules_spreadsheet_to_enum.keys()), size=int(rng.integers(1, 2, endpoint=True)), replace=False):
+        schedule_values.append([frequency, f'${rng.uniform(10, 1000):,.2f}'])
+
+    order_values = [['Date', 'Stock', 'Amount', 'Limit Price', 'Fulfilled?']]
+    for _ in range(int(rng.integers(0, MAX_ORDERS_PER_USER, endpoint=True))):
+        order_date = today_date - timedelta(days=int(rng.integers(1, 60)))
+        order_values.append([str(order_date), rng.choice(stocks), str(int(rng.integers(1, 10))), f'${rng.uniform(10, 500):,.2f}', 'Yes' if rng.random() < 0.7 else 'No'])
+
+    backend.add_worksheet(spreadsheet_id, 'Stocks', stock_values)
+    backend.add_worksheet(spreadsheet_id, 'Investment Schedule', schedule_values)
+    backend.add_worksheet(spreadsheet_id, 'Orders', order_values)
+    return [f'user{user_index}@finz.test', spreadsheet_id, 'Yes', '2020-01-01', 0]
+
+def generate_synthetic_users(backend, number_of_users, tickers, today_date, rng, spreadsheet_id = database_spreadsheet_id):
+    database_values = [['Email', 'Spreadsheet ID', 'Subscribed?', 'Last Date Success', 'Num Current Day Failures']]
+    for user_index in range(number_of_users):
+        database_values.append(generate_synthetic_user(backend, rng, user_index, tickers, today_date))
+    backend.add_worksheet(spreadsheet_id, 'Database', database_values)
+
+def run_load_test(number_of_users = NUMBER_OF_USERS, number_of_tickers = NUMBER_OF_TICKERS, seed = LOAD_TEST_SEED, backend_name = FAKE_SHEETS_BACKEND):
+    rng = np.random.default_rng(seed)
+    today_datetime, today_date = get_today()
+    fake_sheets_backend = FakeSheetsBackend()
+    tickers = get_synthetic_tickers(number_of_tickers)
+    generate_synthetic_users(fake_sheets_backend, number_of_users, tickers, today_date, rng)
+    if backend_name == SQLITE_BACKEND:
+        backend = SQLiteBackend(SQLITE_LOAD_TEST_FILE_PATH)
+        backend.import_from(fake_sheets_backend, database_spreadsheet_id)
+    else:
+        backend = fake_sheets_backend
+
+    smtp_sink = SMTPSink()
+    smtp_sink.start()
+    stub_market_data(tickers, today_date, rng)
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    all_success = True
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            # A fresh in-memory journal, so neither an earlier run in this process nor FINZ_RUN_JOURNAL_PATH skips any user.
+            notifier.main('Load test.', 'Load test context.', backend=backend, run_journal=RunJournal(today_date))
+    except Exception:
+        all_success = False
+    total_seconds = time.perf_counter() - start_time
+    _, peak_memory_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    smtp_sink.stop()
+
+    run_record = [record for record in run_metrics.get_records() if record['scope'] == RUN_SCOPE][0]
+    return {
+        'number_of_users': number_of_users,
+        'all_success': all_success,
+        'total_seconds': total_seconds,
+        'users_per_second': number_of_users / total_seconds,
+        'backend': backend_name,
+        'sheets_api_calls': dict(fake_sheets_backend.api_calls) if backend_name == FAKE_SHEETS_BACKEND else {},
+        'emails_received': smtp_sink.number_of_messages,
+        'email_bytes_received': smtp_sink.number_of_bytes,
+        'peak_memory_mb': peak_memory_bytes / 1e6,
+        'stage_seconds': run_record['stage_seconds'],
+        'counters': run_record['counters'],
+    }
+
+if __name__ == '__main__':
+    number_of_users = int(sys.argv[1]) if len(sys.argv) > 1 else NUMBER_OF_USERS
+    backend_name = sys.argv[2] if len(sys.argv) > 2 else FAKE_SHEETS_BACKEND
+    results = run_load_test(number_of_users, backend_name=backend_name)
+    for key, value in results.items():
+        print(f'{key}: {value}')
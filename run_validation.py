@@ -1,21 +1,31 @@
 import os
 import json
+import cProfile
 from tqdm import tqdm
 from datetime import datetime
 import pytz
 import pandas as pd
 from matplotlib import pyplot as plt
 
-from simulation import Simulator, SimulationParameters, EXAMPLE_STAT_KEY
-from utils import get_data_for_stock
+from simulation import Simulator, SimulationParameters, CycleSweepSimulator, CYCLE_SWEEP_SHARED_PARAMETERS, EXAMPLE_STAT_KEY
+from stock_data import stock_data_store
+from result_cache import ResultCache, get_price_row_hashes, get_data_fingerprint, get_result_key
+from trace_store import TraceRecorder
 from model import BaseModel, ConstantDollarRandomModel, LumpSumModel, LinearRegressionModel, WeightedLinearRegressionModel,LinearDistributionModel, LumpLinearDistributionModel, FutureLimitModel, NUMBER_OF_STOCK_DAYS_IN_YEAR
 
 VALIDATION_PATH = 'validation_sets/'
 RESULT_PATH = 'validation_results/'
 SAVE_BUFFER = 400
+PROFILE_PATH = RESULT_PATH + 'profiles/'
+PROFILE_SHARD_SIZE = 1000
+RESULT_CACHE_PATH = RESULT_PATH + 'result_cache.sqlite'
+TRACE_PATH = RESULT_PATH + 'traces/'
 
 class Validation():
-    def __init__(self, model_list: list, input_file_path, result_file_path):
+    # With batch_cycle_sweeps, rows that only differ in their input cycle are simulated together by a CycleSweepSimulator
+    # (profiling and trace recording need one simulation per row, so they turn this off).
+    # With a trace_recorder every row is simulated (the result cache is only written to) and its daily series are recorded.
+    def __init__(self, model_list: list, input_file_path, result_file_path, profile: bool = False, profile_path = PROFILE_PATH, profile_shard_size: int = PROFILE_SHARD_SIZE, result_cache: ResultCache = None, batch_cycle_sweeps: bool = True, trace_recorder: TraceRecorder = None):
         for model in model_list:
             if not isinstance(model, BaseModel):
                 raise Exception('Model in model_list given to Validation object is not a BaseModel instance.')
@@ -23,6 +33,16 @@ class Validation():
         self.input_file_path = input_file_path
         self.result_file_path = result_file_path
         self.downloaded_data = {}
+        self.profile = profile
+        self.profile_path = profile_path
+        self.profile_shard_size = profile_shard_size
+        self.profile_records = []
+        self.profiler = None
+        self.result_cache = result_cache
+        self.data_row_hashes = {}
+        self.trace_recorder = trace_recorder
+        self.batch_cycle_sweeps = batch_cycle_sweeps and not profile and trace_recorder is None
+        self.batched_metrics = {}
 
         if os.path.exists(result_file_path):
             self.df = pd.read_csv(result_file_path)
@@ -31,19 +51,117 @@ class Validation():
 
         model_names = [model.name for model in self.model_list]
         assert len(model_names) == len(set(model_names)), 'Duplicate model names. Results will be overwritten.'
+
+        self.cycle_sweep_groups = {}
+        if self.batch_cycle_sweeps:
+            for row_indices in self.df.groupby(CYCLE_SWEEP_SHARED_PARAMETERS, sort=False).indices.values():
+                if len(row_indices) > 1:
+                    for row_index in row_indices:
+                        self.cycle_sweep_groups[row_index] = row_indices
     
-    def run_instance_with_model(self, simulation_parameters: SimulationParameters, model: BaseModel):
-        if simulation_parameters.stock not in self.downloaded_data:
+    def get_result_key(self, simulation_parameters: SimulationParameters, model: BaseModel):
+        stock = simulation_parameters.stock
+        if stock not in self.data_row_hashes:
+            self.data_row_hashes[stock] = get_price_row_hashes(self.downloaded_data[stock])
+        data_fingerprint = get_data_fingerprint(self.downloaded_data[stock], self.data_row_hashes[stock], simulation_parameters.end_date)
+        return get_result_key(simulation_parameters, model, data_fingerprint)
+
+    def load_data(self, stock):
+        if stock not in self.downloaded_data:
             today_datetime = datetime.now().astimezone(pytz.timezone('US/Eastern'))
-            self.downloaded_data[simulation_parameters.stock] = get_data_for_stock(simulation_parameters.stock, today_datetime)
-        simulator = Simulator(simulation_parameters, data=self.downloaded_data[simulation_parameters.stock])
+            self.downloaded_data[stock] = stock_data_store.get(stock, today_datetime)
+
+    def has_result(self, row_index, model: BaseModel):
+        column = f'{model.name}_{EXAMPLE_STAT_KEY}'
+        return column in self.df.columns and not pd.isna(self.df.loc[row_index, column])
+
+    # Simulates the rows of row_index's cycle sweep group that still need model in one pass. Results are picked up by run_instance_with_model.
+    def run_cycle_sweep(self, row_index, model: BaseModel):
+        if row_index not in self.cycle_sweep_groups or (row_index, model.name) in self.batched_metrics:
+            return
+        sweep_rows = []
+        for sweep_row_index in self.cycle_sweep_groups[row_index]:
+            if self.has_result(sweep_row_index, model):
+                continue
+            simulation_parameters = SimulationParameters()
+            simulation_parameters.parse_from_dict(self.df.iloc[sweep_row_index])
+            sweep_rows.append((sweep_row_index, simulation_parameters))
+        self.load_data(sweep_rows[0][1].stock)
+        model.annual_money_input = sweep_rows[0][1].yearly_amount_input
+
+        uncached_sweep_rows = []
+        for sweep_row_index, simulation_parameters in sweep_rows:
+            cached_metrics = self.result_cache.get(self.get_result_key(simulation_parameters, model)) if self.result_cache is not None else None
+            if cached_metrics is not None:
+                self.batched_metrics[(sweep_row_index, model.name)] = cached_metrics
+            else:
+                uncached_sweep_rows.append((sweep_row_index, simulation_parameters))
+        if len(uncached_sweep_rows) == 0:
+            return
+
+        cycle_sweep_simulator = CycleSweepSimulator([simulation_parameters for _, simulation_parameters in uncached_sweep_rows], data=self.downloaded_data[sweep_rows[0][1].stock])
+        cycle_sweep_simulator.simulate(model)
+        for (sweep_row_index, simulation_parameters), metrics in zip(uncached_sweep_rows, cycle_sweep_simulator.metrics()):
+            self.batched_metrics[(sweep_row_index, model.name)] = metrics
+            if self.result_cache is not None:
+                self.result_cache.set(self.get_result_key(simulation_parameters, model), metrics)
+
+    def run_instance_with_model(self, simulation_parameters: SimulationParameters, model: BaseModel, validation_row = None):
+        if (validation_row, model.name) in self.batched_metrics:
+            return self.batched_metrics.pop((validation_row, model.name))
+        self.load_data(simulation_parameters.stock)
         model.annual_money_input = simulation_parameters.yearly_amount_input
+
+        if self.result_cache is not None:
+            result_key = self.get_result_key(simulation_parameters, model)
+            cached_metrics = self.result_cache.get(result_key) if self.trace_recorder is None else None
+            if cached_metrics is not None:
+                return cached_metrics
+
+        simulator = Simulator(simulation_parameters, data=self.downloaded_data[simulation_parameters.stock], profile=self.profile)
         simulator.simulate(model)
-        return simulator.metrics()
+        metrics = simulator.metrics()
+        if self.profile:
+            self.profile_records.append({**simulator.profile_stats(), 'validation_row': validation_row})
+        if self.trace_recorder is not None:
+            self.trace_recorder.record(validation_row, model.name, simulator.get_trace())
+        if self.result_cache is not None:
+            self.result_cache.set(result_key, metrics)
+        return metrics
+
+    def get_profile_file_prefix(self):
+        return self.profile_path + os.path.splitext(os.path.basename(self.result_file_path))[0]
+
+    # Each shard of rows gets its own cProfile dump (viewable with pstats or snakeviz) so slow regions of the validation set can be found.
+    def start_profile_shard(self, row_index):
+        if not self.profile or row_index % self.profile_shard_size != 0:
+            return
+        self.finish_profile_shard()
+        self.profiler = cProfile.Profile()
+        self.profiler_shard_index = row_index // self.profile_shard_size
+        self.profiler.enable()
+
+    def finish_profile_shard(self):
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        os.makedirs(self.profile_path, exist_ok=True)
+        self.profiler.dump_stats(f'{self.get_profile_file_prefix()}_shard_{self.profiler_shard_index}.prof')
+        self.profiler = None
+        self.save_profile_records()
+
+    def save_profile_records(self):
+        if len(self.profile_records) == 0:
+            return
+        os.makedirs(self.profile_path, exist_ok=True)
+        profile_file_path = f'{self.get_profile_file_prefix()}_profile.csv'
+        pd.DataFrame(self.profile_records).to_csv(profile_file_path, mode='a', header=not os.path.exists(profile_file_path), index=False)
+        self.profile_records = []
     
     def run(self):
         save_counter = 0
         for ii in tqdm(range(self.df.shape[0]), desc='Simulation Instance'):
+            self.start_profile_shard(ii)
             eval_dictionary = self.df.iloc[ii]
             simulation_parameters = SimulationParameters()
             simulation_parameters.parse_from_dict(eval_dictionary)
@@ -51,15 +169,24 @@ class Validation():
                 if f'{model.name}_{EXAMPLE_STAT_KEY}' in eval_dictionary.keys() and not pd.isna(eval_dictionary[f'{model.name}_{EXAMPLE_STAT_KEY}']):
                     continue
 
-                stats = validation.run_instance_with_model(simulation_parameters, model)
+                self.run_cycle_sweep(ii, model)
+                stats = self.run_instance_with_model(simulation_parameters, model, validation_row=ii)
                 stats = {f'{model.name}_{stat}': value for stat, value in stats.items()}
                 self.df.loc[ii, stats.keys()] = pd.Series(stats)
 
                 save_counter += 1
                 if save_counter >= SAVE_BUFFER:
-                    self.df.to_csv(self.result_file_path, index=False)
+                    self.save()
                     save_counter = 0
+        self.finish_profile_shard()
+        self.save()
+
+    def save(self):
         self.df.to_csv(self.result_file_path, index=False)
+        if self.result_cache is not None:
+            self.result_cache.flush()
+        if self.trace_recorder is not None:
+            self.trace_recorder.flush()
             
 
 if __name__ == '__main__':
@@ -73,5 +200,8 @@ if __name__ == '__main__':
     lump_sum_model = LumpSumModel(yearly_amount_input)
     lump_linear_distribution_model = LumpLinearDistributionModel(yearly_amount_input, 0.85, 5)
     future_limit_model = FutureLimitModel(yearly_amount_input, 0.997, 10)
-    validation = Validation([constant_dollar_random_model, lump_sum_model, lump_linear_distribution_model, future_limit_model], input_file_path, result_file_path)
-    validation.run()
\ No newline at end of file
+    result_cache = ResultCache(RESULT_CACHE_PATH)
+    validation = Validation([constant_dollar_random_model, lump_sum_model, lump_linear_distribution_model, future_limit_model], input_file_path, result_file_path, result_cache=result_cache)
+    validation.run()
+    print(f'Result cache hits: {result_cache.hits} | misses: {result_cache.misses}')
+    result_cache.close()
\ No newline at end of file
@@ -0,0 +1,90 @@
+import pandas as pd
+
+TEXT = 'text'
+CURRENCY = 'currency'
+PERCENTAGE = 'percentage'
+NUMBER = 'number'
+DATE = 'date'
+DATE_FORMAT = '%Y-%m-%d'
+USER_ERROR_PREFIX = 'Error loading user values from spreadsheet: '
+
+def get_user_error_message(message):
+    return f'{USER_ERROR_PREFIX}{message}<br>'
+
+# How one column is parsed and checked. A message is only used when its check is enabled (i.e. it is not None).
+class ColumnSchema:
+    def __init__(self, name, kind, format_message = None, invalid_message = None, negative_message = None, duplicate_message = None, allowed_values = None, allowed_values_message = None):
+        self.name = name
+        self.kind = kind
+        self.format_message = format_message
+        self.invalid_message = invalid_message
+        self.negative_message = negative_message
+        self.duplicate_message = duplicate_message
+        self.allowed_values = allowed_values
+        self.allowed_values_message = allowed_values_message
+
+# Columns of a user sheet. Rows with an empty key_column value are dropped before parsing.
+class SheetSchema:
+    def __init__(self, columns, missing_columns_message, key_column = None):
+        self.columns = columns
+        self.missing_columns_message = missing_columns_message
+        self.key_column = key_column
+
+    def has_columns(self, data) -> bool:
+        return all(column.name in data for column in self.columns)
+
+def get_sheet_frame(values) -> pd.DataFrame:
+    return pd.DataFrame(values[1:], columns=values[0])
+
+# Whole column parse of one column. Returns the parsed column and the messages of every check it fails.
+# Values that fail to parse are NaN / NaT in the returned column.
+def parse_column(values, column: ColumnSchema):
+    text = values.astype(str)
+    errors = []
+    if column.kind == TEXT:
+        parsed = text
+    elif column.kind == DATE:
+        parsed = pd.to_datetime(text, format=DATE_FORMAT, errors='coerce')
+        if parsed.isna().any():
+            errors.append(column.invalid_message)
+        parsed = parsed.dt.date
+    else:
+        if column.kind == CURRENCY:
+            has_format = text.str.startswith('$')
+            numbers = text.str[1:].str.replace(',', '', regex=False)
+        elif column.kind == PERCENTAGE:
+            has_format = text.str.endswith('%')
+            numbers = text.str[:-1]
+        else:
+            has_format = pd.Series(True, index=text.index)
+            numbers = text
+        parsed = pd.to_numeric(numbers.str.strip(), errors='coerce').astype(float).where(has_format)
+        if column.kind == PERCENTAGE:
+            parsed = parsed / 100
+        if column.format_message is not None and not has_format.all():
+            errors.append(column.format_message)
+        if (has_format & parsed.isna()).any():
+            errors.append(column.invalid_message)
+        if column.negative_message is not None and (parsed < 0).any():
+            errors.append(column.negative_message)
+
+    if column.duplicate_message is not None and parsed.duplicated().any():
+        errors.append(column.duplicate_message)
+    if column.allowed_values is not None:
+        if not text.isin(column.allowed_values.keys()).all():
+            errors.append(column.allowed_values_message)
+        parsed = text.map(column.allowed_values)
+    return parsed, errors
+
+# Parses every column of data in one pass and collects the messages of all failed checks (each message once, as user error messages).
+def parse_sheet(data, schema: SheetSchema):
+    if not schema.has_columns(data):
+        return data, [get_user_error_message(schema.missing_columns_message)]
+    if schema.key_column is not None:
+        data = data[data[schema.key_column].astype(str) != '']
+    data = data.copy()
+    errors = []
+    for column in schema.columns:
+        data[column.name], column_errors = parse_column(data[column.name], column)
+        errors += column_errors
+    return data, list(dict.fromkeys(get_user_error_message(error) for error in errors))
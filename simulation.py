@@ -1,4 +1,5 @@
 import random
+import time
 from datetime import date, timedelta, datetime
 import pytz
 from tqdm import tqdm
@@ -52,8 +53,9 @@ class SimulationParameters:
         }
 
 class Simulator():
-    def __init__(self, simulation_parameters: SimulationParameters, data = None, debug: bool = False):
+    def __init__(self, simulation_parameters: SimulationParameters, data = None, debug: bool = False, profile: bool = False):
         self.debug = debug
+        self.profile = profile
         self.data = data
 
         self.reset(simulation_parameters)
@@ -77,6 +79,8 @@ class Simulator():
         self.desired_dollars_to_buy = []
         self.number_stocks_bought = 0
         self.total_cash_received = 0
+        self.simulation_parameters = simulation_parameters
+        self.reset_profile_stats()
         random.seed(self.random_seed)
         
         if self.data is None:
@@ -94,8 +98,23 @@ class Simulator():
         input()
         plt.close(figure)
         
-    def buy_stocks(self, model: BaseModel, daily_input_data, open_price: float, stock_market_is_open: bool) -> None:
+    def reset_profile_stats(self) -> None:
+        self.profile_model_name = None
+        self.profile_slicing_seconds = 0
+        self.profile_model_seconds_per_day = []
+        self.profile_analyze_stock_calls = 0
+
+    def analyze_stock(self, model: BaseModel, daily_input_data) -> float:
+        if not self.profile:
+            return model.analyze_stock(daily_input_data)
+        model_start_time = time.perf_counter()
         number_to_buy = model.analyze_stock(daily_input_data)
+        self.profile_model_seconds_per_day.append(time.perf_counter() - model_start_time)
+        self.profile_analyze_stock_calls += 1
+        return number_to_buy
+
+    def buy_stocks(self, model: BaseModel, daily_input_data, open_price: float, stock_market_is_open: bool) -> None:
+        number_to_buy = self.analyze_stock(model, daily_input_data)
         if stock_market_is_open:
             self.desired_dollars_to_buy.append(number_to_buy * open_price)
         if self.debug and daily_input_data.shape[0] % 60 == 0:
@@ -121,6 +140,8 @@ class Simulator():
         self.stock_value_over_time.append(self.number_stocks_bought * close_price)
         
     def simulate(self, model: BaseModel):
+        if self.profile:
+            self.profile_model_name = getattr(model, 'name', type(model).__name__)
         for ii in range((self.end_date - self.start_date).days + 1):
             if (self.investment_input_cycle_days - self.start_day_of_cycle + ii) % self.investment_input_cycle_days == 0:
                 input_amount = self.yearly_amount_input * self.investment_input_cycle_days / NUMBER_OF_DAYS_IN_YEAR
@@ -133,9 +154,12 @@ class Simulator():
                 continue
 
             self.model_run_dates.append(current_date)
+            slicing_start_time = time.perf_counter() if self.profile else None
             daily_input_data = self.data.loc[:current_date]
             open_price = daily_input_data['Open'].iloc[-1]
             close_price = daily_input_data['Close'].iloc[-1]
+            if self.profile:
+                self.profile_slicing_seconds += time.perf_counter() - slicing_start_time
             
             self.buy_stocks(model, daily_input_data, open_price, stock_market_is_open)
             
@@ -160,24 +184,146 @@ class Simulator():
         figure.show()
         figure2.show()
         
-    def metrics(self):
-        purchase_amount_spent = [purchase[0] * purchase[1] for purchase in self.purchases]
-        if sum([purchase[0] for purchase in self.purchases]) == 0 or sum(purchase_amount_spent) == 0 or self.total_cash_received == 0 or len(self.cash_over_time) == 0:
-            return {}
-        metrics = {
-            'average_price': sum(purchase_amount_spent) / sum([purchase[0] for purchase in self.purchases]),
-            'average_cash': average(self.cash_over_time),
-            'end_total_value': self.total_value_over_time[-1],
-            'end_stock_value': self.stock_value_over_time[-1],
-            'total_cash_received': self.total_cash_received,
-            'total_cash_invested': sum(purchase_amount_spent),
-            'total_roi': (self.total_value_over_time[-1] - self.total_cash_received) / self.total_cash_received,
-            'stock_roi': (self.stock_value_over_time[-1] - sum(purchase_amount_spent)) / sum(purchase_amount_spent),
-            'total_annual_roi': (self.total_value_over_time[-1] / self.total_cash_received) ** (NUMBER_OF_DAYS_IN_YEAR / (self.end_date - self.start_date).days) - 1,
-            'stock_annual_roi': (self.stock_value_over_time[-1] / sum(purchase_amount_spent)) ** (NUMBER_OF_DAYS_IN_YEAR / (self.end_date - self.start_date).days) - 1,
+    # Daily series of the last simulate call, in the form trace_store.TraceRecorder stores them.
+    def get_trace(self):
+        return {
+            'date': self.model_run_dates,
+            'cash': self.cash_over_time,
+            'total_value': self.total_value_over_time,
+            'stock_value': self.stock_value_over_time,
+            'purchase_shares': [float(purchase[0]) for purchase in self.purchases],
+            'purchase_price': [float(purchase[1]) for purchase in self.purchases],
+            'desired_dollars_to_buy': self.desired_dollars_to_buy,
         }
-        assert EXAMPLE_STAT_KEY in metrics.keys()
-        return metrics
+
+    # Timing of the last simulate call, attributed to the model and simulation parameters that produced it.
+    def profile_stats(self):
+        model_seconds = sum(self.profile_model_seconds_per_day)
+        number_of_days = len(self.profile_model_seconds_per_day)
+        return {
+            'model_name': self.profile_model_name,
+            **self.simulation_parameters.convert_to_dict(),
+            'simulated_days': len(self.model_run_dates),
+            'analyze_stock_calls': self.profile_analyze_stock_calls,
+            'slicing_seconds': self.profile_slicing_seconds,
+            'model_seconds': model_seconds,
+            'mean_model_seconds_per_day': model_seconds / number_of_days if number_of_days > 0 else 0,
+            'max_model_seconds_per_day': max(self.profile_model_seconds_per_day, default=0),
+        }
+
+    def metrics(self):
+        return get_metrics(
+            sum([purchase[0] for purchase in self.purchases]),
+            sum([purchase[0] * purchase[1] for purchase in self.purchases]),
+            self.total_cash_received,
+            sum(self.cash_over_time),
+            len(self.cash_over_time),
+            self.total_value_over_time[-1] if len(self.total_value_over_time) > 0 else 0,
+            self.stock_value_over_time[-1] if len(self.stock_value_over_time) > 0 else 0,
+            (self.end_date - self.start_date).days)
+
+def get_metrics(number_of_shares_bought, total_cash_invested, total_cash_received, sum_of_cash_over_time, number_of_model_run_dates, end_total_value, end_stock_value, number_of_days):
+    if number_of_shares_bought == 0 or total_cash_invested == 0 or total_cash_received == 0 or number_of_model_run_dates == 0:
+        return {}
+    metrics = {
+        'average_price': total_cash_invested / number_of_shares_bought,
+        'average_cash': sum_of_cash_over_time / number_of_model_run_dates,
+        'end_total_value': end_total_value,
+        'end_stock_value': end_stock_value,
+        'total_cash_received': total_cash_received,
+        'total_cash_invested': total_cash_invested,
+        'total_roi': (end_total_value - total_cash_received) / total_cash_received,
+        'stock_roi': (end_stock_value - total_cash_invested) / total_cash_invested,
+        'total_annual_roi': (end_total_value / total_cash_received) ** (NUMBER_OF_DAYS_IN_YEAR / number_of_days) - 1,
+        'stock_annual_roi': (end_stock_value / total_cash_invested) ** (NUMBER_OF_DAYS_IN_YEAR / number_of_days) - 1,
+    }
+    assert EXAMPLE_STAT_KEY in metrics.keys()
+    return metrics
+
+# Parameters that all configurations of one CycleSweepSimulator must share (only the input cycle may differ).
+CYCLE_SWEEP_SHARED_PARAMETERS = ['stock', 'random_seed', 'start_date', 'end_date', 'yearly_amount_input', 'starting_account_balance', 'fractional_shares']
+
+# Simulates many investment_input_cycle_days / start_day_of_cycle configurations of the same run in one pass.
+# Buy rates only depend on prices and random draws only on the seed, so both are computed once per day and shared.
+# Only the cash flows differ, and those are kept as numpy arrays with one entry per configuration.
+# Gives the same metrics as running Simulator on each configuration.
+class CycleSweepSimulator:
+    def __init__(self, simulation_parameters_list: list, data = None):
+        first_parameters = simulation_parameters_list[0]
+        for simulation_parameters in simulation_parameters_list:
+            for parameter in CYCLE_SWEEP_SHARED_PARAMETERS:
+                assert getattr(simulation_parameters, parameter) == getattr(first_parameters, parameter), f'All configurations of a cycle sweep must have the same {parameter}.'
+        self.simulation_parameters_list = simulation_parameters_list
+        self.stock = first_parameters.stock
+        self.random_seed = first_parameters.random_seed
+        self.start_date = first_parameters.start_date
+        self.end_date = first_parameters.end_date
+        self.yearly_amount_input = first_parameters.yearly_amount_input
+        self.starting_account_balance = first_parameters.starting_account_balance
+        self.fractional_shares = first_parameters.fractional_shares
+        self.investment_input_cycle_days = np.array([simulation_parameters.investment_input_cycle_days for simulation_parameters in simulation_parameters_list])
+        self.start_day_of_cycle = np.array([simulation_parameters.start_day_of_cycle for simulation_parameters in simulation_parameters_list])
+        self.data = data
+
+        if self.data is None:
+            today_datetime = datetime.now().astimezone(pytz.timezone('US/Eastern'))
+            self.data = get_data_for_stock(self.stock, today_datetime)
+        assert self.start_date >= self.data.iloc[0].name.date() and self.end_date <= self.data.iloc[-1].name.date()
+
+    # Cash added to each configuration (rows) on each day of the simulation (columns).
+    def get_input_schedule(self):
+        days = np.arange((self.end_date - self.start_date).days + 1)
+        is_input_day = (self.investment_input_cycle_days[:, None] - self.start_day_of_cycle[:, None] + days[None, :]) % self.investment_input_cycle_days[:, None] == 0
+        input_amounts = self.yearly_amount_input * self.investment_input_cycle_days / NUMBER_OF_DAYS_IN_YEAR
+        return np.where(is_input_day, input_amounts[:, None], 0.0)
+
+    def simulate(self, model: BaseModel):
+        random.seed(self.random_seed)
+        input_schedule = self.get_input_schedule()
+        number_of_configurations = len(self.simulation_parameters_list)
+        self.account_balance = np.full(number_of_configurations, float(self.starting_account_balance))
+        self.number_stocks_bought = np.zeros(number_of_configurations)
+        self.total_cash_received = np.zeros(number_of_configurations)
+        self.total_cash_invested = np.zeros(number_of_configurations)
+        self.sum_of_cash_over_time = np.zeros(number_of_configurations)
+        self.end_total_value = np.zeros(number_of_configurations)
+        self.end_stock_value = np.zeros(number_of_configurations)
+        self.number_of_model_run_dates = 0
+
+        for ii in range(input_schedule.shape[1]):
+            self.account_balance += input_schedule[:, ii]
+            self.total_cash_received += input_schedule[:, ii]
+
+            current_date = self.start_date + timedelta(days=ii)
+            if current_date.weekday() >= 5:
+                continue
+
+            self.number_of_model_run_dates += 1
+            daily_input_data = self.data.loc[:current_date]
+            open_price = daily_input_data['Open'].iloc[-1]
+            close_price = daily_input_data['Close'].iloc[-1]
+
+            number_to_buy = model.analyze_stock(daily_input_data)
+            if not self.fractional_shares:
+                number_to_buy = model.sample_num_stocks_to_buy(number_to_buy)
+            affordable_number_to_buy = self.account_balance / open_price if open_price > 0 else np.zeros(number_of_configurations)
+            if not self.fractional_shares:
+                affordable_number_to_buy = np.floor(affordable_number_to_buy)
+            number_bought = np.where(self.account_balance >= number_to_buy * open_price, number_to_buy, affordable_number_to_buy)
+
+            self.number_stocks_bought += number_bought
+            self.account_balance -= number_bought * open_price
+            self.total_cash_invested += number_bought * open_price
+            self.sum_of_cash_over_time += self.account_balance
+            self.end_total_value = self.account_balance + self.number_stocks_bought * close_price
+            self.end_stock_value = self.number_stocks_bought * close_price
+
+    # One metrics dictionary per configuration, in the order of simulation_parameters_list.
+    def metrics(self):
+        return [
+            get_metrics(self.number_stocks_bought[ii], self.total_cash_invested[ii], self.total_cash_received[ii], self.sum_of_cash_over_time[ii], self.number_of_model_run_dates, self.end_total_value[ii], self.end_stock_value[ii], (self.end_date - self.start_date).days)
+            for ii in range(len(self.simulation_parameters_list))
+        ]
 
 if __name__ == '__main__':
     stock = 'SPY'
@@ -0,0 +1,285 @@
+import sqlite3
+import threading
+
+from instrumentation import run_metrics
+from storage import StorageBackend, Worksheet, WorksheetNotFoundException, StorageAPIException, SHEET_COLUMN_FORMATS, parse_cell_reference, format_cell_value, parse_cell_value, cast_record_value
+
+# Sheet name -> (table, [(sheet column, table column)]) in sheet column order.
+USER_SHEET_TABLES = {
+    'Stocks': ('holdings', [('Stock', 'stock'), ('Current Balance', 'current_balance'), ('Percentage to Input', 'percentage_to_input')]),
+    'Investment Schedule': ('schedules', [('Investment Frequency', 'investment_frequency'), ('Amount', 'amount')]),
+    'Orders': ('orders', [('Date', 'date'), ('Stock', 'stock'), ('Amount', 'amount'), ('Limit Price', 'limit_price'), ('Fulfilled?', 'fulfilled')]),
+    'Orders Archive': ('order_archive', [('Date', 'date'), ('Stock', 'stock'), ('Amount', 'amount'), ('Limit Price', 'limit_price'), ('Fulfilled?', 'fulfilled')]),
+}
+# Sheets that older user spreadsheets may not have. A user is still imported without them.
+OPTIONAL_USER_SHEETS = ['Orders Archive']
+DATABASE_SHEET_COLUMNS = [('Email', 'email'), ('Spreadsheet ID', 'spreadsheet_id'), ('Subscribed?', 'subscribed'), ('Last Date Success', 'last_date_success'), ('Num Current Day Failures', 'num_current_day_failures')]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    row_index INTEGER PRIMARY KEY,
+    email TEXT NOT NULL,
+    spreadsheet_id TEXT NOT NULL,
+    subscribed TEXT NOT NULL,
+    last_date_success TEXT NOT NULL,
+    num_current_day_failures INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_due ON users (subscribed, last_date_success);
+CREATE TABLE IF NOT EXISTS spreadsheets (spreadsheet_id TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS holdings (
+    spreadsheet_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    stock TEXT,
+    current_balance REAL,
+    percentage_to_input REAL,
+    PRIMARY KEY (spreadsheet_id, position)
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    spreadsheet_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    investment_frequency TEXT,
+    amount REAL,
+    PRIMARY KEY (spreadsheet_id, position)
+);
+CREATE TABLE IF NOT EXISTS orders (
+    spreadsheet_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    date TEXT,
+    stock TEXT,
+    amount TEXT,
+    limit_price REAL,
+    fulfilled TEXT,
+    PRIMARY KEY (spreadsheet_id, position)
+);
+CREATE INDEX IF NOT EXISTS orders_open_by_stock ON orders (fulfilled, stock);
+CREATE TABLE IF NOT EXISTS order_archive (
+    spreadsheet_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    date TEXT,
+    stock TEXT,
+    amount TEXT,
+    limit_price REAL,
+    fulfilled TEXT,
+    PRIMARY KEY (spreadsheet_id, position)
+);
+'''
+
+# The database sheet backed by the users table. Row indices match the sheet (row 1 is the header).
+class SQLiteDatabaseWorksheet(Worksheet):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_all_values(self) -> list:
+        rows = self.backend.execute(f'SELECT {", ".join(column for _, column in DATABASE_SHEET_COLUMNS)} FROM users ORDER BY row_index').fetchall()
+        return [[sheet_column for sheet_column, _ in DATABASE_SHEET_COLUMNS]] + [[str(value) for value in row] for row in rows]
+
+    def get_all_records(self) -> list:
+        values = self.get_all_values()
+        return [{key: cast_record_value(value) for key, value in zip(values[0], row)} for row in values[1:]]
+
+    def update(self, range_name: str, values: list) -> None:
+        start_row, start_column = parse_cell_reference(range_name.split(':')[0])
+        with self.backend.transaction():
+            for ii, row in enumerate(values):
+                for jj, value in enumerate(row):
+                    self.set_value(start_row + ii, start_column + jj, value)
+
+    def update_cell(self, row: int, col: int, value) -> None:
+        with self.backend.transaction():
+            self.set_value(row, col, value)
+
+    def set_value(self, row, col, value):
+        if row == 1:
+            return
+        if col > len(DATABASE_SHEET_COLUMNS):
+            raise StorageAPIException(f'Column {col} does not exist in the users table.')
+        column = DATABASE_SHEET_COLUMNS[col - 1][1]
+        self.backend.execute("INSERT OR IGNORE INTO users (row_index, email, spreadsheet_id, subscribed, last_date_success, num_current_day_failures) VALUES (?, '', '', 'No', '', 0)", (row,))
+        self.backend.execute(f'UPDATE users SET {column} = ? WHERE row_index = ?', (value, row))
+
+# One user sheet backed by its table. Writes that include the header row replace every row of the user in one transaction;
+# writes below the header only touch the rows and columns they cover.
+class SQLiteUserWorksheet(Worksheet):
+    def __init__(self, backend, spreadsheet_id, worksheet_name):
+        self.backend = backend
+        self.spreadsheet_id = spreadsheet_id
+        self.table, self.columns = USER_SHEET_TABLES[worksheet_name]
+        self.column_formats = SHEET_COLUMN_FORMATS.get(worksheet_name, {})
+
+    def get_all_values(self) -> list:
+        rows = self.backend.execute(f'SELECT {", ".join(column for _, column in self.columns)} FROM {self.table} WHERE spreadsheet_id = ? ORDER BY position', (self.spreadsheet_id,)).fetchall()
+        header = [sheet_column for sheet_column, _ in self.columns]
+        return [header] + [[format_cell_value(value, self.column_formats.get(sheet_column)) for (sheet_column, _), value in zip(self.columns, row)] for row in rows]
+
+    def get_all_records(self) -> list:
+        values = self.get_all_values()
+        return [{key: cast_record_value(value) for key, value in zip(values[0], row)} for row in values[1:]]
+
+    def update(self, range_name: str, values: list) -> None:
+        start_row, start_column = parse_cell_reference(range_name.split(':')[0])
+        if start_row > 1:
+            with self.backend.transaction():
+                for ii, row in enumerate(values):
+                    for jj, value in enumerate(row):
+                        self.set_value(start_row + ii, start_column + jj, value)
+            return
+        if start_column != 1 or len(values) == 0:
+            raise StorageAPIException('SQLite user sheets only support updates of the whole sheet starting at A1.')
+        column_indices = [values[0].index(sheet_column) if sheet_column in values[0] else None for sheet_column, _ in self.columns]
+        rows = []
+        for position, row in enumerate(values[1:]):
+            rows.append([self.spreadsheet_id, position] + [parse_cell_value(row[index], self.column_formats.get(sheet_column)) if index is not None and index < len(row) else None for (sheet_column, _), index in zip(self.columns, column_indices)])
+        with self.backend.transaction():
+            self.backend.execute(f'DELETE FROM {self.table} WHERE spreadsheet_id = ?', (self.spreadsheet_id,))
+            self.backend.executemany(f'INSERT INTO {self.table} (spreadsheet_id, position, {", ".join(column for _, column in self.columns)}) VALUES ({", ".join(["?"] * (len(self.columns) + 2))})', rows)
+
+    def update_cell(self, row: int, col: int, value) -> None:
+        with self.backend.transaction():
+            self.set_value(row, col, value)
+
+    def set_value(self, row, col, value):
+        if row == 1 or col > len(self.columns):
+            raise StorageAPIException('SQLite user sheets cannot change their header.')
+        sheet_column, column = self.columns[col - 1]
+        self.backend.execute(f'INSERT OR IGNORE INTO {self.table} (spreadsheet_id, position) VALUES (?, ?)', (self.spreadsheet_id, row - 2))
+        self.backend.execute(f'UPDATE {self.table} SET {column} = ? WHERE spreadsheet_id = ? AND position = ?', (parse_cell_value(value, self.column_formats.get(sheet_column)), self.spreadsheet_id, row - 2))
+
+    def batch_update(self, updates: list) -> None:
+        with self.backend.transaction():
+            for range_name, values in updates:
+                self.update(range_name=range_name, values=values)
+
+    # Rows are in sheet column order.
+    def append_rows(self, values: list) -> None:
+        with self.backend.transaction():
+            start_position = self.backend.execute(f'SELECT COALESCE(MAX(position) + 1, 0) FROM {self.table} WHERE spreadsheet_id = ?', (self.spreadsheet_id,)).fetchone()[0]
+            rows = [[self.spreadsheet_id, start_position + ii] + [parse_cell_value(value, self.column_formats.get(sheet_column)) for (sheet_column, _), value in zip(self.columns, row)] + [None] * (len(self.columns) - len(row)) for ii, row in enumerate(values)]
+            self.backend.executemany(f'INSERT INTO {self.table} (spreadsheet_id, position, {", ".join(column for _, column in self.columns)}) VALUES ({", ".join(["?"] * (len(self.columns) + 2))})', rows)
+
+    def delete_rows(self, start_row: int, end_row: int) -> None:
+        if start_row == 1:
+            raise StorageAPIException('SQLite user sheets cannot change their header.')
+        start_position, end_position = start_row - 2, end_row - 2
+        with self.backend.transaction():
+            self.backend.execute(f'DELETE FROM {self.table} WHERE spreadsheet_id = ? AND position BETWEEN ? AND ?', (self.spreadsheet_id, start_position, end_position))
+            # Shifted through negative positions so that no intermediate state breaks the primary key.
+            self.backend.execute(f'UPDATE {self.table} SET position = -(position - ?) - 1 WHERE spreadsheet_id = ? AND position > ?', (end_position - start_position + 1, self.spreadsheet_id, end_position))
+            self.backend.execute(f'UPDATE {self.table} SET position = -position - 1 WHERE spreadsheet_id = ? AND position < 0', (self.spreadsheet_id,))
+
+# Local store for all user state with indexed tables for users, holdings, schedules and orders.
+# Google Sheets can still be used as a presentation layer through import_from / sync_to.
+class SQLiteBackend(StorageBackend):
+    def __init__(self, file_path, database_spreadsheet_id = None):
+        self.file_path = file_path
+        self.database_spreadsheet_id = database_spreadsheet_id
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(file_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+
+    def execute(self, sql, parameters = ()):
+        run_metrics.increment('sqlite_queries')
+        with self.lock:
+            try:
+                return self.connection.execute(sql, parameters)
+            except sqlite3.Error as e:
+                raise StorageAPIException(str(e))
+
+    def executemany(self, sql, parameters):
+        run_metrics.increment('sqlite_queries')
+        with self.lock:
+            try:
+                return self.connection.executemany(sql, parameters)
+            except sqlite3.Error as e:
+                raise StorageAPIException(str(e))
+
+    def transaction(self):
+        return SQLiteTransaction(self)
+
+    def open_worksheet(self, spreadsheet_id: str, worksheet_name: str) -> Worksheet:
+        if worksheet_name == 'Database' and (self.database_spreadsheet_id is None or spreadsheet_id == self.database_spreadsheet_id):
+            return SQLiteDatabaseWorksheet(self)
+        if worksheet_name not in USER_SHEET_TABLES or self.execute('SELECT 1 FROM spreadsheets WHERE spreadsheet_id = ?', (spreadsheet_id,)).fetchone() is None:
+            raise WorksheetNotFoundException(f'{spreadsheet_id}/{worksheet_name}')
+        return SQLiteUserWorksheet(self, spreadsheet_id, worksheet_name)
+
+    # Every user sheet already has its table, so this only checks that the sheet is known.
+    def create_worksheet(self, spreadsheet_id: str, worksheet_name: str, header: list) -> Worksheet:
+        return self.open_worksheet(spreadsheet_id, worksheet_name)
+
+    def add_spreadsheet(self, spreadsheet_id: str) -> None:
+        self.execute('INSERT OR IGNORE INTO spreadsheets (spreadsheet_id) VALUES (?)', (spreadsheet_id,))
+
+    def get_due_user_records(self, database_sheet: Worksheet, today_date) -> list:
+        rows = self.execute(f'SELECT row_index, {", ".join(column for _, column in DATABASE_SHEET_COLUMNS)} FROM users WHERE subscribed = ? AND last_date_success != ? ORDER BY row_index', ('Yes', str(today_date))).fetchall()
+        return [(row[0], {sheet_column: value for (sheet_column, _), value in zip(DATABASE_SHEET_COLUMNS, row[1:])}) for row in rows]
+
+    # Unfulfilled orders across all users, optionally for one stock, as (spreadsheet id, date, stock, amount, limit price) rows.
+    def get_open_orders(self, stock = None) -> list:
+        if stock is None:
+            return self.execute("SELECT spreadsheet_id, date, stock, amount, limit_price FROM orders WHERE fulfilled != 'Yes' AND stock != ''").fetchall()
+        return self.execute("SELECT spreadsheet_id, date, stock, amount, limit_price FROM orders WHERE fulfilled != 'Yes' AND stock = ?", (stock,)).fetchall()
+
+    def get_open_order_spreadsheet_ids(self):
+        return {row[0] for row in self.execute("SELECT DISTINCT spreadsheet_id FROM orders WHERE fulfilled != 'Yes' AND stock != ''").fetchall()}
+
+    def get_user_spreadsheet_ids(self) -> list:
+        return [row[0] for row in self.execute('SELECT spreadsheet_id FROM users ORDER BY row_index').fetchall()]
+
+    # Copies every user (and their sheets) from another backend, e.g. to migrate from Google Sheets.
+    def import_from(self, backend: StorageBackend, database_spreadsheet_id: str) -> None:
+        database_values = backend.open_worksheet(database_spreadsheet_id, 'Database').get_all_values()
+        with self.transaction():
+            self.execute('DELETE FROM users')
+            self.open_worksheet(database_spreadsheet_id, 'Database').update(range_name='A1', values=database_values)
+        for spreadsheet_id in self.get_user_spreadsheet_ids():
+            try:
+                worksheets = {worksheet_name: backend.open_worksheet(spreadsheet_id, worksheet_name) for worksheet_name in USER_SHEET_TABLES if worksheet_name not in OPTIONAL_USER_SHEETS}
+            except WorksheetNotFoundException:
+                continue
+            for worksheet_name in OPTIONAL_USER_SHEETS:
+                try:
+                    worksheets[worksheet_name] = backend.open_worksheet(spreadsheet_id, worksheet_name)
+                except WorksheetNotFoundException:
+                    pass
+            self.add_spreadsheet(spreadsheet_id)
+            for worksheet_name, worksheet in worksheets.items():
+                self.open_worksheet(spreadsheet_id, worksheet_name).update(range_name='A1', values=worksheet.get_all_values())
+
+    # Pushes the stored state to another backend so users keep seeing their values in Google Sheets.
+    def sync_to(self, backend: StorageBackend, database_spreadsheet_id: str) -> None:
+        backend.open_worksheet(database_spreadsheet_id, 'Database').update(range_name='A1', values=self.open_worksheet(database_spreadsheet_id, 'Database').get_all_values())
+        for spreadsheet_id in self.get_user_spreadsheet_ids():
+            for worksheet_name in USER_SHEET_TABLES:
+                try:
+                    values = self.open_worksheet(spreadsheet_id, worksheet_name).get_all_values()
+                    backend.open_worksheet(spreadsheet_id, worksheet_name).update(range_name='A1', values=values)
+                except WorksheetNotFoundException:
+                    continue
+
+    def close(self):
+        self.connection.close()
+
+class SQLiteTransaction:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __enter__(self):
+        self.backend.lock.acquire()
+        if not self.backend.connection.in_transaction:
+            self.backend.connection.execute('BEGIN')
+            self.owns_transaction = True
+        else:
+            self.owns_transaction = False
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        try:
+            if self.owns_transaction:
+                if exception_type is None:
+                    self.backend.connection.execute('COMMIT')
+                else:
+                    self.backend.connection.execute('ROLLBACK')
+        finally:
+            self.backend.lock.release()
+        return False
@@ -0,0 +1,94 @@
+import os
+import threading
+
+import pandas as pd
+
+from utils import get_data_for_stock, ticker_exists
+from instrumentation import run_metrics
+
+# Downloads each (stock, end date) pair once per process and optionally keeps a pickled copy on disk between processes.
+# Callers can ask for the history from a start date only; a stored download is reused whenever it reaches back far enough.
+# Returned frames are shared between callers and must not be modified in place.
+class StockDataStore:
+    def __init__(self, cache_path = None):
+        self.cache_path = cache_path
+        self.data = {}
+        self.data_start_dates = {}
+        self.valid_tickers = {}
+        self.stubbed_data = {}
+        self.lock = threading.Lock()
+        self.stock_locks = {}
+
+    def get_cache_file_path(self, stock, end_date, start_date = None):
+        if start_date is None:
+            return os.path.join(self.cache_path, f'{stock}_{end_date}.pkl')
+        return os.path.join(self.cache_path, f'{stock}_{start_date}_{end_date}.pkl')
+
+    def get_stock_lock(self, key):
+        with self.lock:
+            if key not in self.stock_locks:
+                self.stock_locks[key] = threading.Lock()
+            return self.stock_locks[key]
+
+    # A start date of None is the full history, which covers every other request.
+    def covers(self, key, start_date):
+        if key not in self.data:
+            return False
+        stored_start_date = self.data_start_dates[key]
+        return stored_start_date is None or (start_date is not None and stored_start_date <= start_date)
+
+    def get(self, stock, end_date, start_date = None):
+        end_date = pd.Timestamp(end_date).date()
+        start_date = None if start_date is None else pd.Timestamp(start_date).date()
+        key = (stock, end_date)
+        if key in self.stubbed_data:
+            run_metrics.increment('cache_hits')
+            return self.stubbed_data[key]
+        with self.get_stock_lock(key):
+            if self.covers(key, start_date):
+                run_metrics.increment('cache_hits')
+                return self.data[key]
+
+            if self.cache_path is not None and os.path.exists(self.get_cache_file_path(stock, end_date)):
+                run_metrics.increment('cache_hits')
+                data = pd.read_pickle(self.get_cache_file_path(stock, end_date))
+                start_date = None
+            elif self.cache_path is not None and os.path.exists(self.get_cache_file_path(stock, end_date, start_date)):
+                run_metrics.increment('cache_hits')
+                data = pd.read_pickle(self.get_cache_file_path(stock, end_date, start_date))
+            else:
+                run_metrics.increment('cache_misses')
+                data = get_data_for_stock(stock, end_date, start_date)
+                if self.cache_path is not None:
+                    os.makedirs(self.cache_path, exist_ok=True)
+                    data.to_pickle(self.get_cache_file_path(stock, end_date, start_date))
+            self.data[key] = data
+            self.data_start_dates[key] = start_date
+            return data
+
+    # Many users hold the same tickers, so each one is only checked once per process.
+    def ticker_exists(self, stock):
+        if any(stubbed_stock == stock for stubbed_stock, _ in self.stubbed_data.keys()):
+            run_metrics.increment('cache_hits')
+            return True
+        with self.lock:
+            if stock in self.valid_tickers:
+                run_metrics.increment('cache_hits')
+                return self.valid_tickers[stock]
+        exists = ticker_exists(stock)
+        with self.lock:
+            self.valid_tickers[stock] = exists
+        return exists
+
+    # Stubbed data is served instead of downloading and survives clear (used for offline load tests).
+    def stub_data(self, stock, end_date, data):
+        self.stubbed_data[(stock, pd.Timestamp(end_date).date())] = data
+
+    def clear(self):
+        with self.lock:
+            self.data = {}
+            self.data_start_dates = {}
+            self.valid_tickers = {}
+            self.stock_locks = {}
+
+stock_data_store = StockDataStore()
@@ -0,0 +1,306 @@
+import re
+import threading
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+from instrumentation import run_metrics
+
+SCOPE = ['https://www.googleapis.com/auth/spreadsheets']
+CREDENTIALS_FILE_PATH = 'spreadsheet_creds.json'
+CURRENCY_FORMAT = 'currency'
+PERCENTAGE_FORMAT = 'percentage'
+# Number formats applied by the user spreadsheet template. Numbers written to these columns are read back as formatted strings.
+SHEET_COLUMN_FORMATS = {
+    'Stocks': {'Current Balance': CURRENCY_FORMAT, 'Percentage to Input': PERCENTAGE_FORMAT},
+    'Investment Schedule': {'Amount': CURRENCY_FORMAT},
+    'Orders': {'Limit Price': CURRENCY_FORMAT},
+    'Orders Archive': {'Limit Price': CURRENCY_FORMAT},
+}
+
+class WorksheetNotFoundException(Exception):
+    'Thrown when a spreadsheet or worksheet does not exist in the storage backend.'
+    pass
+
+class StorageAPIException(Exception):
+    'Thrown when the storage backend fails to read or write values.'
+    pass
+
+# Database and User only talk to worksheets through this interface (the subset of gspread.Worksheet they use).
+class Worksheet:
+    def get_all_values(self) -> list:
+        raise NotImplementedError()
+
+    def get_all_records(self) -> list:
+        raise NotImplementedError()
+
+    def update(self, range_name: str, values: list) -> None:
+        raise NotImplementedError()
+
+    def update_cell(self, row: int, col: int, value) -> None:
+        raise NotImplementedError()
+
+    # Writes several (range name, values) pairs. Backends that can do this in a single request should override it.
+    def batch_update(self, updates: list) -> None:
+        for range_name, values in updates:
+            self.update(range_name=range_name, values=values)
+
+    # Writes values after the last non empty row.
+    def append_rows(self, values: list) -> None:
+        self.update(range_name=f'A{len(self.get_all_values()) + 1}', values=values)
+
+    # Deletes the rows start_row to end_row (inclusive, 1 based). Rows below move up.
+    def delete_rows(self, start_row: int, end_row: int) -> None:
+        raise NotImplementedError()
+
+class StorageBackend:
+    def open_worksheet(self, spreadsheet_id: str, worksheet_name: str) -> Worksheet:
+        raise NotImplementedError()
+
+    # Adds a worksheet with only a header row to an existing spreadsheet.
+    def create_worksheet(self, spreadsheet_id: str, worksheet_name: str, header: list) -> Worksheet:
+        raise NotImplementedError()
+
+    # Returns (database row index, record) pairs of subscribed users that have not succeeded on today_date yet.
+    # Backends with an index on the user table should override this instead of scanning every record.
+    def get_due_user_records(self, database_sheet: Worksheet, today_date) -> list:
+        records = database_sheet.get_all_records()
+        return [(ii + 2, record) for ii, record in enumerate(records) if record['Subscribed?'] == 'Yes' and str(record['Last Date Success']) != str(today_date)]
+
+    # Spreadsheet ids of users with unfulfilled orders, or None when the backend cannot answer without reading every Orders sheet.
+    def get_open_order_spreadsheet_ids(self):
+        return None
+
+class GspreadWorksheet(Worksheet):
+    def __init__(self, worksheet, client_lock):
+        self.worksheet = worksheet
+        self.client_lock = client_lock
+
+    def call(self, method_name, *args, **kwargs):
+        run_metrics.increment('sheets_api_calls')
+        try:
+            with self.client_lock:
+                return getattr(self.worksheet, method_name)(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            raise StorageAPIException(str(e))
+
+    def get_all_values(self) -> list:
+        return self.call('get_all_values')
+
+    def get_all_records(self) -> list:
+        return self.call('get_all_records')
+
+    def update(self, range_name: str, values: list) -> None:
+        self.call('update', range_name=range_name, values=values)
+
+    def update_cell(self, row: int, col: int, value) -> None:
+        self.call('update_cell', row, col, value)
+
+    def batch_update(self, updates: list) -> None:
+        self.call('batch_update', [{'range': range_name, 'values': values} for range_name, values in updates])
+
+    def append_rows(self, values: list) -> None:
+        self.call('append_rows', values)
+
+    def delete_rows(self, start_row: int, end_row: int) -> None:
+        self.call('delete_rows', start_row, end_row)
+
+# A gspread client sends every request through one HTTP session, which is not safe to use from several threads at once.
+# Each thread therefore opens its own client (and caches the spreadsheets it opened with it), and every call through a
+# client holds that client's lock, also when a worksheet it opened is used later from another pipeline thread.
+class GspreadClient:
+    def __init__(self, google_credentials):
+        self.client = gspread.authorize(google_credentials)
+        self.lock = threading.Lock()
+        self.spreadsheets = {}
+
+    def get_spreadsheet(self, spreadsheet_id: str):
+        if spreadsheet_id not in self.spreadsheets:
+            run_metrics.increment('sheets_api_calls')
+            with self.lock:
+                self.spreadsheets[spreadsheet_id] = self.client.open_by_key(spreadsheet_id)
+        return self.spreadsheets[spreadsheet_id]
+
+class GspreadBackend(StorageBackend):
+    def __init__(self, credentials_file_path = CREDENTIALS_FILE_PATH):
+        self.google_credentials = ServiceAccountCredentials.from_json_keyfile_name(credentials_file_path, SCOPE)
+        self.clients = threading.local()
+
+    def get_client(self) -> GspreadClient:
+        if not hasattr(self.clients, 'client'):
+            self.clients.client = GspreadClient(self.google_credentials)
+        return self.clients.client
+
+    def open_worksheet(self, spreadsheet_id: str, worksheet_name: str) -> Worksheet:
+        try:
+            client = self.get_client()
+            spreadsheet = client.get_spreadsheet(spreadsheet_id)
+            run_metrics.increment('sheets_api_calls')
+            with client.lock:
+                return GspreadWorksheet(spreadsheet.worksheet(worksheet_name), client.lock)
+        except (gspread.exceptions.SpreadsheetNotFound, gspread.exceptions.WorksheetNotFound):
+            raise WorksheetNotFoundException(f'{spreadsheet_id}/{worksheet_name}')
+        except gspread.exceptions.APIError as e:
+            raise StorageAPIException(str(e))
+
+    def create_worksheet(self, spreadsheet_id: str, worksheet_name: str, header: list) -> Worksheet:
+        try:
+            client = self.get_client()
+            spreadsheet = client.get_spreadsheet(spreadsheet_id)
+            run_metrics.increment('sheets_api_calls')
+            with client.lock:
+                worksheet = GspreadWorksheet(spreadsheet.add_worksheet(title=worksheet_name, rows=1, cols=len(header)), client.lock)
+        except gspread.exceptions.SpreadsheetNotFound:
+            raise WorksheetNotFoundException(spreadsheet_id)
+        except gspread.exceptions.APIError as e:
+            raise StorageAPIException(str(e))
+        worksheet.update(range_name='A1', values=[header])
+        return worksheet
+
+def parse_cell_reference(cell_reference):
+    match = re.fullmatch(r'([A-Z]+)(\d*)', cell_reference)
+    column = 0
+    for letter in match.group(1):
+        column = column * 26 + ord(letter) - ord('A') + 1
+    row = int(match.group(2)) if match.group(2) != '' else 1
+    return row, column
+
+# Inverse of parse_cell_reference, e.g. (2, 5) -> 'E2'.
+def format_cell_reference(row, column):
+    letters = ''
+    while column > 0:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return f'{letters}{row}'
+
+def format_cell_value(value, cell_format):
+    if isinstance(value, str) or value is None:
+        return '' if value is None else value
+    if cell_format == CURRENCY_FORMAT:
+        return f'${value:,.2f}'
+    if cell_format == PERCENTAGE_FORMAT:
+        return f'{value * 100:.2f}%'
+    return str(value)
+
+# Inverse of format_cell_value. Values that do not parse are kept as text so that malformed user input is still reported by User.
+def parse_cell_value(value, cell_format):
+    if not isinstance(value, str):
+        return value
+    try:
+        if cell_format == CURRENCY_FORMAT and value.startswith('$'):
+            return float(value[1:].replace(',', ''))
+        if cell_format == PERCENTAGE_FORMAT and value.endswith('%'):
+            return float(value[:-1]) / 100
+    except ValueError:
+        pass
+    return value
+
+def cast_record_value(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+# In-process stand-in for a Google Sheets worksheet. Values are kept as strings like the Sheets API returns them.
+class FakeWorksheet(Worksheet):
+    def __init__(self, backend, values, worksheet_name = None):
+        self.backend = backend
+        self.column_formats = SHEET_COLUMN_FORMATS.get(worksheet_name, {})
+        self.values = [[str(value) for value in row] for row in values]
+
+    def get_all_values(self) -> list:
+        self.backend.count_api_call('read')
+        with self.backend.lock:
+            width = max([len(row) for row in self.values], default=0)
+            values = [row + [''] * (width - len(row)) for row in self.values]
+            while len(values) > 0 and all(value == '' for value in values[-1]):
+                values.pop()
+            return values
+
+    # Like gspread, numeric looking cells are returned as numbers.
+    def get_all_records(self) -> list:
+        values = self.get_all_values()
+        if len(values) == 0:
+            return []
+        header = values[0]
+        return [{key: cast_record_value(value) for key, value in zip(header, row)} for row in values[1:]]
+
+    def set_value(self, row, col, value):
+        while len(self.values) < row:
+            self.values.append([])
+        while len(self.values[row - 1]) < col:
+            self.values[row - 1].append('')
+        header = self.values[0] if row > 1 else []
+        cell_format = self.column_formats.get(header[col - 1]) if col <= len(header) else None
+        self.values[row - 1][col - 1] = format_cell_value(value, cell_format)
+
+    # Only the top left cell of range_name is used; values are written from there like the Sheets API does.
+    def update(self, range_name: str, values: list) -> None:
+        self.backend.count_api_call('write')
+        start_row, start_column = parse_cell_reference(range_name.split(':')[0])
+        with self.backend.lock:
+            for ii, row in enumerate(values):
+                for jj, value in enumerate(row):
+                    self.set_value(start_row + ii, start_column + jj, value)
+
+    def update_cell(self, row: int, col: int, value) -> None:
+        self.backend.count_api_call('write')
+        with self.backend.lock:
+            self.set_value(row, col, value)
+
+    def batch_update(self, updates: list) -> None:
+        self.backend.count_api_call('write')
+        with self.backend.lock:
+            for range_name, values in updates:
+                start_row, start_column = parse_cell_reference(range_name.split(':')[0])
+                for ii, row in enumerate(values):
+                    for jj, value in enumerate(row):
+                        self.set_value(start_row + ii, start_column + jj, value)
+
+    def append_rows(self, values: list) -> None:
+        self.backend.count_api_call('write')
+        with self.backend.lock:
+            start_row = len(self.values) + 1
+            while start_row > 1 and all(value == '' for value in self.values[start_row - 2]):
+                start_row -= 1
+            for ii, row in enumerate(values):
+                for jj, value in enumerate(row):
+                    self.set_value(start_row + ii, jj + 1, value)
+
+    def delete_rows(self, start_row: int, end_row: int) -> None:
+        self.backend.count_api_call('write')
+        with self.backend.lock:
+            del self.values[start_row - 1:end_row]
+
+class FakeSheetsBackend(StorageBackend):
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.spreadsheets = {}
+        self.api_calls = {'open': 0, 'read': 0, 'write': 0}
+
+    def count_api_call(self, kind):
+        run_metrics.increment('sheets_api_calls')
+        with self.lock:
+            self.api_calls[kind] += 1
+
+    def add_worksheet(self, spreadsheet_id: str, worksheet_name: str, values: list) -> FakeWorksheet:
+        with self.lock:
+            worksheet = FakeWorksheet(self, values, worksheet_name)
+            self.spreadsheets.setdefault(spreadsheet_id, {})[worksheet_name] = worksheet
+            return worksheet
+
+    def open_worksheet(self, spreadsheet_id: str, worksheet_name: str) -> Worksheet:
+        self.count_api_call('open')
+        with self.lock:
+            if spreadsheet_id not in self.spreadsheets or worksheet_name not in self.spreadsheets[spreadsheet_id]:
+                raise WorksheetNotFoundException(f'{spreadsheet_id}/{worksheet_name}')
+            return self.spreadsheets[spreadsheet_id][worksheet_name]
+
+    def create_worksheet(self, spreadsheet_id: str, worksheet_name: str, header: list) -> Worksheet:
+        self.count_api_call('write')
+        with self.lock:
+            if spreadsheet_id not in self.spreadsheets:
+                raise WorksheetNotFoundException(spreadsheet_id)
+            return self.add_worksheet(spreadsheet_id, worksheet_name, [header])
@@ -0,0 +1,129 @@
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+from database import Database, ORDERS_ARCHIVE_WORKSHEET_NAME, ORDER_ARCHIVE_HORIZON_DAYS, ORDER_ARCHIVE_MIN_ORDERS
+from model import FutureLimitModel, LinearRegressionModel, NUMBER_OF_STOCK_DAYS_IN_YEAR
+from stock_data import stock_data_store
+from storage import FakeSheetsBackend
+from utils import get_start_date_for_bars
+
+DATABASE_SPREADSHEET_ID = 'fake-database'
+USER_SPREADSHEET_ID = 'fake-user'
+TODAY = date(2026, 10, 19)
+ORDERS_HEADER = ['Date', 'Stock', 'Amount', 'Limit Price', 'Fulfilled?']
+
+@pytest.fixture(autouse=True)
+def valid_tickers(monkeypatch):
+    monkeypatch.setattr(stock_data_store, 'ticker_exists', lambda stock: True)
+
+def get_order(days_ago, stock = 'AAA', fulfilled = 'Yes'):
+    return [str(TODAY - timedelta(days=days_ago)), stock, '2', '$10.00', fulfilled]
+
+# Amounts are parsed as floats, so rows written back by the notifier have them as e.g. '2.0' (as the full rewrite did).
+def get_written_order(order):
+    return order[:2] + [str(float(order[2]))] + order[3:]
+
+def get_user(order_values):
+    backend = FakeSheetsBackend()
+    backend.add_worksheet(DATABASE_SPREADSHEET_ID, 'Database', [
+        ['Email', 'Spreadsheet ID', 'Subscribed?', 'Last Date Success', 'Num Current Day Failures'],
+        ['user@finz.test', USER_SPREADSHEET_ID, 'Yes', '2020-01-01', 0],
+    ])
+    backend.add_worksheet(USER_SPREADSHEET_ID, 'Stocks', [['Stock', 'Current Balance', 'Percentage to Input'], ['AAA', '$100.00', '60%'], ['BBB', '$50.00', '40%']])
+    backend.add_worksheet(USER_SPREADSHEET_ID, 'Investment Schedule', [['Investment Frequency', 'Amount'], ['Weekly on Mondays', '$10.00']])
+    backend.add_worksheet(USER_SPREADSHEET_ID, 'Orders', [ORDERS_HEADER] + order_values)
+    user = Database(backend, DATABASE_SPREADSHEET_ID).users[0]
+    assert user.loaded, user.user_error_message
+    return backend, user
+
+def record_batch_updates(worksheet, monkeypatch):
+    batch_updates = []
+    write_batch_update = worksheet.batch_update
+    def batch_update(updates):
+        batch_updates.append(updates)
+        write_batch_update(updates)
+    monkeypatch.setattr(worksheet, 'batch_update', batch_update)
+    return batch_updates
+
+def get_orders_sheet_values(backend, worksheet_name = 'Orders'):
+    return backend.open_worksheet(USER_SPREADSHEET_ID, worksheet_name).get_all_values()
+
+def test_update_orders_sheet_writes_only_changed_and_new_rows(monkeypatch):
+    backend, user = get_user([get_order(5), get_order(4, fulfilled='No'), get_order(3, 'BBB', 'No'), get_order(2)])
+    batch_updates = record_batch_updates(user.orders_sheet, monkeypatch)
+    number_of_writes = backend.api_calls['write']
+
+    user.orders_data.loc[1, 'Fulfilled?'] = 'Yes'
+    new_order = pd.DataFrame([{'Date': TODAY, 'Stock': 'AAA', 'Amount': 3, 'Limit Price': 12.5, 'Fulfilled?': 'No'}])
+    user.orders_data = pd.concat([user.orders_data, new_order], ignore_index=True)
+    user.update_orders_sheet()
+
+    assert batch_updates == [[('E3', [['Yes']]), ('A6', [[str(TODAY), 'AAA', 3.0, 12.5, 'No']])]]
+    assert backend.api_calls['write'] == number_of_writes + 1
+    assert get_orders_sheet_values(backend) == [
+        ORDERS_HEADER,
+        get_order(5),
+        get_order(4),
+        get_order(3, 'BBB', 'No'),
+        get_order(2),
+        [str(TODAY), 'AAA', '3.0', '$12.50', 'No'],
+    ]
+
+    # Nothing changed since the last write, so nothing is sent.
+    user.update_orders_sheet()
+    assert len(batch_updates) == 1
+    assert backend.api_calls['write'] == number_of_writes + 1
+
+def get_archive_test_orders(number_of_old_fulfilled_orders):
+    old_fulfilled_orders = [get_order(ORDER_ARCHIVE_HORIZON_DAYS + 1 + ii) for ii in range(number_of_old_fulfilled_orders)]
+    kept_orders = [get_order(ORDER_ARCHIVE_HORIZON_DAYS + 30, 'BBB', 'No'), get_order(ORDER_ARCHIVE_HORIZON_DAYS - 1), get_order(1, fulfilled='No')]
+    return old_fulfilled_orders, kept_orders
+
+def test_archive_orders_waits_for_minimum_number_of_orders():
+    old_fulfilled_orders, kept_orders = get_archive_test_orders(ORDER_ARCHIVE_MIN_ORDERS - 1)
+    backend, user = get_user(old_fulfilled_orders + kept_orders)
+
+    assert user.archive_orders(TODAY) == 0
+    assert ORDERS_ARCHIVE_WORKSHEET_NAME not in backend.spreadsheets[USER_SPREADSHEET_ID]
+    assert get_orders_sheet_values(backend) == [ORDERS_HEADER] + old_fulfilled_orders + kept_orders
+
+def test_archive_orders_moves_old_fulfilled_orders():
+    old_fulfilled_orders, kept_orders = get_archive_test_orders(ORDER_ARCHIVE_MIN_ORDERS)
+    backend, user = get_user(old_fulfilled_orders + kept_orders)
+
+    assert user.archive_orders(TODAY) == ORDER_ARCHIVE_MIN_ORDERS
+    assert get_orders_sheet_values(backend, ORDERS_ARCHIVE_WORKSHEET_NAME) == [ORDERS_HEADER] + [get_written_order(order) for order in old_fulfilled_orders]
+    assert get_orders_sheet_values(backend) == [ORDERS_HEADER] + [get_written_order(order) for order in kept_orders]
+    assert user.orders_data.shape[0] == len(kept_orders)
+
+    # The remaining orders are what the next write compares against, so an unchanged sheet is not written again.
+    number_of_writes = backend.api_calls['write']
+    user.update_orders_sheet()
+    assert backend.api_calls['write'] == number_of_writes
+
+def test_data_start_date_covers_longest_lookback(monkeypatch):
+    _, user = get_user([get_order(5)])
+
+    # The lump sum model needs a single bar, so the chart window is the longest lookback.
+    assert user.get_data_start_date('AAA', TODAY) == get_start_date_for_bars(TODAY, NUMBER_OF_STOCK_DAYS_IN_YEAR)
+
+    model = FutureLimitModel(100, max_limit_days=2 * NUMBER_OF_STOCK_DAYS_IN_YEAR)
+    monkeypatch.setattr(user, 'get_model_for_stock', lambda stock: model)
+    assert user.get_data_start_date('AAA', TODAY) == get_start_date_for_bars(TODAY, model.get_lookback_distance())
+
+    monkeypatch.setattr(user, 'get_model_for_stock', lambda stock: LinearRegressionModel(100, lookback_distance=10))
+    assert user.get_data_start_date('AAA', TODAY) == get_start_date_for_bars(TODAY, NUMBER_OF_STOCK_DAYS_IN_YEAR)
+
+def test_data_start_date_covers_oldest_open_order():
+    oldest_open_order_days_ago = 2 * NUMBER_OF_STOCK_DAYS_IN_YEAR
+    _, user = get_user([get_order(oldest_open_order_days_ago, fulfilled='No'), get_order(3 * NUMBER_OF_STOCK_DAYS_IN_YEAR), get_order(5, 'BBB', 'No')])
+
+    assert user.get_data_start_date('AAA', TODAY) == TODAY - timedelta(days=oldest_open_order_days_ago - 1)
+    assert user.get_data_start_date('BBB', TODAY) == get_start_date_for_bars(TODAY, NUMBER_OF_STOCK_DAYS_IN_YEAR)
+
+def test_tickers_to_fetch_include_open_orders_only():
+    _, user = get_user([get_order(5, 'CCC', 'No'), get_order(5, 'DDD'), get_order(4, 'AAA', 'No'), get_order(3, 'CCC', 'No')])
+
+    assert user.get_tickers_to_fetch() == ['AAA', 'BBB', 'CCC']
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from instrumentation import run_metrics, RUN_SCOPE
+from model import LinearDistributionModel, LumpLinearDistributionModel, LinearRegressionModel
+from model_state import ModelStateStore
+
+LOOKBACK_DISTANCE = 30
+
+def get_prices(number_of_bars = 120):
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2023-01-02', periods=number_of_bars)
+    return pd.DataFrame({'Open': 100 * np.exp(np.cumsum(rng.normal(0, 0.02, number_of_bars)))}, index=dates)
+
+def get_models():
+    return [
+        LinearDistributionModel(1000, lookback_distance=LOOKBACK_DISTANCE),
+        LumpLinearDistributionModel(1000, lookback_distance=LOOKBACK_DISTANCE),
+        LinearRegressionModel(1000, lookback_distance=LOOKBACK_DISTANCE),
+    ]
+
+def get_counter(counter_name):
+    return run_metrics.counters[RUN_SCOPE][counter_name]
+
+def test_analyze_state_matches_analyze_stock_on_full_window():
+    data = get_prices()
+    for model in get_models():
+        model.reset_state()
+        for ii, (date, open_price) in enumerate(zip(data.index, data['Open'])):
+            model.update_state(date.date(), open_price)
+            if ii + 1 >= LOOKBACK_DISTANCE:
+                assert model.analyze_state() == pytest.approx(model.analyze_stock(data.iloc[:ii + 1]), rel=1e-9)
+
+# Without FINZ_MODEL_STATE_FILE_PATH the store has no file: it still resumes within the process and saving does nothing.
+def test_store_without_state_file_resumes_in_memory(tmp_path, monkeypatch):
+    data = get_prices()
+    store = ModelStateStore(None)
+    run_metrics.reset()
+    for model in get_models():
+        store.resume(model, 'FAKE', data.iloc[:80])
+        assert model.analyze_state() == pytest.approx(model.analyze_stock(data.iloc[:80]), rel=1e-9)
+        store.resume(model, 'FAKE', data)
+        assert model.analyze_state() == pytest.approx(model.analyze_stock(data), rel=1e-9)
+    assert get_counter('model_state_rebuilds') == 3
+    assert get_counter('model_state_resumes') == 3
+
+    monkeypatch.chdir(tmp_path)
+    store.save()
+    assert os.listdir(tmp_path) == []
+
+def test_store_resumes_from_saved_state_file(tmp_path):
+    data = get_prices()
+    file_path = str(tmp_path / 'model_state.json')
+    store = ModelStateStore(file_path)
+    assert store.states == {}
+    for model in get_models():
+        store.resume(model, 'FAKE', data.iloc[:80])
+    store.save()
+
+    run_metrics.reset()
+    next_day_store = ModelStateStore(file_path)
+    for model in get_models():
+        next_day_store.resume(model, 'FAKE', data)
+        assert model.analyze_state() == pytest.approx(model.analyze_stock(data), rel=1e-9)
+    assert get_counter('model_state_resumes') == 3
+    assert get_counter('model_state_rebuilds') == 0
+
+def test_store_rebuilds_when_history_was_revised():
+    data = get_prices()
+    store = ModelStateStore(None)
+    model = LinearRegressionModel(1000, lookback_distance=LOOKBACK_DISTANCE)
+    store.resume(model, 'FAKE', data.iloc[:80])
+
+    revised_data = data.copy()
+    revised_data['Open'] = revised_data['Open'] / 2
+    run_metrics.reset()
+    store.resume(model, 'FAKE', revised_data)
+    assert get_counter('model_state_rebuilds') == 1
+    assert model.analyze_state() == pytest.approx(model.analyze_stock(revised_data), rel=1e-9)
@@ -0,0 +1,21 @@
+import pytest
+
+from run_load_test import run_load_test, FAKE_SHEETS_BACKEND, SQLITE_BACKEND
+
+NUMBER_OF_USERS = 8
+
+# A small run of the offline load test: every synthetic user is subscribed and valid, so each gets exactly one email.
+@pytest.mark.parametrize('backend_name', [FAKE_SHEETS_BACKEND, SQLITE_BACKEND])
+def test_notifier_emails_every_user(backend_name):
+    results = run_load_test(NUMBER_OF_USERS, number_of_tickers=10, backend_name=backend_name)
+    assert results['all_success']
+    assert results['emails_received'] == NUMBER_OF_USERS
+    assert results['counters']['users_processed'] == NUMBER_OF_USERS
+    assert results['counters'].get('users_failed', 0) == 0
+    assert results['counters']['emails_sent'] == NUMBER_OF_USERS
+
+def test_repeated_runs_in_one_process_email_every_user_again():
+    for _ in range(2):
+        results = run_load_test(NUMBER_OF_USERS, number_of_tickers=10)
+        assert results['all_success']
+        assert results['emails_received'] == NUMBER_OF_USERS
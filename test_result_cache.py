@@ -0,0 +1,33 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from model import LumpLinearDistributionModel, LinearRegressionModel
+from result_cache import get_model_hyperparameters, get_result_key
+from simulation import SimulationParameters
+
+def get_open_prices():
+    dates = pd.bdate_range('2020-01-01', periods=300)
+    return pd.DataFrame({'Open': np.linspace(100, 130, len(dates))}, index=dates)
+
+def get_key(model):
+    simulation_parameters = SimulationParameters().parse_from_inputs('VOO', 0, date(2020, 1, 1), date(2020, 12, 31), 0, 1000, 0, False, 14)
+    return get_result_key(simulation_parameters, model, 'fingerprint')
+
+def run_incrementally(model):
+    model.reset_state()
+    for ii, (day, open_price) in enumerate(get_open_prices()['Open'].items()):
+        model.update_state(day.date(), open_price)
+        if ii + 1 >= model.get_lookback_distance():
+            model.analyze_state()
+
+def test_key_does_not_change_when_model_is_run_incrementally():
+    for model in [LinearRegressionModel(1000, lookback_distance=20), LumpLinearDistributionModel(1000, lookback_distance=20)]:
+        key_before_run = get_key(model)
+        run_incrementally(model)
+        assert get_key(model) == key_before_run
+        assert not any(key.startswith('state_') for key in get_model_hyperparameters(model))
+
+def test_key_changes_with_hyperparameters():
+    assert get_key(LinearRegressionModel(1000, lookback_distance=20)) != get_key(LinearRegressionModel(1000, lookback_distance=30))
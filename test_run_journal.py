@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import notifier
+from database import User, database_spreadsheet_id
+from run_journal import RunJournal, SHEETS_UPDATED_STAGE, EMAIL_SENT_STAGE, SUCCESS_RECORDED_STAGE
+from stock_data import stock_data_store
+from storage import FakeSheetsBackend
+from utils import RenderedFigure, get_today
+
+EMAILS = ['first@finz.test', 'second@finz.test']
+
+def test_journal_is_replayed_from_disk(tmp_path):
+    journal = RunJournal('2026-10-19', str(tmp_path))
+    journal.record_sheets_updated(EMAILS[0], 'Buy 1 share.<br>', [RenderedFigure('Market for VOO', b'png bytes')])
+    journal.record_email_sent(EMAILS[0])
+    journal.record_sheets_updated(EMAILS[1], 'Buy 2 shares.<br>', [])
+    # A process that died while appending leaves a partial last line, which is not a finished stage.
+    with open(journal.file_path, 'a') as journal_file:
+        journal_file.write('{"email": "second@finz.test", "stage": "email_')
+
+    replayed_journal = RunJournal('2026-10-19', str(tmp_path))
+    assert replayed_journal.get_emails_with_stage(SHEETS_UPDATED_STAGE) == set(EMAILS)
+    assert replayed_journal.get_emails_with_stage(EMAIL_SENT_STAGE) == {EMAILS[0]}
+    message, figures = replayed_journal.get_delivery(EMAILS[0])
+    assert message == 'Buy 1 share.<br>'
+    assert [(figure.title, figure.png_bytes) for figure in figures] == [('Market for VOO', b'png bytes')]
+
+    assert RunJournal('2026-10-20', str(tmp_path)).get_emails_with_stage(SHEETS_UPDATED_STAGE) == set()
+
+def add_users(backend, today_date):
+    dates = pd.bdate_range(end=today_date, periods=300)
+    open_prices = 100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.01, len(dates))))
+    stock_data_store.stub_data('FAKE', today_date, pd.DataFrame({'Open': open_prices, 'Low': open_prices * 0.99, 'Close': open_prices}, index=dates))
+
+    database_values = [['Email', 'Spreadsheet ID', 'Subscribed?', 'Last Date Success', 'Num Current Day Failures']]
+    for email in EMAILS:
+        backend.add_worksheet(email, 'Stocks', [['Stock', 'Current Balance', 'Percentage to Input'], ['FAKE', '$1,000.00', '100%']])
+        backend.add_worksheet(email, 'Investment Schedule', [['Investment Frequency', 'Amount'], ['Weekly on Mondays', '$10.00']])
+        backend.add_worksheet(email, 'Orders', [['Date', 'Stock', 'Amount', 'Limit Price', 'Fulfilled?']])
+        database_values.append([email, email, 'Yes', '2020-01-01', 0])
+    backend.add_worksheet(database_spreadsheet_id, 'Database', database_values)
+
+# The first run sends every email but fails to record the success of the first user, so that user is retried.
+def test_retry_does_not_send_emails_again(tmp_path, monkeypatch):
+    _, today_date = get_today()
+    backend = FakeSheetsBackend()
+    add_users(backend, today_date)
+    sent_emails = []
+    monkeypatch.setattr(notifier, 'send_email', lambda email_content: sent_emails.append(email_content.to_list[0]))
+    monkeypatch.setattr(notifier, 'send_fail_email', lambda message: None)
+
+    set_last_date_success = User.set_last_date_success
+    def fail_for_first_user(user, date):
+        if user.email == EMAILS[0]:
+            raise Exception('Sheets API is down.')
+        set_last_date_success(user, date)
+    with monkeypatch.context() as first_run:
+        first_run.setattr(User, 'set_last_date_success', fail_for_first_user)
+        with pytest.raises(Exception):
+            notifier.main('Test.', 'Test context.', backend=backend, run_journal=RunJournal(today_date, str(tmp_path)))
+    assert sorted(sent_emails) == sorted(EMAILS)
+    number_of_orders = len(backend.open_worksheet(EMAILS[0], 'Orders').get_all_values())
+    assert number_of_orders == 2
+
+    # The retry is a new process: it only has the journal on disk.
+    notifier.main('Test.', 'Test context.', backend=backend, run_journal=RunJournal(today_date, str(tmp_path)))
+    assert sorted(sent_emails) == sorted(EMAILS)
+    assert len(backend.open_worksheet(EMAILS[0], 'Orders').get_all_values()) == number_of_orders
+    database_values = backend.open_worksheet(database_spreadsheet_id, 'Database').get_all_values()
+    assert [row[3] for row in database_values[1:]] == [str(today_date)] * len(EMAILS)
+    assert RunJournal(today_date, str(tmp_path)).get_emails_with_stage(SUCCESS_RECORDED_STAGE) == set(EMAILS)
@@ -0,0 +1,72 @@
+from datetime import date
+
+from database import STOCKS_SCHEMA, INVESTMENT_SCHEDULE_SCHEMA, ORDERS_SCHEMA, InvestmentInputSchedules
+from sheet_parsing import parse_sheet, get_sheet_frame
+
+# The messages User.populate_user_data gave before the sheets were parsed through schemas.
+ERROR_PREFIX = 'Error loading user values from spreadsheet: '
+STOCKS_MISSING_COLUMNS = f'{ERROR_PREFIX}Could not find column name "Stock", "Current Balance", or "Percentage to Input".<br>'
+INVESTMENT_SCHEDULE_MISSING_COLUMNS = f'{ERROR_PREFIX}Could not find column name "Investment Frequency" or "Amount".<br>'
+ORDERS_MISSING_COLUMNS = f'{ERROR_PREFIX}Could not find column name "Date", "Stock", "Amount", "Limit Price", or "Fulfilled?".<br>'
+BALANCE_FORMAT = f'{ERROR_PREFIX}Some "Current Balance" does not start with a "$".<br>'
+PERCENTAGE_FORMAT = f'{ERROR_PREFIX}Some "Percentage to Input" does not end with a "%".<br>'
+BALANCE_OR_PERCENTAGE_INVALID = f'{ERROR_PREFIX}"Balance" or "Percentage to Input" is not a valid for some rows.<br>'
+NEGATIVE_BALANCE = f'{ERROR_PREFIX}Balance less than 0 for some stock.<br>'
+DUPLICATE_TICKERS = f'{ERROR_PREFIX}Some tickers appears multiple times in the "Stock" sheet. This will lead to undefined behavior.<br>'
+AMOUNT_FORMAT = f'{ERROR_PREFIX}Some "Amount" does not start with a "$".<br>'
+AMOUNT_INVALID = f'{ERROR_PREFIX}"Amount" is not a valid for some rows.<br>'
+FREQUENCY_INVALID = f'{ERROR_PREFIX}Some "Investment Frequency" is valid from possibilities (Weekly on Mondays, Weekly on Tuesdays, Weekly on Wednesdays, Weekly on Thursdays, Weekly on Fridays).<br>'
+DATE_INVALID = f'{ERROR_PREFIX}"Date" is not a valid for some rows. Ensure format is "YYYY-MM-DD".<br>'
+ORDER_AMOUNT_OR_LIMIT_PRICE_INVALID = f'{ERROR_PREFIX}"Amount" or "Limit Price" is not a valid for some rows.<br>'
+LIMIT_PRICE_FORMAT = f'{ERROR_PREFIX}Some "Limit Price" does not start with a "$".<br>'
+
+STOCKS_HEADER = ['Stock', 'Current Balance', 'Percentage to Input']
+INVESTMENT_SCHEDULE_HEADER = ['Investment Frequency', 'Amount']
+ORDERS_HEADER = ['Date', 'Stock', 'Amount', 'Limit Price', 'Fulfilled?']
+
+def get_errors(values, schema):
+    return parse_sheet(get_sheet_frame(values), schema)[1]
+
+def test_valid_sheets_parse_without_errors():
+    stock_data, errors = parse_sheet(get_sheet_frame([STOCKS_HEADER, ['VOO', '$1,234.50', '60%'], ['SCHD', '$0.00', '40%'], ['', '', '']]), STOCKS_SCHEMA)
+    assert errors == []
+    assert stock_data['Stock'].tolist() == ['VOO', 'SCHD']
+    assert stock_data['Current Balance'].tolist() == [1234.5, 0.0]
+    assert stock_data['Percentage to Input'].tolist() == [0.6, 0.4]
+
+    investment_schedule_data, errors = parse_sheet(get_sheet_frame([INVESTMENT_SCHEDULE_HEADER, ['Weekly on Fridays', '$25.00']]), INVESTMENT_SCHEDULE_SCHEMA)
+    assert errors == []
+    assert investment_schedule_data['Investment Frequency'].tolist() == [InvestmentInputSchedules.FRIDAYS]
+    assert investment_schedule_data['Amount'].tolist() == [25.0]
+
+    orders_data, errors = parse_sheet(get_sheet_frame([ORDERS_HEADER, ['2024-01-05', 'VOO', '2', '$400.10', 'No']]), ORDERS_SCHEMA)
+    assert errors == []
+    assert orders_data['Date'].tolist() == [date(2024, 1, 5)]
+    assert orders_data['Amount'].tolist() == [2.0]
+    assert orders_data['Limit Price'].tolist() == [400.1]
+
+def test_missing_columns():
+    assert get_errors([['Stock', 'Current Balance'], ['VOO', '$1.00']], STOCKS_SCHEMA) == [STOCKS_MISSING_COLUMNS]
+    assert get_errors([['Investment Frequency'], ['Weekly on Fridays']], INVESTMENT_SCHEDULE_SCHEMA) == [INVESTMENT_SCHEDULE_MISSING_COLUMNS]
+    assert get_errors([['Date', 'Stock', 'Amount', 'Limit Price'], ['2024-01-05', 'VOO', '2', '$400.10']], ORDERS_SCHEMA) == [ORDERS_MISSING_COLUMNS]
+
+def test_non_numeric_amounts():
+    assert get_errors([INVESTMENT_SCHEDULE_HEADER, ['Weekly on Fridays', '$twenty']], INVESTMENT_SCHEDULE_SCHEMA) == [AMOUNT_INVALID]
+    assert get_errors([INVESTMENT_SCHEDULE_HEADER, ['Weekly on Fridays', '20']], INVESTMENT_SCHEDULE_SCHEMA) == [AMOUNT_FORMAT]
+    assert get_errors([ORDERS_HEADER, ['2024-01-05', 'VOO', 'two', '$400.10', 'No']], ORDERS_SCHEMA) == [ORDER_AMOUNT_OR_LIMIT_PRICE_INVALID]
+    assert get_errors([ORDERS_HEADER, ['2024-01-05', 'VOO', '2', '400.10', 'No']], ORDERS_SCHEMA) == [LIMIT_PRICE_FORMAT]
+    assert get_errors([STOCKS_HEADER, ['VOO', '$lots', '100%']], STOCKS_SCHEMA) == [BALANCE_OR_PERCENTAGE_INVALID]
+
+def test_bad_dates():
+    for bad_date in ['2024/01/05', '05-01-2024', '2024-13-01', 'yesterday']:
+        assert get_errors([ORDERS_HEADER, ['2024-01-05', 'VOO', '2', '$400.10', 'No'], [bad_date, 'VOO', '2', '$400.10', 'No']], ORDERS_SCHEMA) == [DATE_INVALID]
+
+def test_invalid_values():
+    assert get_errors([INVESTMENT_SCHEDULE_HEADER, ['Every day', '$20.00']], INVESTMENT_SCHEDULE_SCHEMA) == [FREQUENCY_INVALID]
+    assert get_errors([STOCKS_HEADER, ['VOO', '$-5.00', '100%']], STOCKS_SCHEMA) == [NEGATIVE_BALANCE]
+    assert get_errors([STOCKS_HEADER, ['VOO', '$5.00', '50%'], ['VOO', '$5.00', '50%']], STOCKS_SCHEMA) == [DUPLICATE_TICKERS]
+
+# All problems of a sheet are reported at once, each message once.
+def test_every_error_is_reported_once():
+    errors = get_errors([STOCKS_HEADER, ['VOO', '5.00', '50'], ['SCHD', '4.00', '$-5.00'], ['VOO', '$-1.00', '50%']], STOCKS_SCHEMA)
+    assert errors == [DUPLICATE_TICKERS, BALANCE_FORMAT, NEGATIVE_BALANCE, PERCENTAGE_FORMAT]
@@ -0,0 +1,54 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from model import LumpSumModel, RandomModel, LumpLinearDistributionModel
+from portfolio_simulation import PortfolioSimulationParameters, PortfolioSimulator
+from simulation import SimulationParameters, Simulator, CycleSweepSimulator
+
+START_DATE = date(2021, 1, 4)
+END_DATE = date(2021, 6, 30)
+# (investment_input_cycle_days, start_day_of_cycle). The last two cycles are longer than the simulated range: one deposits
+# once on day 10, the other never deposits (so both simulators have no metrics).
+CYCLES = [(1, 0), (7, 3), (14, 0), (30, 29), (400, 10), (400, 250)]
+
+def get_prices():
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2020-01-01', '2021-07-30')
+    open_prices = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.01, len(dates))))
+    return pd.DataFrame({'Open': open_prices, 'Close': open_prices * rng.uniform(0.99, 1.01, len(dates))}, index=dates)
+
+def get_simulation_parameters(fractional_shares, investment_input_cycle_days, start_day_of_cycle):
+    return SimulationParameters().parse_from_inputs('FAKE', 7, START_DATE, END_DATE, start_day_of_cycle, 5000, 100, fractional_shares, investment_input_cycle_days)
+
+def get_models():
+    return [LumpSumModel(20), RandomModel(0.3), LumpLinearDistributionModel(40, lookback_distance=20)]
+
+def test_cycle_sweep_matches_simulator_per_cycle():
+    data = get_prices()
+    for fractional_shares in [False, True]:
+        simulation_parameters_list = [get_simulation_parameters(fractional_shares, *cycle) for cycle in CYCLES]
+        for sweep_model, model in zip(get_models(), get_models()):
+            sweep = CycleSweepSimulator(simulation_parameters_list, data=data)
+            sweep.simulate(sweep_model)
+            for simulation_parameters, sweep_metrics in zip(simulation_parameters_list, sweep.metrics()):
+                simulator = Simulator(simulation_parameters, data=data)
+                simulator.simulate(model)
+                assert sweep_metrics == simulator.metrics()
+            assert sweep.metrics()[-2] != {} and sweep.metrics()[-1] == {}
+
+# Purchase prices of different tickers are not averaged together, only per stock.
+def test_portfolio_reports_average_price_per_stock():
+    data = {'CHEAP': get_prices() / 10, 'DEAR': get_prices()}
+    simulation_parameters = PortfolioSimulationParameters().parse_from_inputs(['CHEAP', 'DEAR'], [0.5, 0.5], 7, START_DATE, END_DATE, 0, 5000, 100, True, 14)
+    simulator = PortfolioSimulator(simulation_parameters, data=data)
+    simulator.simulate({'CHEAP': LumpSumModel(20), 'DEAR': LumpSumModel(20)})
+
+    assert simulator.metrics() != {} and 'average_price' not in simulator.metrics()
+    per_stock_metrics = simulator.per_stock_metrics()
+    for stock in ['CHEAP', 'DEAR']:
+        purchases = simulator.purchases_per_stock[stock]
+        expected_average_price = sum(purchase[0] * purchase[1] for purchase in purchases) / sum(purchase[0] for purchase in purchases)
+        assert per_stock_metrics[stock]['average_price'] == expected_average_price
+    assert per_stock_metrics['DEAR']['average_price'] > per_stock_metrics['CHEAP']['average_price']
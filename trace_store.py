@@ -0,0 +1,93 @@
+import os
+import json
+import glob
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+TRACE_CHUNK_SIZE = 500
+TRACE_COMPRESSION = 'zstd'
+TRACE_FILE_PATTERN = '{prefix}_traces_{chunk_index:05d}.arrow'
+TRACE_FILE_GLOB = '{prefix}_traces_*.arrow'
+# Series with one value per simulated day.
+DAILY_TRACE_COLUMNS = ['cash', 'total_value', 'stock_value', 'purchase_shares', 'purchase_price']
+TRACE_SCHEMA = pa.schema([
+    ('validation_row', pa.int64()),
+    ('model', pa.string()),
+    ('date', pa.list_(pa.date32())),
+    *[(column, pa.list_(pa.float64())) for column in DAILY_TRACE_COLUMNS],
+    # Only recorded on days the market was open, so it is shorter than the daily series.
+    ('desired_dollars_to_buy', pa.list_(pa.float64())),
+])
+
+# Buffers simulation traces and writes every chunk_size of them as one compressed Arrow IPC file. Each (validation row, model)
+# trace is its own record batch, so a reader only decompresses the traces it asks for.
+class TraceRecorder:
+    def __init__(self, directory, prefix = 'validation', chunk_size: int = TRACE_CHUNK_SIZE):
+        self.directory = directory
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.traces = []
+        os.makedirs(directory, exist_ok=True)
+        self.chunk_index = len(glob.glob(os.path.join(directory, TRACE_FILE_GLOB.format(prefix=prefix))))
+
+    def record(self, validation_row, model_name, trace: dict) -> None:
+        self.traces.append({'validation_row': validation_row, 'model': model_name, **trace})
+        if len(self.traces) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.traces) == 0:
+            return
+        # The keys are repeated in the file metadata so that a reader can index the file without decompressing the batch.
+        schema = TRACE_SCHEMA.with_metadata({'keys': json.dumps([[trace['validation_row'], trace['model']] for trace in self.traces])})
+        file_path = os.path.join(self.directory, TRACE_FILE_PATTERN.format(prefix=self.prefix, chunk_index=self.chunk_index))
+        with pa.OSFile(file_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression=TRACE_COMPRESSION)) as writer:
+                for trace in self.traces:
+                    writer.write_batch(pa.RecordBatch.from_pylist([trace], schema=TRACE_SCHEMA))
+        self.chunk_index += 1
+        self.traces = []
+
+# Lazy access to recorded traces. Files are memory-mapped and indexed from their metadata; a trace's record batch is only
+# read and decompressed when that trace is requested.
+class TraceReader:
+    def __init__(self, directory, prefix = 'validation'):
+        self.readers = []
+        keys = []
+        for file_path in sorted(glob.glob(os.path.join(directory, TRACE_FILE_GLOB.format(prefix=prefix)))):
+            reader = pa.ipc.open_file(pa.memory_map(file_path, 'r'))
+            for position, (validation_row, model_name) in enumerate(json.loads(reader.schema.metadata[b'keys'])):
+                keys.append((validation_row, model_name, len(self.readers), position))
+            self.readers.append(reader)
+        self.index = pd.DataFrame(keys, columns=['validation_row', 'model', 'reader_index', 'position'])
+        # A row that was traced again (e.g. after a rerun) is served from the latest file.
+        self.index = self.index.drop_duplicates(['validation_row', 'model'], keep='last').set_index(['validation_row', 'model'])
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self) -> pd.DataFrame:
+        return self.index.index.to_frame(index=False)
+
+    def locate(self, validation_row, model_name):
+        reader_index, position = self.index.loc[(validation_row, model_name)]
+        return self.readers[reader_index].get_batch(position)
+
+    # Daily series of one run indexed by date.
+    def get(self, validation_row, model_name) -> pd.DataFrame:
+        batch = self.locate(validation_row, model_name)
+        return pd.DataFrame(
+            {column: batch.column(column)[0].values.to_numpy(zero_copy_only=False) for column in DAILY_TRACE_COLUMNS},
+            index=pd.DatetimeIndex(batch.column('date')[0].values.to_numpy(zero_copy_only=False), name='date'))
+
+    def get_desired_dollars_to_buy(self, validation_row, model_name) -> np.ndarray:
+        batch = self.locate(validation_row, model_name)
+        return batch.column('desired_dollars_to_buy')[0].values.to_numpy(zero_copy_only=False)
+
+    # Yields (validation row, model, daily series) one trace at a time, optionally only for some models.
+    def iter_traces(self, model_names = None):
+        for validation_row, model_name in self.index.index:
+            if model_names is None or model_name in model_names:
+                yield validation_row, model_name, self.get(validation_row, model_name)
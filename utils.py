@@ -4,11 +4,23 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 import io
+import os
+import math
+import threading
 from datetime import datetime, timedelta
 import pytz
 
+from instrumentation import run_metrics
 from hidden import from_email, from_password, fail_email_address
 
+# Up to about 10 market holidays a year, so a few percent more calendar days than weekdays are requested.
+TRADING_DAY_HOLIDAY_MARGIN = 1.05
+
+SMTP_HOST = os.environ.get('FINZ_SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('FINZ_SMTP_PORT', 465))
+# Plain SMTP (no SSL) is only meant for local sinks such as the one in run_load_test.py.
+SMTP_USE_SSL = os.environ.get('FINZ_SMTP_USE_SSL', 'Yes') == 'Yes'
+
 class EmailContent:
     def __init__(self, subject, message, figures, to_list):
         self.subject = subject
@@ -16,6 +28,18 @@ class EmailContent:
         self.figures = figures
         self.to_list = to_list
 
+# Figure that was already rendered to png, so a journaled email can be re-sent without the user data that produced it.
+class RenderedFigure:
+    def __init__(self, title, png_bytes):
+        self.title = title
+        self.png_bytes = png_bytes
+
+    @staticmethod
+    def from_figure(figure):
+        figure_file = io.BytesIO()
+        figure.savefig(figure_file, format='png')
+        return RenderedFigure(figure.axes[0].get_title(), figure_file.getvalue())
+
 def try_cast(obj, cast):
     try:
         return cast(obj)
@@ -25,8 +49,29 @@ def try_cast(obj, cast):
 def average(lst):
     return 0 if len(lst) == 0 else sum(lst) / len(lst)
 
-def get_data_for_stock(stock, end_date):
-    return yf.download(stock, end=end_date + timedelta(days=1), progress=False)
+# yf.download collects its results in a module global that every call resets, so concurrent downloads (e.g. from the
+# notifier's fetch workers) can return another ticker's data or fail. Every download holds this lock.
+yfinance_download_lock = threading.Lock()
+
+# Without start_date the full history is downloaded.
+def get_data_for_stock(stock, end_date, start_date = None):
+    run_metrics.increment('network_calls')
+    run_metrics.increment('price_downloads')
+    with yfinance_download_lock, run_metrics.stage('price_download'):
+        data = yf.download(stock, start=start_date, end=end_date + timedelta(days=1), progress=False)
+    run_metrics.increment('price_bars_downloaded', len(data.index))
+    return data
+
+# Calendar date far enough before end_date to include number_of_bars trading days (weekends and a margin for holidays).
+def get_start_date_for_bars(end_date, number_of_bars):
+    return end_date - timedelta(days=math.ceil(number_of_bars * 7 / 5 * TRADING_DAY_HOLIDAY_MARGIN) + 7)
+
+# Bars of the current session from start_datetime on, used to track limit orders during market hours.
+def get_intraday_data_for_stock(stock, start_datetime, interval):
+    run_metrics.increment('network_calls')
+    run_metrics.increment('intraday_downloads')
+    with yfinance_download_lock, run_metrics.stage('intraday_download'):
+        return yf.download(stock, start=start_datetime, interval=interval, progress=False)
 
 def get_today():
     today_datetime = datetime.now().astimezone(pytz.timezone('US/Eastern'))
@@ -37,9 +82,6 @@ def send_fail_email(reason):
     send_email(EmailContent('Stock Notifier Failed', f'Please check stock notifier for {reason}.', [], [fail_email_address]))
 
 def send_email(email_content):
-    server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-    server.login(from_email, from_password)
-    
     subject = email_content.subject
     message = email_content.message
     figures = email_content.figures
@@ -49,22 +91,30 @@ def send_email(email_content):
     email_msg['From'] = from_email
     email_msg['Subject'] = subject
     email_msg.attach(MIMEText(message, "html"))
-    for figure in figures:
-        figure_file = io.BytesIO()
-        figure.savefig(figure_file, format='png')
-        figure_file.seek(0)
-        img = MIMEImage(figure_file.read())
-        img.add_header("Content-ID", "<{}>".format(figure.axes[0].get_title()))
-        email_msg.attach(img)
-    for recipient in to_list:
-        email_msg['To'] = recipient
-        server.sendmail(from_email, recipient, email_msg.as_string())
-    server.quit()
+    with run_metrics.stage('figure_rendering'):
+        for figure in figures:
+            if not isinstance(figure, RenderedFigure):
+                figure = RenderedFigure.from_figure(figure)
+            img = MIMEImage(figure.png_bytes)
+            img.add_header("Content-ID", "<{}>".format(figure.title))
+            email_msg.attach(img)
+
+    run_metrics.increment('network_calls')
+    run_metrics.increment('emails_sent', len(to_list))
+    with run_metrics.stage('smtp_send'):
+        server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) if SMTP_USE_SSL else smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+        server.login(from_email, from_password)
+        for recipient in to_list:
+            email_msg['To'] = recipient
+            server.sendmail(from_email, recipient, email_msg.as_string())
+        server.quit()
 
 def ticker_exists(ticker_string: str) -> bool:
-    info = yf.Ticker(ticker_string).history(
-        period='14d',
-        interval='1d')
+    run_metrics.increment('network_calls')
+    with run_metrics.stage('ticker_validation'):
+        info = yf.Ticker(ticker_string).history(
+            period='14d',
+            interval='1d')
     return len(info) > 0
         
 
@@ -0,0 +1,215 @@
+import os
+import json
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import pytz
+
+import numpy as np
+import pandas as pd
+
+from simulation import Simulator, SimulationParameters, EXAMPLE_STAT_KEY
+from stock_data import stock_data_store
+from generate_validation_set import validation_stocks
+from model import BaseModel, LumpSumModel, ConstantDollarRandomModel, LumpLinearDistributionModel, LinearDistributionModel, FutureLimitModel, NUMBER_OF_STOCK_DAYS_IN_YEAR
+
+RESULT_PATH = 'validation_results/'
+WALK_FORWARD_RESULT_FILE_PATH = RESULT_PATH + 'walk_forward.csv'
+TRAIN_DAYS = 365 * 3
+TEST_DAYS = 365
+WALK_FORWARD_WORKERS = os.cpu_count()
+
+class WalkForwardParameters:
+    def __init__(self, train_days: int = TRAIN_DAYS, test_days: int = TEST_DAYS, step_days: int = None, random_seed: int = 0, yearly_amount_input: float = 10000, starting_account_balance: float = 0, fractional_shares: bool = True, investment_input_cycle_days: int = 14, start_day_of_cycle: int = 0):
+        self.train_days = train_days
+        self.test_days = test_days
+        self.step_days = test_days if step_days is None else step_days
+        self.random_seed = random_seed
+        self.yearly_amount_input = yearly_amount_input
+        self.starting_account_balance = starting_account_balance
+        self.fractional_shares = fractional_shares
+        self.investment_input_cycle_days = investment_input_cycle_days
+        self.start_day_of_cycle = start_day_of_cycle
+
+        assert self.train_days > 0 and self.test_days > 0 and self.step_days > 0
+
+    def get_simulation_parameters(self, stock, start_date, end_date) -> SimulationParameters:
+        return SimulationParameters().parse_from_inputs(stock, self.random_seed, start_date, end_date, self.start_day_of_cycle, self.yearly_amount_input, self.starting_account_balance, self.fractional_shares, self.investment_input_cycle_days)
+
+# One model family and the hyperparameters the walk forward search picks from on every training window.
+class ModelSearchSpace:
+    def __init__(self, name: str, model_class, hyperparameter_grid: dict, fixed_hyperparameters: dict = None):
+        self.name = name
+        self.model_class = model_class
+        self.hyperparameter_grid = hyperparameter_grid
+        self.fixed_hyperparameters = {} if fixed_hyperparameters is None else fixed_hyperparameters
+
+    def get_candidates(self) -> list:
+        names = list(self.hyperparameter_grid.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[self.hyperparameter_grid[name] for name in names])]
+
+    def create_model(self, yearly_amount_input: float, hyperparameters: dict) -> BaseModel:
+        return self.model_class(yearly_amount_input, **self.fixed_hyperparameters, **hyperparameters)
+
+def get_candidate_key(search_space: ModelSearchSpace, hyperparameters: dict) -> str:
+    return f'{search_space.name}|{json.dumps(hyperparameters, sort_keys=True)}'
+
+# Serves buy rates computed ahead of time, so a Simulator can replay a model on any window without running it again.
+# Simulator hands models data.loc[:current_date] of the frame the buy rates were computed on, so the number of bars it
+# passes is the position of the current bar.
+class PrecomputedSignalModel(BaseModel):
+    def __init__(self, name: str, buy_rates: np.ndarray):
+        self.name = name
+        self.buy_rates = buy_rates
+
+    def analyze_stock(self, data) -> float:
+        return self.buy_rates[data.shape[0] - 1]
+
+# Number of leading bars that are only used as model history, so every candidate has a full lookback on the first simulated day.
+def get_warmup_bars(search_spaces: list, parameters: WalkForwardParameters) -> int:
+    lookbacks = [NUMBER_OF_STOCK_DAYS_IN_YEAR]
+    for search_space in search_spaces:
+        for hyperparameters in search_space.get_candidates():
+            lookback = search_space.create_model(parameters.yearly_amount_input, hyperparameters).get_lookback_distance()
+            lookbacks.append(NUMBER_OF_STOCK_DAYS_IN_YEAR if lookback is None else lookback)
+    return max(lookbacks)
+
+# Buy rate of the model on every bar from warmup_bars on, indexed by bar position (NaN during the warmup).
+# Models with incremental state are fed one bar at a time instead of re-slicing the history.
+def compute_buy_rates(model: BaseModel, data, warmup_bars: int) -> np.ndarray:
+    buy_rates = np.full(data.shape[0], np.nan)
+    if model.supports_incremental_state():
+        model.reset_state()
+        for ii, (date, open_price) in enumerate(zip(data.index, data['Open'])):
+            model.update_state(date.date(), open_price)
+            if ii >= warmup_bars:
+                buy_rates[ii] = model.analyze_state()
+    else:
+        for ii in range(warmup_bars, data.shape[0]):
+            buy_rates[ii] = model.analyze_stock(data.iloc[:ii + 1])
+    return buy_rates
+
+# Price only features (the buy rate of every candidate on every bar) of one ticker, computed once and reused by all of its folds.
+def compute_ticker_features(stock, data, search_spaces: list, parameters: WalkForwardParameters, warmup_bars: int) -> dict:
+    features = {}
+    for search_space in search_spaces:
+        for hyperparameters in search_space.get_candidates():
+            model = search_space.create_model(parameters.yearly_amount_input, hyperparameters)
+            features[get_candidate_key(search_space, hyperparameters)] = compute_buy_rates(model, data, warmup_bars)
+    return features
+
+# (train start, train end, test start, test end) windows rolled forward by step_days over the ticker's history.
+def get_folds(data, parameters: WalkForwardParameters, warmup_bars: int) -> list:
+    if data.shape[0] <= warmup_bars:
+        return []
+    first_date = data.index[warmup_bars].date()
+    last_date = data.index[-1].date()
+    folds = []
+    train_start_date = first_date
+    while True:
+        train_end_date = train_start_date + timedelta(days=parameters.train_days - 1)
+        test_start_date = train_end_date + timedelta(days=1)
+        test_end_date = test_start_date + timedelta(days=parameters.test_days - 1)
+        if test_end_date > last_date:
+            return folds
+        folds.append((train_start_date, train_end_date, test_start_date, test_end_date))
+        train_start_date += timedelta(days=parameters.step_days)
+
+def simulate_with_signal(stock, data, buy_rates: np.ndarray, name: str, parameters: WalkForwardParameters, start_date, end_date) -> dict:
+    simulator = Simulator(parameters.get_simulation_parameters(stock, start_date, end_date), data=data)
+    simulator.simulate(PrecomputedSignalModel(name, buy_rates))
+    return simulator.metrics()
+
+def get_score(metrics: dict) -> float:
+    return metrics.get(EXAMPLE_STAT_KEY, -np.inf)
+
+# Picks the best hyperparameters of each search space on the training window and reports how they do on the following test window.
+def run_fold(stock, data, features: dict, search_spaces: list, parameters: WalkForwardParameters, fold) -> list:
+    train_start_date, train_end_date, test_start_date, test_end_date = fold
+    rows = []
+    for search_space in search_spaces:
+        best_hyperparameters, best_score = None, -np.inf
+        for hyperparameters in search_space.get_candidates():
+            candidate_key = get_candidate_key(search_space, hyperparameters)
+            score = get_score(simulate_with_signal(stock, data, features[candidate_key], candidate_key, parameters, train_start_date, train_end_date))
+            if best_hyperparameters is None or score > best_score:
+                best_hyperparameters, best_score = hyperparameters, score
+
+        candidate_key = get_candidate_key(search_space, best_hyperparameters)
+        test_metrics = simulate_with_signal(stock, data, features[candidate_key], candidate_key, parameters, test_start_date, test_end_date)
+        rows.append({
+            'stock': stock,
+            'model': search_space.name,
+            'train_start_date': train_start_date,
+            'train_end_date': train_end_date,
+            'test_start_date': test_start_date,
+            'test_end_date': test_end_date,
+            'hyperparameters': json.dumps(best_hyperparameters, sort_keys=True),
+            f'train_{EXAMPLE_STAT_KEY}': best_score,
+            **{f'test_{stat}': value for stat, value in test_metrics.items()},
+        })
+    return rows
+
+# Everything the folds of a run need, set once per worker process by the fold pool's initializer so that a fold task
+# only carries its ticker and window: {stock: (data, features)}, the search spaces and the parameters.
+worker_state = {}
+
+def set_worker_state(tickers: dict, search_spaces: list, parameters: WalkForwardParameters) -> None:
+    worker_state['tickers'] = tickers
+    worker_state['search_spaces'] = search_spaces
+    worker_state['parameters'] = parameters
+
+def run_worker_fold(stock, fold) -> list:
+    data, features = worker_state['tickers'][stock]
+    return run_fold(stock, data, features, worker_state['search_spaces'], worker_state['parameters'], fold)
+
+class WalkForward():
+    def __init__(self, search_spaces: list, parameters: WalkForwardParameters = None, number_of_workers: int = WALK_FORWARD_WORKERS):
+        search_space_names = [search_space.name for search_space in search_spaces]
+        assert len(search_space_names) == len(set(search_space_names)), 'Duplicate search space names. Results would be mixed.'
+        self.search_spaces = search_spaces
+        self.parameters = WalkForwardParameters() if parameters is None else parameters
+        self.number_of_workers = number_of_workers
+        self.warmup_bars = get_warmup_bars(search_spaces, self.parameters)
+        self.downloaded_data = {}
+
+    def load_data(self, stock):
+        if stock not in self.downloaded_data:
+            today_datetime = datetime.now().astimezone(pytz.timezone('US/Eastern'))
+            self.downloaded_data[stock] = stock_data_store.get(stock, today_datetime)
+        return self.downloaded_data[stock]
+
+    # Features are computed once per ticker (in parallel over tickers), then all folds of all tickers run in parallel.
+    # Each worker of the fold pool receives the price data and feature arrays once, not once per fold.
+    def run(self, stocks: list) -> pd.DataFrame:
+        stocks = list(dict.fromkeys(stocks))
+        for stock in stocks:
+            self.load_data(stock)
+
+        with ProcessPoolExecutor(max_workers=self.number_of_workers) as executor:
+            feature_futures = {stock: executor.submit(compute_ticker_features, stock, self.downloaded_data[stock], self.search_spaces, self.parameters, self.warmup_bars) for stock in stocks}
+            tickers = {stock: (self.downloaded_data[stock], future.result()) for stock, future in feature_futures.items()}
+
+        with ProcessPoolExecutor(max_workers=self.number_of_workers, initializer=set_worker_state, initargs=(tickers, self.search_spaces, self.parameters)) as executor:
+            fold_futures = [executor.submit(run_worker_fold, stock, fold) for stock in stocks for fold in get_folds(self.downloaded_data[stock], self.parameters, self.warmup_bars)]
+            rows = [row for future in fold_futures for row in future.result()]
+        return pd.DataFrame(rows)
+
+    # Mean out of sample result per model family, the number used to compare families.
+    @staticmethod
+    def summarize(results: pd.DataFrame) -> pd.DataFrame:
+        return results.groupby('model')[[f'train_{EXAMPLE_STAT_KEY}', f'test_{EXAMPLE_STAT_KEY}']].agg(['mean', 'std', 'count'])
+
+if __name__ == '__main__':
+    search_spaces = [
+        ModelSearchSpace('lump_sum_model', LumpSumModel, {}),
+        ModelSearchSpace('constant_dollar_random_model', ConstantDollarRandomModel, {'spending_cycle': [NUMBER_OF_STOCK_DAYS_IN_YEAR]}),
+        ModelSearchSpace('linear_distribution_model', LinearDistributionModel, {'lookback_distance': [5, 20, NUMBER_OF_STOCK_DAYS_IN_YEAR]}),
+        ModelSearchSpace('lump_linear_distribution_model', LumpLinearDistributionModel, {'range_buy_percentage': [0.5, 0.7, 0.85], 'lookback_distance': [5, 20, 60]}),
+        ModelSearchSpace('future_limit_model', FutureLimitModel, {'price_decrease': [0.99, 0.995, 0.997], 'max_limit_days': [5, 10, 20]}),
+    ]
+    walk_forward = WalkForward(search_spaces)
+    results = walk_forward.run(validation_stocks)
+    os.makedirs(RESULT_PATH, exist_ok=True)
+    results.to_csv(WALK_FORWARD_RESULT_FILE_PATH, index=False)
+    print(WalkForward.summarize(results))